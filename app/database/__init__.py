@@ -1,3 +1,7 @@
-from app.database.models import init_db, Session, User, Driver, Order, Review, Earning
+from app.database.models import init_db, engine, Session, User, Driver, Order, Review, Earning, Admin, OrderEvent
+from app.database.instrumentation import instrument_engine
+from app.database.session_scope import session_scope
 
-__all__ = ['init_db', 'Session', 'User', 'Driver', 'Order', 'Review', 'Earning']
\ No newline at end of file
+instrument_engine(engine)
+
+__all__ = ['init_db', 'Session', 'User', 'Driver', 'Order', 'Review', 'Earning', 'Admin', 'OrderEvent', 'session_scope']
\ No newline at end of file
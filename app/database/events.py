@@ -0,0 +1,82 @@
+"""
+Журнал событий заказов (append-only).
+
+Каждый переход заказа (создание, цена, встречное предложение, принятие,
+назначение водителя, прибытие, завершение, отмена, оценка) добавляет строку
+в таблицу order_events в той же транзакции, что и изменение orders:
+taxi_bot.py - через курсор sqlite3 (log_order_event), обработчики
+app/handlers - через сессию SQLAlchemy (add_order_event).
+"""
+import json
+import time
+
+from app.database.models import OrderEvent
+
+# Типы событий
+EVENT_CREATED = 'CREATED'
+EVENT_PRICE_OFFERED = 'PRICE_OFFERED'
+EVENT_COUNTER_OFFERED = 'COUNTER_OFFERED'
+EVENT_ACCEPTED = 'ACCEPTED'
+EVENT_DECLINED = 'DECLINED'
+EVENT_ASSIGNED = 'ASSIGNED'
+EVENT_ARRIVED = 'ARRIVED'
+EVENT_COMPLETED = 'COMPLETED'
+EVENT_CANCELLED = 'CANCELLED'
+EVENT_RATED = 'RATED'
+
+_INSERT_EVENT = '''
+    INSERT INTO order_events (order_id, event_type, old_status, new_status, actor_id, payload, created_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _dump_payload(payload):
+    if not payload:
+        return None
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def log_order_event(cursor, order_id, event_type, old_status=None, new_status=None, actor_id=None, **payload):
+    """
+    Записывает событие заказа.
+
+    Вызывается внутри транзакции перехода, до conn.commit(), чтобы событие
+    и изменение заказа фиксировались атомарно.
+    """
+    cursor.execute(
+        _INSERT_EVENT,
+        (order_id, event_type, old_status, new_status, actor_id, _dump_payload(payload), int(time.time()))
+    )
+    return cursor.lastrowid
+
+
+def log_order_events(cursor, events):
+    """
+    Пакетная запись событий.
+
+    events - итерируемое кортежей (order_id, event_type, old_status, new_status, actor_id, payload).
+    """
+    now = int(time.time())
+    cursor.executemany(
+        _INSERT_EVENT,
+        [
+            (order_id, event_type, old_status, new_status, actor_id, _dump_payload(payload), now)
+            for order_id, event_type, old_status, new_status, actor_id, payload in events
+        ]
+    )
+
+
+def add_order_event(session, order_id, event_type, old_status=None, new_status=None, actor_id=None, **payload):
+    """
+    То же для обработчиков app/handlers: событие добавляется в сессию
+    SQLAlchemy и фиксируется тем же session.commit(), что и заказ.
+    """
+    session.add(OrderEvent(
+        order_id=order_id,
+        event_type=event_type,
+        old_status=old_status,
+        new_status=new_status,
+        actor_id=actor_id,
+        payload=_dump_payload(payload),
+        created_ts=int(time.time()),
+    ))
@@ -0,0 +1,301 @@
+"""
+Инструментирование запросов к SQLite.
+
+Два источника:
+  * sqlite3 (taxi_bot.py): TimedConnection передается как factory в
+    sqlite3.connect, его курсоры засекают каждый запрос;
+  * SQLAlchemy (app/): instrument_engine() подписывается на события
+    before/after_cursor_execute движка.
+
+Для каждого запроса (нормализованный текст SQL) копятся количество
+выполнений, суммарное и максимальное время, число строк и число шагов
+виртуальной машины SQLite (через progress handler). Списки параметров
+переменной длины ("IN (?, ?, ?)") схлопываются в один ключ, число ключей
+ограничено MAX_QUERY_KEYS. Если запрос выполнялся дольше SLOW_QUERY_MS,
+для него сохраняется вывод EXPLAIN QUERY PLAN - так видно полные сканы
+таблиц.
+
+query_budget() ограничивает число запросов внутри блока (обработчик
+одного апдейта) - так ловятся N+1 при ленивой загрузке связей.
+"""
+import contextlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from app.utils import metrics
+from config import SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Progress handler вызывается раз в столько инструкций VM
+PROGRESS_STEP = 1000
+# Сколько планов медленных запросов держать в памяти
+MAX_SLOW_PLANS = 100
+# Сколько разных запросов учитывать; остальные копятся под OTHER_QUERIES
+MAX_QUERY_KEYS = 500
+OTHER_QUERIES = '(прочие запросы)'
+# Списки параметров переменной длины: "IN (?, ?, ?)" и "VALUES (?, ?), (?, ?)"
+_IN_LIST_RE = re.compile(r'\bIN \(\?(?: ?, ?\?)*\)', re.IGNORECASE)
+_ROW_LIST_RE = re.compile(r'(\([^()]*\))(?: ?, ?\1)+')
+
+_slow_threshold = SLOW_QUERY_MS / 1000.0
+_lock = threading.Lock()
+_query_stats = {}
+_slow_plans = OrderedDict()
+_normalized = {}
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Блок выполнил больше запросов, чем разрешено бюджетом"""
+
+
+class QueryStat:
+    """Накопленная статистика одного запроса"""
+
+    __slots__ = ('count', 'total', 'max', 'rows', 'steps')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.steps = 0
+
+
+def normalize_sql(sql):
+    """
+    Схлопывает пробелы и списки параметров ("IN (?, ?, ?)" -> "IN (?, ...)"),
+    чтобы один и тот же запрос считался одним ключом при любой длине списка
+    """
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = ' '.join(sql.split())
+        normalized = _IN_LIST_RE.sub('IN (?, ...)', normalized)
+        normalized = _ROW_LIST_RE.sub(r'\1, ...', normalized)
+        with _lock:
+            if len(_normalized) > 2000:
+                _normalized.clear()
+            _normalized[sql] = normalized
+    return normalized
+
+
+def _is_explainable(sql):
+    head = sql[:10].lstrip().upper()
+    return head.startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'))
+
+
+def record_query(sql, elapsed, rows=0, steps=0):
+    """Учитывает выполнение запроса"""
+    key = normalize_sql(sql)
+    with _lock:
+        stat = _query_stats.get(key)
+        if stat is None:
+            if len(_query_stats) >= MAX_QUERY_KEYS:
+                key = OTHER_QUERIES
+                stat = _query_stats.get(key)
+            if stat is None:
+                stat = _query_stats[key] = QueryStat()
+        stat.count += 1
+        stat.total += elapsed
+        if elapsed > stat.max:
+            stat.max = elapsed
+        stat.rows += rows
+        stat.steps += steps
+    budget = getattr(_local, 'budget', None)
+    if budget is not None:
+        budget.append(key)
+    metrics.add_db_time(elapsed)
+    return key
+
+
+def add_rows(key, rows):
+    """Досчитывает строки, полученные fetch* после выполнения запроса"""
+    with _lock:
+        stat = _query_stats.get(key)
+        if stat is not None:
+            stat.rows += rows
+
+
+def capture_plan(raw_connection, sql, parameters, elapsed):
+    """Сохраняет EXPLAIN QUERY PLAN медленного запроса"""
+    key = normalize_sql(sql)
+    try:
+        plan_cursor = sqlite3.Cursor(raw_connection)
+        plan_cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+        plan = [row[-1] for row in plan_cursor.fetchall()]
+        plan_cursor.close()
+    except Exception as e:
+        plan = [f"не удалось получить план: {e}"]
+    with _lock:
+        _slow_plans.pop(key, None)
+        _slow_plans[key] = {
+            'sql': key,
+            'elapsed': elapsed,
+            'plan': plan,
+            'captured_at': time.time(),
+        }
+        while len(_slow_plans) > MAX_SLOW_PLANS:
+            _slow_plans.popitem(last=False)
+    metrics.registry.inc('db_slow_queries_total')
+    scans = [line for line in plan if line.startswith('SCAN')]
+    logger.warning(
+        f"Медленный запрос {elapsed * 1000:.1f} мс: {key}"
+        + (f" | {'; '.join(scans)}" if scans else "")
+    )
+
+
+def query_summary(limit=15):
+    """Статистика запросов, отсортированная по суммарному времени"""
+    with _lock:
+        rows = [
+            {
+                'sql': sql,
+                'count': stat.count,
+                'total': stat.total,
+                'avg': stat.total / stat.count,
+                'max': stat.max,
+                'rows': stat.rows,
+                'steps': stat.steps,
+            }
+            for sql, stat in _query_stats.items() if stat.count
+        ]
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    return rows[:limit]
+
+
+def slow_query_plans():
+    """Сохраненные планы медленных запросов, последние - первыми"""
+    with _lock:
+        return list(reversed(_slow_plans.values()))
+
+
+@contextlib.contextmanager
+def query_budget(limit, label='', strict=True):
+    """
+    Считает запросы текущего потока внутри блока.
+
+    Отдает список выполненных запросов. При превышении limit бросает
+    QueryBudgetExceeded (strict=True) или пишет предупреждение в лог.
+    Вложенные блоки считаются и во внешнем бюджете.
+    """
+    outer = getattr(_local, 'budget', None)
+    queries = _local.budget = []
+    try:
+        yield queries
+    finally:
+        _local.budget = outer
+        if outer is not None:
+            outer.extend(queries)
+    if len(queries) > limit:
+        message = f"{label or 'блок'}: {len(queries)} запросов при бюджете {limit}"
+        if strict:
+            raise QueryBudgetExceeded(message + "\n" + "\n".join(queries))
+        metrics.registry.inc('db_query_budget_exceeded_total')
+        logger.warning(message)
+
+
+def reset_query_stats():
+    with _lock:
+        _query_stats.clear()
+        _slow_plans.clear()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, учитывающий время, строки и шаги VM каждого запроса"""
+
+    _stat_key = None
+
+    def execute(self, sql, parameters=()):
+        conn = self.connection
+        steps_before = conn.vm_steps
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            rows = self.rowcount if self.rowcount > 0 else 0
+            self._stat_key = record_query(sql, elapsed, rows, (conn.vm_steps - steps_before) * PROGRESS_STEP)
+            if elapsed >= _slow_threshold and _is_explainable(sql):
+                capture_plan(conn, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            rows = self.rowcount if self.rowcount > 0 else 0
+            self._stat_key = record_query(sql, time.perf_counter() - started, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self._stat_key:
+            add_rows(self._stat_key, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._stat_key:
+            add_rows(self._stat_key, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self._stat_key:
+            add_rows(self._stat_key, len(rows))
+        return rows
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, создающее TimedCursor и считающее шаги VM"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vm_steps = 0
+        self.set_progress_handler(self._on_progress, PROGRESS_STEP)
+
+    def _on_progress(self):
+        self.vm_steps += 1
+        return 0
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в CPython создает курсор в обход cursor(), поэтому
+    # без этих методов запросы через conn.execute не попадали в статистику
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.add_db_time(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """Подключает учет запросов к движку SQLAlchemy"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        record_query(statement, elapsed, rows)
+        if not executemany and elapsed >= _slow_threshold and _is_explainable(statement):
+            capture_plan(cursor.connection, statement, parameters, elapsed)
+
+    return engine
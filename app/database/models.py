@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, scoped_session, sessionmaker
 import datetime
 import os
 import sys
@@ -14,7 +14,11 @@ from config import DATABASE_URL
 
 Base = declarative_base()
 engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# Одна сессия на поток: обработчик апдейта и вызываемые им хелперы работают
+# с одной сессией, session_scope закрывает ее после обработки апдейта.
+# expire_on_commit=False - после commit объекты остаются читаемыми без
+# повторного запроса.
+Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 
 class User(Base):
     __tablename__ = 'users'
@@ -62,8 +66,16 @@ class Order(Base):
     price = Column(Float, nullable=True)
     counter_offer = Column(Float, nullable=True)
     status = Column(String(20), default="NEW")
+    scheduled_at = Column(String(40), nullable=True)  # ISO-строка с часовым поясом
+    payment_method = Column(String(10), nullable=True)  # CASH / CARD
+    from_lat = Column(Float, nullable=True)  # геопозиция точки А, если отправлена
+    from_lon = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
+    # Секунды Unix для выборок по периодам; заполняются триггерами базы
+    created_ts = Column(Integer, nullable=True)
+    scheduled_ts = Column(Integer, nullable=True)
+    completed_ts = Column(Integer, nullable=True)
     
     # Связи
     client = relationship("User", back_populates="orders")
@@ -94,12 +106,37 @@ class Earning(Base):
     order_id = Column(Integer, ForeignKey('orders.id'), unique=True)
     amount = Column(Float, nullable=False)
     date = Column(DateTime, default=datetime.datetime.utcnow)
+    date_ts = Column(Integer, nullable=True)  # заполняется триггером базы
     
     # Связи
     driver = relationship("Driver", back_populates="earnings")
 
+class Admin(Base):
+    __tablename__ = 'admins'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, unique=True, nullable=False)
+    first_name = Column(String(100))
+    added_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class OrderEvent(Base):
+    __tablename__ = 'order_events'
+    
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
+    event_type = Column(String(20), nullable=False)
+    old_status = Column(String(20), nullable=True)
+    new_status = Column(String(20), nullable=True)
+    actor_id = Column(Integer, nullable=True)  # Telegram ID
+    payload = Column(Text, nullable=True)  # JSON
+    created_ts = Column(Integer, nullable=False)
+
 def init_db():
-    Base.metadata.create_all(engine)
+    # Схема общая с taxi_bot.py и описана в repository.init_schema
+    from app.database import repository
+    conn = repository.connect()
+    repository.ensure_schema(conn)
+    conn.close()
 
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
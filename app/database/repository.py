@@ -0,0 +1,710 @@
+"""
+Общий слой доступа к данным.
+
+Используется и монолитом taxi_bot.py, и обработчиками app/handlers, чтобы
+схема, индексы и тяжелые выборки существовали в одном экземпляре.
+
+  * connect() / init_schema() - соединение и DDL (включая миграции);
+    ensure_schema() пропускает DDL, если версия схемы уже актуальна;
+  * get_meta() / set_meta() - служебные значения бота (bot_meta);
+  * столбцы *_ts - время в секундах Unix (см. app.utils.timeutils),
+    заполняются триггерами при любой записи, в том числе через SQLAlchemy;
+  * get_counters() - счетчики COUNTERS (заказы без водителя, свободные
+    водители), их ведут триггеры на каждом переходе статуса;
+  * driver_shifts - интервалы статусов водителей, их открывает и
+    закрывает триггер на drivers.status; суточные итоги в
+    driver_shift_daily считает app.utils.utilization;
+  * пакетные выборки: get_orders_by_ids, get_client_order_numbers,
+    get_drivers_with_stats, get_active_board, get_cancellation_recipients,
+    get_price_offer_recipients, get_driver_earnings.
+
+Функции принимают sqlite3-соединение первым аргументом, как и
+app.database.events; транзакциями управляет вызывающий код.
+"""
+import datetime
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from app.database.instrumentation import TimedConnection
+from config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = make_url(DATABASE_URL).database or ':memory:'
+
+# Статусы заказов, которые показываются на доске активных заказов
+ACTIVE_STATUSES = ('NEW', 'PRICE_OFFERED', 'COUNTER_OFFERED', 'ACCEPTED', 'IN_PROGRESS', 'ARRIVED')
+# Статусы, при которых заказ числится за водителем
+DRIVER_BUSY_STATUSES = ('IN_PROGRESS', 'ACCEPTED')
+
+# Версия схемы (PRAGMA user_version). Увеличивается при каждом изменении
+# init_schema, иначе уже созданные базы не получат новых таблиц и индексов.
+SCHEMA_VERSION = 7
+
+# SQLite ограничивает число параметров запроса
+_CHUNK_SIZE = 500
+
+# Столбцы с секундами Unix: таблица -> [(столбец *_ts, исходный столбец)]
+EPOCH_COLUMNS = {
+    'orders': [('created_ts', 'created_at'), ('scheduled_ts', 'scheduled_at'), ('completed_ts', 'completed_at')],
+    'earnings': [('date_ts', 'date')],
+}
+
+
+# Счетчики, которые триггеры обновляют при каждом изменении строк:
+# имя -> (таблица, столбцы, от которых зависит условие, условие для строки {row})
+COUNTERS = {
+    # Заказы, которые ждут цену, ответа клиента или водителя
+    'open_orders': (
+        'orders', ('status', 'driver_id'),
+        "{row}.status IN ('NEW', 'PRICE_OFFERED', 'COUNTER_OFFERED') "
+        "OR ({row}.status = 'ACCEPTED' AND {row}.driver_id IS NULL)"
+    ),
+    # Одобренные водители на линии
+    'available_drivers': (
+        'drivers', ('status', 'is_approved'),
+        "{row}.status = 'ON_DUTY' AND {row}.is_approved = 1"
+    ),
+}
+
+
+def _epoch_sql(column):
+    # strftime понимает все форматы в базе: 'YYYY-MM-DD HH:MM:SS', 'T',
+    # доли секунды и смещение '+02:00'; результат - UTC
+    return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Открывает соединение с общей базой (строки доступны по имени столбца)"""
+    conn = sqlite3.connect(path or DATABASE_PATH, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    """Создает таблицы и индексы, применяет миграции"""
+    cursor = conn.cursor()
+    
+    # Создаем таблицу пользователей
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        phone_number TEXT,
+        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Создаем таблицу водителей
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS drivers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        first_name TEXT NOT NULL,
+        license_number TEXT NOT NULL,
+        car_registration TEXT NOT NULL,
+        car_number TEXT NOT NULL,
+        car_photos TEXT,
+        status TEXT DEFAULT 'OFF_DUTY',
+        is_approved INTEGER DEFAULT 0,
+        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Создаем таблицу заказов
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER,
+        driver_id INTEGER,
+        from_address TEXT NOT NULL,
+        to_address TEXT NOT NULL,
+        scheduled_at TEXT,
+        payment_method TEXT,
+        from_lat REAL,
+        from_lon REAL,
+        comment TEXT,
+        price REAL,
+        counter_offer REAL,
+        status TEXT DEFAULT 'NEW',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        created_ts INTEGER,
+        scheduled_ts INTEGER,
+        completed_ts INTEGER,
+        FOREIGN KEY (client_id) REFERENCES users (id),
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    
+    # Миграция: добавляем столбец payment_method, если отсутствует (для существующих БД)
+    try:
+        cursor.execute("PRAGMA table_info(orders)")
+        cols = [row[1] for row in cursor.fetchall()]
+        if 'payment_method' not in cols:
+            cursor.execute('ALTER TABLE orders ADD COLUMN payment_method TEXT')
+        if 'scheduled_at' not in cols:
+            cursor.execute('ALTER TABLE orders ADD COLUMN scheduled_at TEXT')
+        # Координаты точки А, если клиент отправил геопозицию
+        if 'from_lat' not in cols:
+            cursor.execute('ALTER TABLE orders ADD COLUMN from_lat REAL')
+            cursor.execute('ALTER TABLE orders ADD COLUMN from_lon REAL')
+    except Exception as e:
+        logger.error(f"Ошибка миграции orders.payment_method: {e}")
+    
+    # Таблица администраторов
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS admins (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        first_name TEXT,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Создаем таблицу отзывов
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER UNIQUE,
+        client_id INTEGER,
+        driver_id INTEGER,
+        rating INTEGER NOT NULL,
+        comment TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (client_id) REFERENCES users (id),
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    
+    # Создаем таблицу заработка
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS earnings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER,
+        order_id INTEGER UNIQUE,
+        amount REAL NOT NULL,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        date_ts INTEGER,
+        FOREIGN KEY (driver_id) REFERENCES drivers (id),
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )
+    ''')
+    
+    _migrate_epoch_columns(cursor)
+    
+    # Счетчики спроса и предложения (ведутся триггерами)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    _create_counter_triggers(cursor)
+    
+    # Журнал событий заказов (только добавление)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        event_type TEXT NOT NULL,
+        old_status TEXT,
+        new_status TEXT,
+        actor_id INTEGER,
+        payload TEXT,
+        created_ts INTEGER NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id, id)')
+    # Позиции потребителей журнала больше не хранятся
+    cursor.execute('DROP TABLE IF EXISTS order_event_offsets')
+    
+    # Индексы горячих выборок
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_client ON orders (client_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_driver ON orders (driver_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reviews_driver ON reviews (driver_id, rating)')
+    # Диапазоны по времени - только по столбцам *_ts
+    cursor.execute('DROP INDEX IF EXISTS idx_earnings_driver')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_earnings_driver_ts ON earnings (driver_id, date_ts, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_earnings_ts ON earnings (date_ts, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_created_ts ON orders (created_ts)')
+    
+    # Последние геопозиции водителей (пишет app.utils.geo.LocationTracker)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_locations (
+        driver_id INTEGER PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        updated_ts REAL NOT NULL,
+        live_until REAL,
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    
+    # Интервалы статусов водителей (открывает и закрывает триггер) и суточные итоги по ним
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_shifts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        started_ts INTEGER NOT NULL,
+        ended_ts INTEGER,
+        rolled_up INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (driver_id) REFERENCES drivers (id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_shifts_open ON driver_shifts (driver_id) WHERE ended_ts IS NULL')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_driver_shifts_pending ON driver_shifts (id) '
+        'WHERE rolled_up = 0 AND ended_ts IS NOT NULL'
+    )
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS driver_shift_daily (
+        driver_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        idle_seconds INTEGER NOT NULL DEFAULT 0,
+        busy_seconds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (driver_id, day)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_shift_daily_day ON driver_shift_daily (day)')
+    _create_shift_triggers(cursor)
+    
+    # Политики уведомлений администраторов по категориям (app.utils.notifications)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS admin_notification_settings (
+        admin_user_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        policy TEXT NOT NULL,
+        PRIMARY KEY (admin_user_id, category)
+    )
+    ''')
+    
+    # Служебные значения бота (хэш команд, имя бота и т.п.)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bot_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+    
+    conn.commit()
+
+
+def _migrate_epoch_columns(cursor):
+    """Добавляет столбцы *_ts, заполняет их для старых строк и создает триггеры"""
+    for table, columns in EPOCH_COLUMNS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for ts_column, source in columns:
+            if ts_column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {ts_column} INTEGER')
+            cursor.execute(
+                f'UPDATE {table} SET {ts_column} = {_epoch_sql(source)} '
+                f'WHERE {ts_column} IS NULL AND {source} IS NOT NULL'
+            )
+        
+        # Вставка: все столбцы сразу (DEFAULT CURRENT_TIMESTAMP уже подставлен в NEW)
+        assignments = ', '.join(f'{ts_column} = {_epoch_sql("NEW." + source)}' for ts_column, source in columns)
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_ts_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE {table} SET {assignments} WHERE id = NEW.id;
+        END
+        ''')
+        # Изменение: только затронутый столбец
+        for ts_column, source in columns:
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{ts_column}_update AFTER UPDATE OF {source} ON {table}
+            BEGIN
+                UPDATE {table} SET {ts_column} = {_epoch_sql("NEW." + source)} WHERE id = NEW.id;
+            END
+            ''')
+
+
+def _create_counter_triggers(cursor):
+    """Пересчитывает счетчики по таблицам и создает триггеры, которые дальше ведут их на ходу"""
+    for name, (table, columns, condition) in COUNTERS.items():
+        # NULL в условии считается ложью, иначе сравнение NEW и OLD тоже дает NULL
+        new = f"IFNULL(({condition.format(row='NEW')}), 0)"
+        old = f"IFNULL(({condition.format(row='OLD')}), 0)"
+        cursor.execute(
+            f'INSERT INTO counters (name, value) '
+            f'SELECT ?, COUNT(*) FROM {table} WHERE {condition.format(row=table)} '
+            f'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+            (name,)
+        )
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_insert AFTER INSERT ON {table} WHEN {new}
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = '{name}';
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_delete AFTER DELETE ON {table} WHEN {old}
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = '{name}';
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+        WHEN {new} != {old}
+        BEGIN
+            UPDATE counters SET value = value + {new} - {old} WHERE name = '{name}';
+        END
+        ''')
+
+
+def _create_shift_triggers(cursor):
+    """Открывает интервалы для текущих статусов и создает триггеры журнала статусов водителей"""
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    # История до миграции неизвестна: текущий статус считается с момента миграции
+    cursor.execute(f'''
+    INSERT INTO driver_shifts (driver_id, status, started_ts)
+    SELECT id, status, {now} FROM drivers
+    WHERE status IS NOT NULL
+      AND id NOT IN (SELECT driver_id FROM driver_shifts WHERE ended_ts IS NULL)
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_driver_shift_insert AFTER INSERT ON drivers WHEN NEW.status IS NOT NULL
+    BEGIN
+        INSERT INTO driver_shifts (driver_id, status, started_ts) VALUES (NEW.id, NEW.status, {now});
+    END
+    ''')
+    # Любая смена статуса (кнопки водителя, назначение на заказ, админка, SQLAlchemy)
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_driver_shift_update AFTER UPDATE OF status ON drivers
+    WHEN NEW.status IS NOT OLD.status
+    BEGIN
+        UPDATE driver_shifts SET ended_ts = {now} WHERE driver_id = NEW.id AND ended_ts IS NULL;
+        INSERT INTO driver_shifts (driver_id, status, started_ts)
+        SELECT NEW.id, NEW.status, {now} WHERE NEW.status IS NOT NULL;
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_driver_shift_delete AFTER DELETE ON drivers
+    BEGIN
+        UPDATE driver_shifts SET ended_ts = {now} WHERE driver_id = OLD.id AND ended_ts IS NULL;
+    END
+    ''')
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def ensure_schema(conn: sqlite3.Connection) -> bool:
+    """Применяет init_schema, только если версия схемы устарела. Возвращает True, если DDL выполнялся"""
+    if schema_version(conn) == SCHEMA_VERSION:
+        return False
+    init_schema(conn)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    logger.info(f"Схема базы обновлена до версии {SCHEMA_VERSION}")
+    return True
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute('SELECT value FROM bot_meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        'INSERT INTO bot_meta (key, value) VALUES (?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+        (key, value)
+    )
+
+
+def get_counters(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Текущие значения COUNTERS (одно чтение маленькой таблицы)"""
+    values = dict.fromkeys(COUNTERS, 0)
+    values.update((name, value) for name, value in conn.execute('SELECT name, value FROM counters'))
+    return values
+
+
+def _parse_ts(value):
+    """Разбирает TIMESTAMP из SQLite (CURRENT_TIMESTAMP или isoformat)"""
+    if not value or isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _chunks(values, size=_CHUNK_SIZE):
+    values = list(dict.fromkeys(values))
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _placeholders(count):
+    return ','.join('?' * count)
+
+
+@dataclass
+class ClientInfo:
+    user_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    username: Optional[str]
+    phone_number: Optional[str]
+
+
+@dataclass
+class DriverInfo:
+    id: int
+    user_id: int
+    first_name: str
+    car_number: str
+
+
+@dataclass
+class BoardOrder:
+    """Заказ на доске активных заказов вместе с клиентом и водителем"""
+    id: int
+    client_id: int
+    driver_id: Optional[int]
+    from_address: str
+    to_address: str
+    comment: Optional[str]
+    price: Optional[float]
+    counter_offer: Optional[float]
+    status: str
+    scheduled_at: Optional[str]
+    payment_method: Optional[str]
+    created_at: Optional[datetime.datetime]
+    completed_at: Optional[datetime.datetime]
+    client_order_number: int
+    client: ClientInfo
+    driver: Optional[DriverInfo]
+
+
+@dataclass
+class DriverStats:
+    """Водитель со сводной статистикой"""
+    id: int
+    user_id: int
+    first_name: str
+    license_number: str
+    car_registration: str
+    car_number: str
+    status: str
+    is_approved: bool
+    avg_rating: Optional[float]
+    reviews_count: int
+    total_earnings: float
+    active_orders: int
+
+
+def get_orders_by_ids(conn: sqlite3.Connection, order_ids: Iterable[int]) -> Dict[int, sqlite3.Row]:
+    """Заказы по списку id одним запросом на каждые 500 id"""
+    cursor = conn.cursor()
+    orders = {}
+    for chunk in _chunks(order_ids):
+        cursor.execute(f'SELECT * FROM orders WHERE id IN ({_placeholders(len(chunk))})', chunk)
+        for row in cursor.fetchall():
+            orders[row['id']] = row
+    return orders
+
+
+def get_client_order_numbers(conn: sqlite3.Connection, order_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Порядковые номера заказов у их клиентов ("Заказ #N").
+
+    Эквивалент SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?
+    для каждого заказа, но одним проходом ROW_NUMBER по заказам этих клиентов.
+    """
+    cursor = conn.cursor()
+    numbers = {}
+    for chunk in _chunks(order_ids):
+        marks = _placeholders(len(chunk))
+        cursor.execute(f'''
+            SELECT id, n FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY client_id ORDER BY id) AS n
+                FROM orders
+                WHERE client_id IN (SELECT client_id FROM orders WHERE id IN ({marks}))
+            )
+            WHERE id IN ({marks})
+        ''', chunk + chunk)
+        numbers.update((row[0], row[1]) for row in cursor.fetchall())
+    return numbers
+
+
+def get_cancellation_recipients(conn: sqlite3.Connection,
+                                keep_statuses: Iterable[str] = ('COMPLETED', 'CANCELLED')) -> List[sqlite3.Row]:
+    """
+    Незавершенные заказы вместе с получателями уведомлений об отмене.
+
+    Одним запросом: Telegram ID клиента и водителя и номер заказа у клиента
+    (ROW_NUMBER по заказам тех же клиентов).
+    """
+    keep_statuses = tuple(keep_statuses)
+    marks = _placeholders(len(keep_statuses))
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        WITH numbered AS (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY client_id ORDER BY id) AS client_order_number
+            FROM orders
+            WHERE client_id IN (SELECT client_id FROM orders WHERE status NOT IN ({marks}))
+        )
+        SELECT o.id, o.client_id, o.driver_id, o.status, n.client_order_number,
+               u.user_id AS client_user_id, d.user_id AS driver_user_id
+        FROM orders o
+        LEFT JOIN numbered n ON n.id = o.id
+        LEFT JOIN users u ON o.client_id = u.id
+        LEFT JOIN drivers d ON o.driver_id = d.id
+        WHERE o.status NOT IN ({marks})
+        ORDER BY o.id
+    ''', keep_statuses + keep_statuses)
+    return cursor.fetchall()
+
+
+def get_price_offer_recipients(conn: sqlite3.Connection, order_ids: Iterable[int]) -> List[sqlite3.Row]:
+    """Заказы с ценой, Telegram ID клиента и номером заказа у клиента - для рассылки предложений цены"""
+    cursor = conn.cursor()
+    recipients = []
+    for chunk in _chunks(order_ids):
+        marks = _placeholders(len(chunk))
+        cursor.execute(f'''
+            WITH numbered AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY client_id ORDER BY id) AS client_order_number
+                FROM orders
+                WHERE client_id IN (SELECT client_id FROM orders WHERE id IN ({marks}))
+            )
+            SELECT o.id, o.price, n.client_order_number, u.user_id AS client_user_id
+            FROM orders o
+            JOIN numbered n ON n.id = o.id
+            JOIN users u ON o.client_id = u.id
+            WHERE o.id IN ({marks})
+            ORDER BY o.id
+        ''', chunk + chunk)
+        recipients.extend(cursor.fetchall())
+    return recipients
+
+
+def get_drivers_with_stats(conn: sqlite3.Connection, approved: Optional[bool] = None) -> List[DriverStats]:
+    """
+    Водители с рейтингом, заработком и числом текущих заказов.
+
+    Агрегаты считаются одним запросом вместо трех запросов на водителя.
+    approved=None - все водители, True/False - только одобренные/заявки.
+    """
+    busy = _placeholders(len(DRIVER_BUSY_STATUSES))
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT d.*, r.avg_rating, COALESCE(r.reviews_count, 0) AS reviews_count,
+               COALESCE(e.total, 0) AS total_earnings, COALESCE(a.active, 0) AS active_orders
+        FROM drivers d
+        LEFT JOIN (SELECT driver_id, AVG(rating) AS avg_rating, COUNT(*) AS reviews_count
+                   FROM reviews GROUP BY driver_id) r ON r.driver_id = d.id
+        LEFT JOIN (SELECT driver_id, SUM(amount) AS total
+                   FROM earnings GROUP BY driver_id) e ON e.driver_id = d.id
+        LEFT JOIN (SELECT driver_id, COUNT(*) AS active
+                   FROM orders WHERE driver_id IS NOT NULL AND status IN ({busy})
+                   GROUP BY driver_id) a ON a.driver_id = d.id
+        WHERE ? IS NULL OR d.is_approved = ?
+        ORDER BY d.id
+    ''', (*DRIVER_BUSY_STATUSES, approved, approved))
+    return [
+        DriverStats(
+            id=row['id'],
+            user_id=row['user_id'],
+            first_name=row['first_name'],
+            license_number=row['license_number'],
+            car_registration=row['car_registration'],
+            car_number=row['car_number'],
+            status=row['status'],
+            is_approved=bool(row['is_approved']),
+            avg_rating=row['avg_rating'],
+            reviews_count=row['reviews_count'],
+            total_earnings=row['total_earnings'],
+            active_orders=row['active_orders'],
+        )
+        for row in cursor.fetchall()
+    ]
+
+
+def get_active_board(conn: sqlite3.Connection, statuses=ACTIVE_STATUSES) -> List[BoardOrder]:
+    """
+    Активные заказы (новые сверху) с клиентом, водителем и номером заказа
+    у клиента - одним запросом.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT o.*,
+               u.user_id AS client_user_id, u.first_name AS client_first_name, u.last_name AS client_last_name,
+               u.username AS client_username, u.phone_number AS client_phone_number,
+               d.user_id AS driver_user_id, d.first_name AS driver_first_name, d.car_number AS driver_car_number,
+               (SELECT COUNT(*) FROM orders o2 WHERE o2.client_id = o.client_id AND o2.id <= o.id) AS client_order_number
+        FROM orders o
+        JOIN users u ON o.client_id = u.id
+        LEFT JOIN drivers d ON o.driver_id = d.id
+        WHERE o.status IN ({_placeholders(len(statuses))})
+        ORDER BY o.created_at DESC
+    ''', tuple(statuses))
+    board = []
+    for row in cursor.fetchall():
+        driver = None
+        if row['driver_user_id'] is not None:
+            driver = DriverInfo(row['driver_id'], row['driver_user_id'], row['driver_first_name'], row['driver_car_number'])
+        board.append(BoardOrder(
+            id=row['id'],
+            client_id=row['client_id'],
+            driver_id=row['driver_id'],
+            from_address=row['from_address'],
+            to_address=row['to_address'],
+            comment=row['comment'],
+            price=row['price'],
+            counter_offer=row['counter_offer'],
+            status=row['status'],
+            scheduled_at=row['scheduled_at'],
+            payment_method=row['payment_method'],
+            created_at=_parse_ts(row['created_at']),
+            completed_at=_parse_ts(row['completed_at']),
+            client_order_number=row['client_order_number'],
+            client=ClientInfo(
+                row['client_user_id'], row['client_first_name'], row['client_last_name'],
+                row['client_username'], row['client_phone_number']
+            ),
+            driver=driver,
+        ))
+    return board
+
+
+def get_driver_earnings(conn: sqlite3.Connection, driver_id: int, now=None) -> Dict[str, float]:
+    """
+    Заработок водителя за текущие сутки, неделю и месяц (по местному
+    времени) и за все время.
+    
+    Один проход по покрывающему индексу (driver_id, date_ts, amount).
+    """
+    # Импорт здесь: app.utils импортирует app.database
+    from app.utils import timeutils
+    starts = timeutils.period_starts(now)
+    row = conn.execute('''
+        SELECT SUM(CASE WHEN date_ts >= ? THEN amount END),
+               SUM(CASE WHEN date_ts >= ? THEN amount END),
+               SUM(CASE WHEN date_ts >= ? THEN amount END),
+               SUM(amount)
+        FROM earnings
+        WHERE driver_id = ?
+    ''', (starts['day'], starts['week'], starts['month'], driver_id)).fetchone()
+    return {
+        'day': row[0] or 0,
+        'week': row[1] or 0,
+        'month': row[2] or 0,
+        'total': row[3] or 0,
+    }
@@ -0,0 +1,37 @@
+"""
+Сессия на апдейт для обработчиков app/.
+
+session_scope оборачивает обработчик так, что все вызовы Session() внутри
+обработки одного апдейта получают одну и ту же сессию, а после обработки
+она закрывается (Session.remove()). Заодно считаются запросы обработчика:
+больше HANDLER_QUERY_BUDGET - предупреждение в лог.
+
+Обертка ставится через metrics.instrument_bot(bot, wrappers=(session_scope,))
+тем же проходом, что и замер времени.
+"""
+import functools
+import threading
+
+from app.database.instrumentation import query_budget
+from app.database.models import Session
+from config import HANDLER_QUERY_BUDGET
+
+_local = threading.local()
+
+
+def session_scope(func, name, budget=HANDLER_QUERY_BUDGET):
+    """Одна сессия и бюджет запросов на вызов обработчика; name - метка бюджета"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'depth', 0):
+            return func(*args, **kwargs)
+        _local.depth = 1
+        try:
+            with query_budget(budget, label=name, strict=False):
+                return func(*args, **kwargs)
+        finally:
+            _local.depth = 0
+            Session.remove()
+
+    return wrapper
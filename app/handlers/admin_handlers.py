@@ -1,10 +1,11 @@
-from telebot import TeleBot
+from telebot import TeleBot, types
 from telebot.types import Message, CallbackQuery
-from app.keyboards import get_admin_keyboard, get_main_keyboard, get_yes_no_keyboard
-from app.utils import get_admin_order_view, format_driver_info
-from app.database import Session, User, Driver, Order, Earning
+from app.keyboards import get_admin_keyboard, get_main_keyboard, get_yes_no_keyboard, get_driver_keyboard
+from app.utils import get_admin_order_view, format_driver_info, statistics, templates
+from app.database import Session, User, Driver, Order, Earning, events, repository
 from config import ADMIN_ID
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
 import datetime
 
 def register_admin_handlers(bot: TeleBot):
@@ -35,12 +36,10 @@ def register_admin_handlers(bot: TeleBot):
     @bot.message_handler(func=lambda message: message.text == "📊 Активные заказы" and message.from_user.id == ADMIN_ID)
     def active_orders(message: Message):
         """Показывает активные заказы"""
-        session = Session()
-        
-        # Получаем все активные заказы (новые и принятые)
-        orders = session.query(Order).filter(
-            Order.status.in_(["NEW", "PRICE_OFFERED", "ACCEPTED", "IN_PROGRESS"])
-        ).order_by(desc(Order.created_at)).all()
+        # Все активные заказы вместе с клиентами и водителями одним запросом
+        conn = repository.connect()
+        orders = repository.get_active_board(conn)
+        conn.close()
         
         if not orders:
             bot.send_message(
@@ -48,7 +47,6 @@ def register_admin_handlers(bot: TeleBot):
                 "Активных заказов нет.",
                 reply_markup=get_admin_keyboard()
             )
-            session.close()
             return
         
         # Отправляем информацию о каждом заказе
@@ -74,8 +72,6 @@ def register_admin_handlers(bot: TeleBot):
                 parse_mode="HTML",
                 reply_markup=markup
             )
-        
-        session.close()
     
     @bot.callback_query_handler(func=lambda call: call.data.startswith("set_price:") and call.from_user.id == ADMIN_ID)
     def set_price_callback(call: CallbackQuery):
@@ -118,22 +114,20 @@ def register_admin_handlers(bot: TeleBot):
             
             # Обновляем заказ
             session = Session()
-            order = session.query(Order).filter(Order.id == order_id).first()
+            order = session.query(Order).options(joinedload(Order.client)).filter(Order.id == order_id).first()
             
             if not order:
                 bot.send_message(message.chat.id, "Ошибка: заказ не найден")
-                session.close()
                 return
             
+            events.add_order_event(session, order.id, events.EVENT_PRICE_OFFERED, order.status, 'PRICE_OFFERED', message.from_user.id, price=price)
             order.price = price
             order.status = "PRICE_OFFERED"
             session.commit()
+            statistics.cache.invalidate()
             
-            # Получаем клиента
-            client = session.query(User).filter(User.id == order.client_id).first()
-            client_id = client.user_id if client else None
-            
-            session.close()
+            # Клиент загружен вместе с заказом
+            client_id = order.client.user_id if order.client else None
             
             # Уведомляем администратора
             bot.send_message(
@@ -187,7 +181,6 @@ def register_admin_handlers(bot: TeleBot):
                 call.message.chat.id,
                 "В данный момент нет доступных водителей на линии."
             )
-            session.close()
             return
         
         # Удаляем кнопки из предыдущего сообщения
@@ -208,8 +201,6 @@ def register_admin_handlers(bot: TeleBot):
             f"Выберите водителя для заказа #{order_id}:",
             reply_markup=markup
         )
-        
-        session.close()
     
     @bot.callback_query_handler(func=lambda call: call.data.startswith("select_driver:") and call.from_user.id == ADMIN_ID)
     def select_driver_callback(call: CallbackQuery):
@@ -224,15 +215,15 @@ def register_admin_handlers(bot: TeleBot):
         
         # Назначаем водителя на заказ
         session = Session()
-        order = session.query(Order).filter(Order.id == order_id).first()
+        order = session.query(Order).options(joinedload(Order.client)).filter(Order.id == order_id).first()
         driver = session.query(Driver).filter(Driver.id == driver_id).first()
         
         if not order or not driver:
             bot.answer_callback_query(call.id, "Ошибка: заказ или водитель не найден")
-            session.close()
             return
         
         # Обновляем заказ
+        events.add_order_event(session, order.id, events.EVENT_ASSIGNED, order.status, 'IN_PROGRESS', call.from_user.id, driver_id=driver_id)
         order.driver_id = driver_id
         order.status = "IN_PROGRESS"
         
@@ -241,15 +232,12 @@ def register_admin_handlers(bot: TeleBot):
         
         session.commit()
         
-        # Получаем клиента
-        client = session.query(User).filter(User.id == order.client_id).first()
-        client_id = client.user_id if client else None
+        # Клиент загружен вместе с заказом
+        client_id = order.client.user_id if order.client else None
         
         # Получаем ID водителя в Telegram
         driver_telegram_id = driver.user_id
         
-        session.close()
-        
         # Удаляем кнопки из предыдущего сообщения
         bot.edit_message_reply_markup(
             chat_id=call.message.chat.id,
@@ -303,10 +291,13 @@ def register_admin_handlers(bot: TeleBot):
     @bot.message_handler(func=lambda message: message.text == "👨‍✈️ Управление водителями" and message.from_user.id == ADMIN_ID)
     def manage_drivers(message: Message):
         """Управление водителями"""
-        session = Session()
+        # Водители со статистикой одним запросом
+        conn = repository.connect()
+        drivers = repository.get_drivers_with_stats(conn)
+        conn.close()
         
-        # Получаем заявки на регистрацию водителей
-        pending_drivers = session.query(Driver).filter(Driver.is_approved == False).all()
+        # Заявки на регистрацию водителей
+        pending_drivers = [driver for driver in drivers if not driver.is_approved]
         
         if pending_drivers:
             bot.send_message(
@@ -335,8 +326,8 @@ def register_admin_handlers(bot: TeleBot):
                     reply_markup=markup
                 )
         
-        # Получаем активных водителей
-        active_drivers = session.query(Driver).filter(Driver.is_approved == True).all()
+        # Активные водители
+        active_drivers = [driver for driver in drivers if driver.is_approved]
         
         if active_drivers:
             bot.send_message(
@@ -359,8 +350,6 @@ def register_admin_handlers(bot: TeleBot):
                 "Нет водителей для отображения.",
                 reply_markup=get_admin_keyboard()
             )
-        
-        session.close()
     
     @bot.callback_query_handler(func=lambda call: call.data.startswith("approve_driver:") and call.from_user.id == ADMIN_ID)
     def approve_driver_callback(call: CallbackQuery):
@@ -378,7 +367,6 @@ def register_admin_handlers(bot: TeleBot):
         
         if not driver:
             bot.answer_callback_query(call.id, "Ошибка: водитель не найден")
-            session.close()
             return
         
         driver.is_approved = True
@@ -387,8 +375,6 @@ def register_admin_handlers(bot: TeleBot):
         # Получаем ID водителя в Telegram
         driver_telegram_id = driver.user_id
         
-        session.close()
-        
         # Удаляем кнопки из предыдущего сообщения
         bot.edit_message_reply_markup(
             chat_id=call.message.chat.id,
@@ -429,7 +415,6 @@ def register_admin_handlers(bot: TeleBot):
         
         if not driver:
             bot.answer_callback_query(call.id, "Ошибка: водитель не найден")
-            session.close()
             return
         
         # Получаем ID водителя в Telegram
@@ -439,7 +424,6 @@ def register_admin_handlers(bot: TeleBot):
         # Удаляем водителя из БД
         session.delete(driver)
         session.commit()
-        session.close()
         
         # Удаляем кнопки из предыдущего сообщения
         bot.edit_message_reply_markup(
@@ -471,7 +455,10 @@ def register_admin_handlers(bot: TeleBot):
         session = Session()
         
         # Получаем последние 10 завершенных заказов
-        orders = session.query(Order).filter(
+        orders = session.query(Order).options(
+            joinedload(Order.client),
+            joinedload(Order.driver)
+        ).filter(
             Order.status.in_(["COMPLETED", "CANCELLED"])
         ).order_by(desc(Order.created_at)).limit(10).all()
         
@@ -481,7 +468,6 @@ def register_admin_handlers(bot: TeleBot):
                 "История заказов пуста.",
                 reply_markup=get_admin_keyboard()
             )
-            session.close()
             return
         
         # Отправляем информацию о каждом заказе
@@ -492,68 +478,11 @@ def register_admin_handlers(bot: TeleBot):
                 order_text,
                 parse_mode="HTML"
             )
-        
-        session.close()
     
     @bot.message_handler(func=lambda message: message.text == "📈 Статистика" and message.from_user.id == ADMIN_ID)
     def show_statistics(message: Message):
-        """Показывает статистику"""
-        session = Session()
-        
-        # Общее количество заказов
-        total_orders = session.query(Order).count()
-        
-        # Количество завершенных заказов
-        completed_orders = session.query(Order).filter(Order.status == "COMPLETED").count()
-        
-        # Количество отмененных заказов
-        cancelled_orders = session.query(Order).filter(Order.status == "CANCELLED").count()
-        
-        # Количество активных заказов
-        active_orders = session.query(Order).filter(
-            Order.status.in_(["NEW", "PRICE_OFFERED", "ACCEPTED", "IN_PROGRESS"])
-        ).count()
-        
-        # Количество клиентов
-        total_clients = session.query(User).count()
-        
-        # Количество водителей
-        total_drivers = session.query(Driver).filter(Driver.is_approved == True).count()
-        
-        # Общая сумма заработка
-        total_earnings = session.query(func.sum(Order.price)).filter(Order.status == "COMPLETED").scalar() or 0
-        
-        # Средняя стоимость поездки
-        avg_price = session.query(func.avg(Order.price)).filter(Order.status == "COMPLETED").scalar() or 0
-        
-        # Заказы за сегодня
-        today = datetime.datetime.utcnow().date()
-        start_of_day = datetime.datetime.combine(today, datetime.time.min)
-        orders_today = session.query(Order).filter(Order.created_at >= start_of_day).count()
-        
-        # Заказы за текущий месяц
-        start_of_month = datetime.datetime(today.year, today.month, 1)
-        orders_month = session.query(Order).filter(Order.created_at >= start_of_month).count()
-        
-        session.close()
-        
-        # Формируем сообщение со статистикой
-        stats_text = f"📊 <b>Статистика</b>\n\n"
-        stats_text += f"<b>Заказы:</b>\n"
-        stats_text += f"Всего заказов: {total_orders}\n"
-        stats_text += f"Завершенных: {completed_orders}\n"
-        stats_text += f"Отмененных: {cancelled_orders}\n"
-        stats_text += f"Активных: {active_orders}\n"
-        stats_text += f"За сегодня: {orders_today}\n"
-        stats_text += f"За месяц: {orders_month}\n\n"
-        
-        stats_text += f"<b>Пользователи:</b>\n"
-        stats_text += f"Клиентов: {total_clients}\n"
-        stats_text += f"Водителей: {total_drivers}\n\n"
-        
-        stats_text += f"<b>Финансы:</b>\n"
-        stats_text += f"Общий доход: {total_earnings:.2f} руб.\n"
-        stats_text += f"Средняя стоимость поездки: {avg_price:.2f} руб.\n"
+        """Показывает статистику (снимок app.utils.statistics, кэшируется)"""
+        stats_text = templates.statistics_text(statistics.get_statistics())
         
         bot.send_message(
             message.chat.id,
@@ -574,11 +503,10 @@ def register_admin_handlers(bot: TeleBot):
         
         # Получаем данные о заказе
         session = Session()
-        order = session.query(Order).filter(Order.id == order_id).first()
+        order = session.query(Order).options(joinedload(Order.client)).filter(Order.id == order_id).first()
         
         if not order:
             bot.answer_callback_query(call.id, "Ошибка: заказ не найден")
-            session.close()
             return
         
         # Проверяем, что заказ назначен на этого водителя
@@ -586,10 +514,15 @@ def register_admin_handlers(bot: TeleBot):
         
         if not driver or driver.id != order.driver_id:
             bot.answer_callback_query(call.id, "Ошибка: заказ не назначен на вас")
-            session.close()
+            return
+        
+        # Повторное нажатие не должно дублировать заработок
+        if order.status == "COMPLETED":
+            bot.answer_callback_query(call.id, "Заказ уже завершен")
             return
         
         # Обновляем статус заказа
+        events.add_order_event(session, order.id, events.EVENT_COMPLETED, order.status, 'COMPLETED', call.from_user.id, price=order.price, driver_id=driver.id)
         order.status = "COMPLETED"
         order.completed_at = datetime.datetime.utcnow()
         
@@ -605,12 +538,11 @@ def register_admin_handlers(bot: TeleBot):
         
         session.add(earning)
         session.commit()
+        # Выручка и завершенные заказы в статистике - сразу
+        statistics.cache.invalidate()
         
-        # Получаем клиента
-        client = session.query(User).filter(User.id == order.client_id).first()
-        client_id = client.user_id if client else None
-        
-        session.close()
+        # Клиент загружен вместе с заказом
+        client_id = order.client.user_id if order.client else None
         
         # Удаляем кнопки из предыдущего сообщения
         bot.edit_message_reply_markup(
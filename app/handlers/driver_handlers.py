@@ -1,8 +1,10 @@
-from telebot import TeleBot
+from telebot import TeleBot, types
 from telebot.types import Message, CallbackQuery
 from app.keyboards import get_main_keyboard, get_driver_keyboard, get_driver_status_keyboard
 from app.utils import get_user_by_id, get_driver_by_id, format_order_info, format_driver_info
 from app.database import Session, User, Driver, Order, Earning
+from app.utils import timeutils
+from sqlalchemy import case, func
 from config import ADMIN_ID, DRIVER_STATUSES
 import json
 import datetime
@@ -313,7 +315,6 @@ def register_driver_handlers(bot: TeleBot):
         
         session.add(new_driver)
         session.commit()
-        session.close()
         
         # Очищаем временные данные
         if user_id in driver_registration_data:
@@ -398,13 +399,11 @@ def register_driver_handlers(bot: TeleBot):
         
         if not driver:
             bot.answer_callback_query(call.id, "Ошибка: водитель не найден")
-            session.close()
             return
         
         old_status = driver.status
         driver.status = status
         session.commit()
-        session.close()
         
         # Уведомляем водителя
         new_status_text = DRIVER_STATUSES.get(status, status)
@@ -463,7 +462,6 @@ def register_driver_handlers(bot: TeleBot):
                 "У вас пока нет заказов.",
                 reply_markup=get_driver_keyboard()
             )
-            session.close()
             return
         
         # Отправляем информацию о каждом заказе
@@ -474,8 +472,6 @@ def register_driver_handlers(bot: TeleBot):
                 order_text,
                 parse_mode="HTML"
             )
-        
-        session.close()
     
     @bot.message_handler(func=lambda message: message.text == "💰 Мой заработок")
     def driver_earnings(message: Message):
@@ -501,37 +497,18 @@ def register_driver_handlers(bot: TeleBot):
             )
             return
         
-        # Получаем заработок водителя
+        # Заработок одним проходом по индексу (driver_id, date_ts, amount);
+        # границы суток, недели и месяца - по местному времени
         session = Session()
-        
-        # Общий заработок
-        total_earnings = session.query(func.sum(Earning.amount)).filter(Earning.driver_id == driver.id).scalar() or 0
-        
-        # Заработок за текущий месяц
-        now = datetime.datetime.utcnow()
-        start_of_month = datetime.datetime(now.year, now.month, 1)
-        monthly_earnings = session.query(func.sum(Earning.amount)).filter(
-            Earning.driver_id == driver.id,
-            Earning.date >= start_of_month
-        ).scalar() or 0
-        
-        # Заработок за текущую неделю
-        today = now.date()
-        start_of_week = today - datetime.timedelta(days=today.weekday())
-        start_of_week = datetime.datetime.combine(start_of_week, datetime.time.min)
-        weekly_earnings = session.query(func.sum(Earning.amount)).filter(
-            Earning.driver_id == driver.id,
-            Earning.date >= start_of_week
-        ).scalar() or 0
-        
-        # Заработок за сегодня
-        start_of_day = datetime.datetime.combine(today, datetime.time.min)
-        daily_earnings = session.query(func.sum(Earning.amount)).filter(
-            Earning.driver_id == driver.id,
-            Earning.date >= start_of_day
-        ).scalar() or 0
-        
-        session.close()
+        starts = timeutils.period_starts()
+        daily_earnings, weekly_earnings, monthly_earnings, total_earnings = (
+            value or 0 for value in session.query(
+                func.sum(case((Earning.date_ts >= starts['day'], Earning.amount))),
+                func.sum(case((Earning.date_ts >= starts['week'], Earning.amount))),
+                func.sum(case((Earning.date_ts >= starts['month'], Earning.amount))),
+                func.sum(Earning.amount),
+            ).filter(Earning.driver_id == driver.id).one()
+        )
         
         # Формируем сообщение
         earnings_text = f"💰 <b>Ваш заработок</b>\n\n"
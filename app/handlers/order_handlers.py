@@ -1,5 +1,5 @@
 from telebot import TeleBot
-from telebot.types import Message, CallbackQuery
+from telebot.types import Message, CallbackQuery, InlineQuery
 from app.keyboards import (
     get_main_keyboard,
     get_popular_destinations_keyboard,
@@ -8,8 +8,10 @@ from app.keyboards import (
     get_rating_keyboard
 )
 from app.utils import save_user_data, get_user_by_id, is_within_city_radius, format_order_info
-from app.database import Session, User, Order, Driver, Review
+from app.utils import addresses, statistics
+from app.database import Session, User, Order, Driver, Review, events
 from config import ADMIN_ID, POPULAR_DESTINATIONS
+from sqlalchemy.orm import selectinload
 import datetime
 
 # Словарь для хранения временных данных заказа
@@ -151,6 +153,11 @@ def register_order_handlers(bot: TeleBot):
             reply_markup=get_order_confirmation_keyboard()
         )
     
+    @bot.inline_handler(func=lambda query: True)
+    def address_inline_query(query: InlineQuery):
+        """Подсказки адресов в инлайн-режиме"""
+        bot.answer_inline_query(query.id, addresses.index.inline_results(query.query), cache_time=60)
+    
     @bot.callback_query_handler(func=lambda call: call.data == "confirm_order")
     def confirm_order_callback(call: CallbackQuery):
         """Обработка подтверждения заказа"""
@@ -182,9 +189,13 @@ def register_order_handlers(bot: TeleBot):
             status="NEW"
         )
         session.add(new_order)
+        # id заказа нужен событию до commit
+        session.flush()
+        events.add_order_event(session, new_order.id, events.EVENT_CREATED, new_status='NEW', actor_id=user_id)
         session.commit()
+        statistics.cache.invalidate()
         order_id = new_order.id
-        session.close()
+        addresses.index.add(order_data['from_address'], order_data['to_address'])
         
         # Уведомляем пользователя
         bot.edit_message_text(
@@ -248,7 +259,14 @@ def register_order_handlers(bot: TeleBot):
         
         # Получаем заказы пользователя
         session = Session()
-        orders = session.query(Order).filter(Order.client_id == user.id).order_by(Order.created_at.desc()).limit(5).all()
+        orders = (
+            session.query(Order)
+            .options(selectinload(Order.review))
+            .filter(Order.client_id == user.id)
+            .order_by(Order.created_at.desc())
+            .limit(5)
+            .all()
+        )
         
         if not orders:
             bot.send_message(message.chat.id, "У вас пока нет заказов.")
@@ -260,9 +278,8 @@ def register_order_handlers(bot: TeleBot):
             # Добавляем кнопку для оценки, если заказ завершен и еще не оценен
             markup = None
             if order.status == "COMPLETED":
-                # Проверяем, есть ли уже отзыв
-                review = session.query(Review).filter(Review.order_id == order.id).first()
-                if not review:
+                # Проверяем, есть ли уже отзыв (загружены вместе с заказами)
+                if not order.review:
                     markup = get_rating_keyboard(order.id)
             
             bot.send_message(
@@ -271,8 +288,6 @@ def register_order_handlers(bot: TeleBot):
                 parse_mode="HTML",
                 reply_markup=markup
             )
-        
-        session.close()
     
     @bot.callback_query_handler(func=lambda call: call.data.startswith("rate:"))
     def process_rating(call: CallbackQuery):
@@ -298,14 +313,12 @@ def register_order_handlers(bot: TeleBot):
         
         if not order:
             bot.answer_callback_query(call.id, "Ошибка: заказ не найден")
-            session.close()
             return
         
         # Проверяем, есть ли уже отзыв
         existing_review = session.query(Review).filter(Review.order_id == order_id).first()
         if existing_review:
             bot.answer_callback_query(call.id, "Вы уже оставили отзыв на этот заказ")
-            session.close()
             return
         
         # Создаем отзыв
@@ -316,8 +329,8 @@ def register_order_handlers(bot: TeleBot):
             rating=rating
         )
         session.add(review)
+        events.add_order_event(session, order_id, events.EVENT_RATED, actor_id=user_id, rating=rating)
         session.commit()
-        session.close()
         
         # Удаляем кнопки оценки
         bot.edit_message_reply_markup(
@@ -346,8 +359,6 @@ def register_order_handlers(bot: TeleBot):
                 review.comment = comment
                 session.commit()
             
-            session.close()
-            
             bot.send_message(
                 message.chat.id,
                 "Спасибо за ваш отзыв! Мы ценим ваше мнение.",
@@ -376,12 +387,11 @@ def register_order_handlers(bot: TeleBot):
         
         if not order:
             bot.answer_callback_query(call.id, "Ошибка: заказ не найден")
-            session.close()
             return
         
+        events.add_order_event(session, order.id, events.EVENT_ACCEPTED, order.status, 'ACCEPTED', call.from_user.id, price=order.price)
         order.status = "ACCEPTED"
         session.commit()
-        session.close()
         
         # Уведомляем пользователя
         bot.edit_message_text(
@@ -415,12 +425,11 @@ def register_order_handlers(bot: TeleBot):
         
         if not order:
             bot.answer_callback_query(call.id, "Ошибка: заказ не найден")
-            session.close()
             return
         
+        events.add_order_event(session, order.id, events.EVENT_DECLINED, order.status, 'DECLINED', call.from_user.id, price=order.price)
         order.status = "DECLINED"
         session.commit()
-        session.close()
         
         # Уведомляем пользователя
         bot.edit_message_text(
@@ -478,12 +487,10 @@ def register_order_handlers(bot: TeleBot):
             
             if not order:
                 bot.send_message(message.chat.id, "Ошибка: заказ не найден")
-                session.close()
                 return
             
             order.counter_offer = price
             session.commit()
-            session.close()
             
             # Уведомляем пользователя
             bot.send_message(
@@ -1,4 +1,4 @@
-from telebot import TeleBot
+from telebot import TeleBot, types
 from telebot.types import Message, CallbackQuery
 from app.keyboards import get_main_keyboard
 from app.utils import save_user_data, get_user_by_id
@@ -74,7 +74,6 @@ def register_user_handlers(bot: TeleBot):
         # Получаем историю заказов
         session = Session()
         orders_count = session.query(User).filter(User.user_id == user_id).count()
-        session.close()
         
         profile_text = f"👤 <b>Ваш профиль</b>\n\n"
         profile_text += f"Имя: {user.first_name or 'Не указано'} {user.last_name or ''}\n"
@@ -113,7 +112,6 @@ def register_user_handlers(bot: TeleBot):
             if user:
                 user.phone_number = phone
                 session.commit()
-            session.close()
             
             bot.send_message(
                 message.chat.id,
@@ -1,3 +1,4 @@
+from app.keyboards.registry import CachedMarkup, cached_keyboard, inline_template
 from app.keyboards.keyboards import (
     get_main_keyboard,
     get_admin_keyboard,
@@ -11,6 +12,9 @@ from app.keyboards.keyboards import (
 )
 
 __all__ = [
+    'CachedMarkup',
+    'cached_keyboard',
+    'inline_template',
     'get_main_keyboard',
     'get_admin_keyboard',
     'get_driver_keyboard',
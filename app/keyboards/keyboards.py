@@ -1,6 +1,8 @@
 from telebot import types
 from config import POPULAR_DESTINATIONS, DRIVER_STATUSES
+from app.keyboards.registry import cached_keyboard, inline_template
 
+@cached_keyboard
 def get_main_keyboard():
     """Основная клавиатура для пользователей"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -8,6 +10,7 @@ def get_main_keyboard():
     markup.add(types.KeyboardButton("📝 Мои заказы"), types.KeyboardButton("📞 Связаться с нами"))
     return markup
 
+@cached_keyboard
 def get_admin_keyboard():
     """Клавиатура для администратора"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -16,6 +19,7 @@ def get_admin_keyboard():
     markup.add(types.KeyboardButton("📈 Статистика"), types.KeyboardButton("🔙 Главное меню"))
     return markup
 
+@cached_keyboard
 def get_driver_keyboard():
     """Клавиатура для водителей"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -24,6 +28,7 @@ def get_driver_keyboard():
     markup.add(types.KeyboardButton("🔙 Главное меню"))
     return markup
 
+@cached_keyboard
 def get_popular_destinations_keyboard():
     """Клавиатура с популярными направлениями"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -33,6 +38,7 @@ def get_popular_destinations_keyboard():
     markup.add(types.KeyboardButton("🔙 Назад"))
     return markup
 
+@cached_keyboard
 def get_order_confirmation_keyboard():
     """Клавиатура для подтверждения заказа"""
     markup = types.InlineKeyboardMarkup()
@@ -42,6 +48,7 @@ def get_order_confirmation_keyboard():
     )
     return markup
 
+@inline_template('order_id')
 def get_price_response_keyboard(order_id):
     """Клавиатура для ответа на предложенную цену"""
     markup = types.InlineKeyboardMarkup()
@@ -52,6 +59,7 @@ def get_price_response_keyboard(order_id):
     markup.add(types.InlineKeyboardButton("💰 Предложить свою цену", callback_data=f"counter_offer:{order_id}"))
     return markup
 
+@cached_keyboard
 def get_driver_status_keyboard():
     """Клавиатура для изменения статуса водителя"""
     markup = types.InlineKeyboardMarkup()
@@ -60,6 +68,7 @@ def get_driver_status_keyboard():
     markup.add(types.InlineKeyboardButton(DRIVER_STATUSES["OFF_DUTY"], callback_data="status:OFF_DUTY"))
     return markup
 
+@inline_template('order_id')
 def get_rating_keyboard(order_id):
     """Клавиатура для оценки поездки"""
     markup = types.InlineKeyboardMarkup(row_width=5)
@@ -67,6 +76,7 @@ def get_rating_keyboard(order_id):
     markup.add(*buttons)
     return markup
 
+@inline_template('action', 'item_id')
 def get_yes_no_keyboard(action, item_id):
     """Универсальная клавиатура да/нет"""
     markup = types.InlineKeyboardMarkup()
@@ -0,0 +1,75 @@
+"""
+Реестр готовых клавиатур.
+
+telebot сериализует reply_markup в JSON при каждой отправке. Статические
+клавиатуры (меню) строятся один раз: @cached_keyboard возвращает один и
+тот же CachedMarkup с готовым JSON. Инлайн-клавиатуры с параметрами
+(номер заказа в callback_data) описываются через @inline_template:
+разметка строится и сериализуется один раз с метками вместо значений,
+а при вызове метки заменяются в готовой JSON-строке. Строку telebot
+передает в API как есть.
+"""
+import functools
+import json
+
+from telebot import types
+
+
+class CachedMarkup(types.JsonSerializable):
+    """Разметка, сериализованная один раз"""
+
+    __slots__ = ('markup', 'json')
+
+    def __init__(self, markup):
+        self.markup = markup
+        self.json = markup.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+def cached_keyboard(builder):
+    """Декоратор: клавиатура без параметров строится при первом вызове и переиспользуется"""
+    cached = None
+
+    @functools.wraps(builder)
+    def get_keyboard():
+        nonlocal cached
+        if cached is None:
+            cached = CachedMarkup(builder())
+        return cached
+
+    get_keyboard.build = builder
+    return get_keyboard
+
+
+def _placeholder(name):
+    return f"@@{name}@@"
+
+
+def inline_template(*params):
+    """
+    Декоратор: инлайн-клавиатура с параметрами params.
+
+    Значения подставляются в строки (callback_data, текст кнопок), поэтому
+    builder не должен выполнять над ними вычислений.
+    """
+    def decorator(builder):
+        template = None
+
+        @functools.wraps(builder)
+        def render(*args, **kwargs):
+            nonlocal template
+            if template is None:
+                template = builder(**{name: _placeholder(name) for name in params}).to_json()
+            values = dict(zip(params, args))
+            values.update(kwargs)
+            result = template
+            for name in params:
+                # json.dumps экранирует кавычки и спецсимволы строковых значений
+                result = result.replace(_placeholder(name), json.dumps(str(values[name]), ensure_ascii=False)[1:-1])
+            return result
+
+        render.build = builder
+        return render
+    return decorator
@@ -5,6 +5,7 @@ from app.utils.helpers import (
     format_order_info,
     format_driver_info,
     calculate_rating,
+    calculate_ratings,
     is_within_city_radius,
     get_admin_order_view
 )
@@ -16,6 +17,7 @@ __all__ = [
     'format_order_info',
     'format_driver_info',
     'calculate_rating',
+    'calculate_ratings',
     'is_within_city_radius',
     'get_admin_order_view'
 ]
@@ -0,0 +1,313 @@
+"""
+Подсказки адресов (инлайн-режим бота).
+
+Клиент набирает "@бот морск" в поле ввода, Telegram присылает inline_query
+на каждое изменение текста, и ответ нужен сразу. AddressIndex хранит
+адреса в памяти:
+
+  * адрес нормализуется: нижний регистр, е вместо ё, без знаков
+    препинания и служебных слов ("ул.", "г.", "д." ...);
+  * ключи поиска - хвосты нормализованного адреса, начинающиеся с
+    каждого слова ("светлогорск морская 5", "морская 5"), поэтому
+    "морск" находит адрес и без названия города;
+  * ключи лежат в отсортированном списке, совпадения по префиксу - один
+    отрезок, который находится двумя bisect;
+  * порядок подсказок - по числу заказов с этим адресом. Для коротких
+    префиксов с длинным отрезком лучшие адреса кэшируются, и add()
+    обновляет этот кэш, не пересчитывая отрезок.
+
+Источники: адреса отправления и назначения из истории заказов, улицы
+города (CITY_STREETS) и популярные направления. Новые заказы добавляются
+через add() без перестроения индекса. Индекс загружается при запуске
+(main.warm_up, в том числе у резерва), до загрузки подсказок нет;
+refresh() догружает заказы, созданные после загрузки.
+
+DestinationMatcher распознает набранный текстом город назначения
+("калининград", "храброво", "зеленоградск" с опечаткой) по триграммам:
+сходство - доля общих триграмм (коэффициент Жаккара) с названием или
+одним из его слов, не ниже порога DESTINATION_SIMILARITY (для вариантов
+из одного слова - DESTINATION_WORD_SIMILARITY). Улицы города и их начала
+нечетко не сопоставляются: "ул. Балтийская" - это не г.Балтийск.
+Нечеткое совпадение - только догадка, клиента нужно переспросить.
+"""
+import bisect
+import heapq
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from telebot import types
+
+from app.utils import metrics
+from config import CITY_NAME, CITY_STREETS, KNOWN_SETTLEMENTS, POPULAR_DESTINATIONS
+
+logger = logging.getLogger(__name__)
+
+# Сколько подсказок показывать и сколько ключей просматривать без кэша
+SUGGESTIONS = 10
+MAX_SCAN = 256
+
+_SEPARATORS = re.compile(r'[^\w]+')
+_STOP_WORDS = frozenset({
+    'г', 'гор', 'город', 'пгт', 'п', 'пос', 'поселок', 'ул', 'улица', 'д', 'дом',
+    'пр', 'пр-т', 'просп', 'пер', 'переулок', 'кв', 'корп', 'к', 'стр',
+})
+# Символ больше любого в ключах: верхняя граница отрезка префикса
+_HIGH = '\uffff'
+# Порог сходства названий и насколько лучший вариант должен опережать другой город
+DESTINATION_SIMILARITY = 0.45
+DESTINATION_MARGIN = 0.1
+# Однословные варианты сравниваются строже: короткое слово легко похоже
+# на чужое ("балтийская" и "балтийск", "пионерская" и "пионерский")
+DESTINATION_WORD_SIMILARITY = 0.6
+
+
+def normalize(text) -> List[str]:
+    """Слова адреса для поиска"""
+    text = (text or '').lower().replace('ё', 'е')
+    return [word for word in _SEPARATORS.split(text) if word and word not in _STOP_WORDS]
+
+
+def trigrams(words) -> frozenset:
+    """Триграммы слов; пробелы по краям выделяют начало и конец слова"""
+    grams = set()
+    for word in words:
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class AddressIndex:
+    def __init__(self, limit=SUGGESTIONS, max_scan=MAX_SCAN):
+        self.limit = limit
+        self.max_scan = max_scan
+        # Нормализованный адрес -> [адрес для вывода, число заказов]
+        self._addresses: Dict[str, list] = {}
+        # Отсортированные пары (ключ, нормализованный адрес)
+        self._entries: List[Tuple[str, str]] = []
+        self._hot: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Последний заказ, учтенный в индексе (для refresh)
+        self._last_order_id = 0
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def _add(self, address, weight, keys=None):
+        """keys - список, куда складываются ключи при загрузке (сортируется один раз)"""
+        address = (address or '').strip()
+        words = normalize(address)
+        if not words:
+            return None
+        norm = ' '.join(words)
+        item = self._addresses.get(norm)
+        if item is not None:
+            item[1] += weight
+            return norm
+        self._addresses[norm] = [address, weight]
+        for i, word in enumerate(words):
+            # Номер дома сам по себе не подсказывает адрес
+            if word.isdigit():
+                continue
+            if keys is None:
+                bisect.insort(self._entries, (' '.join(words[i:]), norm))
+            else:
+                keys.append((' '.join(words[i:]), norm))
+        return norm
+
+    def _rank(self, norm):
+        address, weight = self._addresses[norm]
+        return -weight, len(address), address
+
+    def _promote(self, norm):
+        """Обновляет кэш префиксов, под которые попадает адрес (число заказов только растет)"""
+        if not self._hot:
+            return
+        words = norm.split()
+        keys = [' '.join(words[i:]) for i in range(len(words))]
+        for prefix, top in self._hot.items():
+            if any(key.startswith(prefix) for key in keys):
+                if norm not in top:
+                    top.append(norm)
+                top.sort(key=self._rank)
+                del top[self.limit:]
+
+    def load(self, conn):
+        """Строит индекс по истории заказов и списку улиц"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT IFNULL(MAX(id), 0) FROM orders')
+        last_order_id = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT address, COUNT(*) FROM (
+                SELECT from_address AS address FROM orders WHERE from_lat IS NULL AND id <= ?
+                UNION ALL
+                SELECT to_address FROM orders WHERE id <= ?
+            )
+            WHERE address IS NOT NULL
+            GROUP BY address
+        ''', (last_order_id, last_order_id))
+        rows = cursor.fetchall()
+        with self._lock:
+            self._addresses.clear()
+            self._entries.clear()
+            self._hot.clear()
+            for street in CITY_STREETS:
+                self._add(f"{CITY_NAME}, {street}", 0, self._entries)
+            for destination in POPULAR_DESTINATIONS:
+                self._add(destination, 0, self._entries)
+            for address, count in rows:
+                self._add(address, count, self._entries)
+            self._entries.sort()
+            self._last_order_id = last_order_id
+            self._loaded = True
+        return len(self._addresses)
+
+    def refresh(self, conn):
+        """Добавляет адреса заказов, созданных после load (резерв стал ведущим)"""
+        if not self._loaded:
+            return self.load(conn)
+        rows = conn.execute(
+            'SELECT id, CASE WHEN from_lat IS NULL THEN from_address END, to_address FROM orders WHERE id > ? ORDER BY id',
+            (self._last_order_id,)
+        ).fetchall()
+        for order_id, from_address, to_address in rows:
+            self.add(from_address, to_address)
+            self._last_order_id = order_id
+        return len(rows)
+
+    def add(self, *addresses):
+        """Адреса нового заказа. До загрузки индекса ничего не делает - заказ уже в базе"""
+        if not self._loaded:
+            return
+        with self._lock:
+            for address in addresses:
+                norm = self._add(address, 1)
+                if norm is not None:
+                    self._promote(norm)
+
+    def complete(self, text, limit=None) -> List[str]:
+        """Адреса, слова которых начинаются с набранного текста, популярные первыми"""
+        limit = limit or self.limit
+        prefix = ' '.join(normalize(text))
+        with self._lock:
+            top = self._hot.get(prefix)
+            if top is None:
+                lo = bisect.bisect_left(self._entries, (prefix,))
+                hi = bisect.bisect_left(self._entries, (prefix + _HIGH,), lo)
+                found = {norm for _, norm in self._entries[lo:hi]}
+                top = heapq.nsmallest(self.limit, found, key=self._rank)
+                if hi - lo > self.max_scan:
+                    self._hot[prefix] = top
+                metrics.registry.inc('address_suggestions_total', result='found' if top else 'empty')
+            else:
+                metrics.registry.inc('address_suggestions_total', result='cached')
+            return [self._addresses[norm][0] for norm in top[:limit]]
+
+    def inline_results(self, text) -> List[types.InlineQueryResultArticle]:
+        """Ответ на inline_query: выбранный адрес отправляется в чат текстом"""
+        return [
+            types.InlineQueryResultArticle(
+                id=str(i),
+                title=address,
+                input_message_content=types.InputTextMessageContent(address)
+            )
+            for i, address in enumerate(self.complete(text))
+        ]
+
+
+class DestinationMatcher:
+    """Нечеткий поиск города назначения по списку названий"""
+
+    def __init__(self, names, streets=(), threshold=DESTINATION_SIMILARITY,
+                 word_threshold=DESTINATION_WORD_SIMILARITY, margin=DESTINATION_MARGIN):
+        self.margin = margin
+        self._exact: Dict[str, str] = {}
+        # Отдельные слова названий ("храброво"), если слово есть только у одного названия
+        self._words: Dict[str, str] = {}
+        shared = set()
+        # Улицы города: их и их начала не сопоставляем с городами
+        self._streets = [' '.join(normalize(street)) for street in streets]
+        # Варианты написания: (название, триграммы, порог) - полное название и отдельные слова
+        self._aliases: List[Tuple[str, frozenset, float]] = []
+        self._by_gram: Dict[str, List[int]] = {}
+        for name in names:
+            words = normalize(name)
+            if not words:
+                continue
+            self._exact[name] = name
+            self._exact.setdefault(' '.join(words), name)
+            for word in words:
+                if len(word) >= 4 and self._words.setdefault(word, name) != name:
+                    shared.add(word)
+            variants = {tuple(words)} | {(word,) for word in words if len(word) >= 4}
+            for variant in variants:
+                grams = trigrams(variant)
+                self._aliases.append((name, grams, word_threshold if len(variant) == 1 else threshold))
+                for gram in grams:
+                    self._by_gram.setdefault(gram, []).append(len(self._aliases) - 1)
+        for word in shared:
+            del self._words[word]
+
+    def is_street(self, text) -> bool:
+        """Текст - улица города или начало ее названия"""
+        key = ' '.join(normalize(text))
+        return bool(key) and any(street.startswith(key) for street in self._streets)
+    
+    def _ranked(self, text) -> List[Tuple[float, str, float]]:
+        grams = trigrams(normalize(text))
+        common = Counter()
+        for gram in grams:
+            common.update(self._by_gram.get(gram, ()))
+        best: Dict[str, Tuple[float, float]] = {}
+        for alias, count in common.items():
+            name, alias_grams, threshold = self._aliases[alias]
+            score = count / (len(grams) + len(alias_grams) - count)
+            if score > best.get(name, (0, 0))[0]:
+                best[name] = (score, threshold)
+        return sorted(((score, name, threshold) for name, (score, threshold) in best.items()), reverse=True)
+
+    def scores(self, text) -> List[Tuple[float, str]]:
+        """[(сходство, название)] по убыванию, лучшее сходство для каждого названия"""
+        return [(score, name) for score, name, _ in self._ranked(text)]
+    
+    def exact(self, text) -> Optional[str]:
+        """Название, набранное без ошибок: целиком или одним его словом"""
+        if not text:
+            return None
+        key = ' '.join(normalize(text))
+        name = self._exact.get(text) or self._exact.get(key)
+        if name is None and not self.is_street(text):
+            name = self._words.get(key)
+        return name
+    
+    def match(self, text) -> Optional[str]:
+        """
+        Название, которое имел в виду клиент, или None, если уверенного
+        совпадения нет. Если exact() ничего не нашел, это догадка - ее
+        подтверждает клиент.
+        """
+        name = self.exact(text)
+        if name is not None or not text:
+            return name
+        if self.is_street(text):
+            metrics.registry.inc('destination_match_total', result='street')
+            return None
+        ranked = self._ranked(text)
+        if not ranked or ranked[0][0] < ranked[0][2]:
+            metrics.registry.inc('destination_match_total', result='none')
+            return None
+        if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < self.margin:
+            metrics.registry.inc('destination_match_total', result='ambiguous')
+            return None
+        metrics.registry.inc('destination_match_total', result='fuzzy')
+        return ranked[0][1]
+
+
+# Общий индекс для обоих наборов обработчиков
+index = AddressIndex()
+# Популярные направления и населенные пункты области
+destinations = DestinationMatcher(POPULAR_DESTINATIONS + KNOWN_SETTLEMENTS, CITY_STREETS)
+
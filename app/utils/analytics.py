@@ -0,0 +1,217 @@
+"""
+Аналитика спроса для планирования смен водителей.
+
+История заказов за ANALYTICS_DAYS читается пачками по CHUNK_ROWS строк
+прямо в структурированный массив NumPy (статус кодируется в SQL), затем
+раскладывается по столбцам: время создания, время подачи, направление,
+цена и статус. Дальше все считается над массивами целиком, без циклов
+по заказам:
+
+  * спрос по дням недели и часам - матрица 7 x 24 по местному времени
+    подачи (для предзаказа - scheduled_ts), в среднем за неделю;
+  * конверсия предложенной цены: доля заказов с ценой, которые клиент
+    принял (статус ACCEPTED и дальше);
+  * число заказов, средняя цена и конверсия по направлениям.
+
+Направление - популярное направление или населенный пункт из
+app.utils.addresses.destinations, поездки по городу или "Другое".
+Модуль тяжелый (NumPy), поэтому обработчик импортирует его при первом
+запросе отчета.
+"""
+import datetime
+import time
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import numpy as np
+
+from app.utils import addresses, metrics, timeutils
+from config import ANALYTICS_DAYS, CITY_NAME
+
+CHUNK_ROWS = 50000
+# Сколько часов пик и направлений показывать в отчете
+TOP_SLOTS = 5
+TOP_DESTINATIONS = 10
+
+STATUSES = ('NEW', 'PRICE_OFFERED', 'COUNTER_OFFERED', 'ACCEPTED', 'DECLINED',
+            'IN_PROGRESS', 'ARRIVED', 'COMPLETED', 'CANCELLED')
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+# Клиент согласился с ценой: заказ дошел до ACCEPTED или дальше
+ACCEPTED_STATUSES = ('ACCEPTED', 'IN_PROGRESS', 'ARRIVED', 'COMPLETED')
+
+OTHER_DESTINATION = "Другое"
+
+_STATUS_CASE = 'CASE status ' + ' '.join(
+    f"WHEN '{status}' THEN {code}" for status, code in _STATUS_CODES.items()
+) + ' ELSE -1 END'
+_LOAD_SQL = f'''
+    SELECT created_ts, IFNULL(scheduled_ts, 0), IFNULL(price, 0), {_STATUS_CASE}, to_address
+    FROM orders
+    WHERE {{created}} >= ?
+'''
+# Строка заказа в массиве; адрес заменяется номером направления после загрузки
+_ROW_DTYPE = np.dtype([
+    ('created', np.int64), ('scheduled', np.int64), ('price', np.float64), ('status', np.int8), ('address', object),
+])
+# Если период покрывает большую часть таблицы, последовательное чтение
+# быстрее поиска каждой строки по индексу created_ts
+_SCAN_SHARE = 0.3
+
+
+@dataclass
+class OrderArrays:
+    """Заказы периода по столбцам"""
+    created: np.ndarray      # int64, секунды Unix
+    pickup: np.ndarray       # int64, время подачи (scheduled_ts или created_ts)
+    destination: np.ndarray  # int32, индекс в destinations
+    price: np.ndarray        # float64, 0 - цена не предлагалась
+    status: np.ndarray       # int8, индекс в STATUSES
+    destinations: List[str]
+
+    def __len__(self):
+        return len(self.created)
+
+
+def destination_category(address):
+    """Направление для отчета по адресу назначения"""
+    head = (address or '').partition(',')[0]
+    match = addresses.destinations.match(head)
+    if match is not None:
+        return match
+    if CITY_NAME.lower() in (address or '').lower():
+        return CITY_NAME
+    return OTHER_DESTINATION
+
+
+def load_orders(conn, since, chunk=CHUNK_ROWS) -> OrderArrays:
+    """Заказы, созданные не раньше since, в массивах"""
+    cursor = conn.cursor()
+    # np.fromiter читает кортежи, а не sqlite3.Row
+    cursor.row_factory = None
+    cursor.execute('SELECT (SELECT COUNT(*) FROM orders WHERE created_ts >= ?), (SELECT COUNT(*) FROM orders)', (since,))
+    selected, total = cursor.fetchone()
+    use_scan = total and selected / total > _SCAN_SHARE
+    cursor.execute(_LOAD_SQL.format(created='+created_ts' if use_scan else 'created_ts'), (since,))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            break
+        chunks.append(np.fromiter(rows, _ROW_DTYPE, len(rows)))
+    table = np.concatenate(chunks) if chunks else np.zeros(0, _ROW_DTYPE)
+
+    # Направление считается один раз на уникальный адрес
+    address_ids = {}
+    address = np.fromiter(
+        (address_ids.setdefault(value, len(address_ids)) for value in table['address']), np.int32, len(table)
+    )
+    destination_ids = {}
+    category_of_address = np.fromiter(
+        (destination_ids.setdefault(category, len(destination_ids))
+         for category in map(destination_category, address_ids)),
+        np.int32, len(address_ids)
+    )
+    return OrderArrays(
+        created=table['created'],
+        pickup=np.where(table['scheduled'] > 0, table['scheduled'], table['created']),
+        destination=category_of_address[address] if len(address_ids) else address,
+        price=table['price'],
+        status=table['status'],
+        destinations=list(destination_ids),
+    )
+
+
+def local_hour_weekday(ts) -> Tuple[np.ndarray, np.ndarray]:
+    """Местные час (0-23) и день недели (0 - понедельник) для массива секунд Unix"""
+    if not len(ts):
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    # Смещение часового пояса меняется не чаще раза в час: считаем его
+    # для каждого уникального часа, а не для каждого заказа
+    hours, inverse = np.unique(ts // 3600, return_inverse=True)
+    offsets = np.fromiter(
+        (timeutils.from_epoch(int(hour) * 3600).utcoffset().total_seconds() for hour in hours),
+        np.int64, len(hours)
+    )
+    local = ts + offsets[inverse]
+    # 1 января 1970 года - четверг
+    return (local // 3600) % 24, (local // 86400 + 3) % 7
+
+
+@dataclass
+class DestinationStats:
+    name: str
+    orders: int
+    avg_price: float
+    conversion: float
+
+
+@dataclass
+class DemandReport:
+    generated_at: datetime.datetime
+    days: int
+    orders: int = 0
+    # Среднее число заказов за неделю: [день недели][час]
+    matrix: List[List[float]] = field(default_factory=lambda: [[0.0] * 24 for _ in range(7)])
+    by_weekday: List[float] = field(default_factory=lambda: [0.0] * 7)
+    by_hour: List[float] = field(default_factory=lambda: [0.0] * 24)
+    # Часы пик: (день недели, час, заказов в среднем за неделю)
+    peaks: List[Tuple[int, int, float]] = field(default_factory=list)
+    offered: int = 0
+    accepted: int = 0
+    destinations: List[DestinationStats] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def conversion(self):
+        return self.accepted / self.offered if self.offered else 0.0
+
+
+def build_report(orders: OrderArrays, days, now=None) -> DemandReport:
+    now = timeutils.to_local(now)
+    report = DemandReport(generated_at=now, days=days, orders=len(orders))
+    if not len(orders):
+        return report
+    # Средние за неделю - по времени, которое реально покрывает история
+    covered = (timeutils.to_epoch(now) - int(orders.created.min())) / 86400
+    weeks = max(1.0, min(days, covered)) / 7
+
+    hour, weekday = local_hour_weekday(orders.pickup)
+    counts = np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24) / weeks
+    report.matrix = counts.round(2).tolist()
+    report.by_weekday = counts.sum(axis=1).round(2).tolist()
+    report.by_hour = counts.sum(axis=0).round(2).tolist()
+    flat = counts.ravel()
+    top = np.argsort(flat, kind='stable')[::-1][:TOP_SLOTS]
+    report.peaks = [(int(slot // 24), int(slot % 24), float(flat[slot])) for slot in top if flat[slot] > 0]
+
+    offered = orders.price > 0
+    accepted = offered & np.isin(orders.status, [_STATUS_CODES[status] for status in ACCEPTED_STATUSES])
+    report.offered = int(offered.sum())
+    report.accepted = int(accepted.sum())
+
+    # Суммы по направлениям одним bincount на показатель
+    size = len(orders.destinations)
+    per_destination = np.bincount(orders.destination, minlength=size)
+    offered_count = np.bincount(orders.destination, weights=offered, minlength=size)
+    accepted_count = np.bincount(orders.destination, weights=accepted, minlength=size)
+    price_sum = np.bincount(orders.destination, weights=np.where(offered, orders.price, 0), minlength=size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_price = np.where(offered_count > 0, price_sum / offered_count, 0)
+        conversion = np.where(offered_count > 0, accepted_count / offered_count, 0)
+    for i in np.argsort(per_destination, kind='stable')[::-1][:TOP_DESTINATIONS]:
+        if per_destination[i]:
+            report.destinations.append(DestinationStats(
+                orders.destinations[i], int(per_destination[i]), float(avg_price[i]), float(conversion[i])
+            ))
+    return report
+
+
+def demand_report(conn, days=ANALYTICS_DAYS, now=None) -> DemandReport:
+    """Отчет о спросе за последние days дней"""
+    started = time.perf_counter()
+    now = timeutils.to_local(now)
+    since = timeutils.to_epoch(now - datetime.timedelta(days=days))
+    report = build_report(load_orders(conn, since), days, now)
+    report.elapsed = time.perf_counter() - started
+    metrics.registry.histogram('demand_report_seconds').observe(report.elapsed)
+    return report
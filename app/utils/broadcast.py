@@ -0,0 +1,182 @@
+"""
+Массовая рассылка с ограничением скорости.
+
+Telegram допускает около 30 сообщений в секунду на бота; при превышении
+отвечает 429 с retry_after. Broadcaster отправляет сообщения из пула
+потоков, общая скорость ограничена TokenBucket, а ответ 429 обрабатывается
+повтором после указанной паузы. Ход рассылки сообщается через on_progress
+(например, для редактирования сообщения администратора).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+from app.utils import metrics
+from config import BROADCAST_RATE, BROADCAST_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять сообщение после 429
+MAX_RETRIES = 3
+# Telegram принимает до 4096 символов; запас на разметку
+MESSAGE_LIMIT = 4000
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ждет и забирает один токен"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Сдвигает выдачу токенов (ответ 429 с retry_after)"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+@dataclass
+class Notification:
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+
+def _kwargs_key(kwargs):
+    """Ключ параметров отправки: клавиатуры сравниваются по JSON"""
+    return tuple(sorted(
+        (name, value.to_json() if hasattr(value, 'to_json') else repr(value))
+        for name, value in kwargs.items()
+    ))
+
+
+def dedupe_notifications(notifications, limit=MESSAGE_LIMIT):
+    """
+    Меньше сообщений на получателя: повторы текста в одном чате
+    отбрасываются, разные тексты с одинаковыми параметрами (клавиатура,
+    parse_mode) склеиваются в сообщения не длиннее limit
+    """
+    merged = {}
+    seen_texts = {}
+    result = []
+    for item in notifications:
+        texts = seen_texts.setdefault(item.chat_id, set())
+        if item.text in texts:
+            continue
+        texts.add(item.text)
+        key = (item.chat_id, _kwargs_key(item.kwargs))
+        existing = merged.get(key)
+        if existing is not None and len(existing.text) + 2 + len(item.text) <= limit:
+            existing.text += "\n\n" + item.text
+            continue
+        merged[key] = Notification(item.chat_id, item.text, dict(item.kwargs))
+        result.append(merged[key])
+    return result
+
+
+class Broadcaster:
+    def __init__(self, bot, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+
+    def _send(self, item):
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+                return True
+            except ApiTelegramException as e:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+                if e.error_code == 429 and retry_after and attempt < MAX_RETRIES:
+                    metrics.registry.inc('broadcast_throttled_total')
+                    self.bucket.pause(retry_after)
+                    continue
+                logger.error(f"Ошибка рассылки в чат {item.chat_id}: {e}")
+                return False
+            except Exception as e:
+                logger.error(f"Ошибка рассылки в чат {item.chat_id}: {e}")
+                return False
+        return False
+
+    def send(self, notifications: List[Notification],
+             on_progress: Optional[Callable[[BroadcastResult], None]] = None,
+             progress_interval: float = 1.0) -> BroadcastResult:
+        """Отправляет сообщения и ждет завершения; on_progress - не чаще progress_interval"""
+        result = BroadcastResult(total=len(notifications))
+        started = time.perf_counter()
+        last_progress = started
+        lock = threading.Lock()
+
+        def send_one(item):
+            nonlocal last_progress
+            ok = self._send(item)
+            metrics.registry.inc('broadcast_messages_total', status='sent' if ok else 'failed')
+            with lock:
+                if ok:
+                    result.sent += 1
+                else:
+                    result.failed += 1
+                now = time.perf_counter()
+                report = on_progress is not None and now - last_progress >= progress_interval and result.done < result.total
+                if report:
+                    last_progress = now
+            if report:
+                try:
+                    on_progress(result)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления прогресса рассылки: {e}")
+
+        if notifications:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(notifications)), thread_name_prefix='broadcast') as pool:
+                list(pool.map(send_one, notifications))
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def send_in_background(self, notifications, on_progress=None, on_done=None, progress_interval=1.0):
+        """То же в отдельном потоке, чтобы не держать обработчик апдейта"""
+        def run():
+            result = self.send(notifications, on_progress, progress_interval)
+            if on_done is not None:
+                try:
+                    on_done(result)
+                except Exception as e:
+                    logger.error(f"Ошибка завершения рассылки: {e}")
+
+        thread = threading.Thread(target=run, name='broadcast-runner', daemon=True)
+        thread.start()
+        return thread
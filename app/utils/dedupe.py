@@ -0,0 +1,110 @@
+"""
+Отсев повторных апдейтов до обработчиков.
+
+Два окна:
+  * update_id - повторная доставка после перезапуска polling;
+  * (чат, сообщение, callback_data) - двойное нажатие инлайн-кнопки.
+    Окно короткое, чтобы осознанное повторное нажатие позже проходило.
+
+install_dedupe(bot) оборачивает bot.process_new_updates. Отброшенные
+апдейты считаются в метрике updates_deduplicated_total{kind=...}.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils import metrics
+from config import DEDUPE_UPDATE_SECONDS, DEDUPE_CALLBACK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class DedupeWindow:
+    """Множество ключей с временем жизни и ограничением размера"""
+
+    def __init__(self, ttl, max_size=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key):
+        """Возвращает True, если ключ уже встречался в окне; иначе запоминает его"""
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def _expire(self, now):
+        # Ключи добавляются по времени, поэтому устаревшие всегда в начале
+        deadline = now - self.ttl
+        while self._seen:
+            key, added = next(iter(self._seen.items()))
+            if added > deadline:
+                break
+            self._seen.popitem(last=False)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class UpdateDeduplicator:
+    def __init__(self, update_ttl=DEDUPE_UPDATE_SECONDS, callback_ttl=DEDUPE_CALLBACK_SECONDS):
+        self.updates = DedupeWindow(update_ttl)
+        self.callbacks = DedupeWindow(callback_ttl)
+
+    def duplicate_kind(self, update):
+        """'update' / 'callback' для повтора, None для нового апдейта"""
+        if self.updates.seen(update.update_id):
+            return 'update'
+        call = update.callback_query
+        if call is not None and call.message is not None and call.data:
+            key = (call.message.chat.id, call.message.message_id, call.data)
+            if self.callbacks.seen(key):
+                return 'callback'
+        return None
+
+    def filter(self, updates):
+        fresh = []
+        dropped = []
+        for update in updates:
+            kind = self.duplicate_kind(update)
+            if kind is None:
+                fresh.append(update)
+            else:
+                metrics.registry.inc('updates_deduplicated_total', kind=kind)
+                dropped.append((kind, update))
+        return fresh, dropped
+
+
+def install_dedupe(bot, deduplicator=None):
+    """Оборачивает bot.process_new_updates отсевом повторов"""
+    if getattr(bot.process_new_updates, '_deduplicated', False):
+        return bot
+    deduplicator = deduplicator or UpdateDeduplicator()
+    original_process = bot.process_new_updates
+
+    def process_new_updates(updates):
+        fresh, dropped = deduplicator.filter(updates)
+        for kind, update in dropped:
+            logger.info(f"Повторный апдейт {update.update_id} ({kind}) отброшен")
+            if kind == 'callback':
+                # Гасим «часики» на кнопке, обработчик уже работает по первому нажатию
+                try:
+                    bot.answer_callback_query(update.callback_query.id)
+                except Exception as e:
+                    logger.error(f"Ошибка ответа на повторное нажатие: {e}")
+        if fresh:
+            original_process(fresh)
+
+    process_new_updates._deduplicated = True
+    bot.process_new_updates = process_new_updates
+    bot.deduplicator = deduplicator
+    return bot
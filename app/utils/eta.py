@@ -0,0 +1,281 @@
+"""
+Время подачи машины для клиента.
+
+После назначения водителя клиент получает одно сообщение, которое бот
+редактирует по мере движения водителя (геопозиции из LocationTracker):
+"Водитель прибудет примерно через N мин". Правки ограничены одной в
+ETA_EDIT_SECONDS на чат, текст без изменений не отправляется. Слежение
+прекращается, когда водитель отмечает прибытие (ARRIVED), заказ
+завершается, отменяется или отклоняется, либо через ETA_WATCH_SECONDS:
+просроченные слежения снимает поток записи LocationTracker (add_sweeper),
+даже если от водителя больше нет точек.
+
+Время в пути считает SpeedModel: расстояние по прямой, умноженное на
+коэффициент извилистости дорог, делится на среднюю скорость для часа
+суток. Профиль скоростей уточняется по фактическим перемещениям
+водителей и хранится в bot_meta.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from telebot.apihelper import ApiTelegramException
+
+from app.database import repository
+from app.utils import metrics, timeutils
+from app.utils.geo import haversine_km
+from config import ETA_DETOUR_FACTOR, ETA_SPEED_KMH, ETA_EDIT_SECONDS, ETA_WATCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Ближе этого расстояния (км) водитель считается подъезжающим
+ARRIVING_KM = 0.15
+# Границы правдоподобных наблюдений: скорость (км/ч) и интервал между точками (с)
+_OBSERVED_SPEED = (3, 90)
+_OBSERVED_INTERVAL = (20, 600)
+
+
+def _base_profile(speed):
+    """Начальный профиль: часы пик медленнее, ночью быстрее"""
+    profile = [speed] * 24
+    for hour in (7, 8, 9, 17, 18, 19):
+        profile[hour] = speed * 0.75
+    for hour in range(0, 6):
+        profile[hour] = speed * 1.3
+    return profile
+
+
+class SpeedModel:
+    """Средняя скорость по дорогам района по часам суток, км/ч"""
+
+    META_KEY = 'eta_speed_model'
+
+    def __init__(self, speed=ETA_SPEED_KMH, detour=ETA_DETOUR_FACTOR, alpha=0.05):
+        self.detour = detour
+        self.alpha = alpha
+        self._speeds = _base_profile(speed)
+        self._anchors = {}  # водитель -> точка начала текущего отрезка наблюдения
+        self._lock = threading.Lock()
+
+    def speed(self, hour):
+        return self._speeds[hour]
+
+    def travel_minutes(self, distance_km, hour):
+        """Минуты в пути по дорогам, округление вверх"""
+        return max(1, math.ceil(distance_km * self.detour / self.speed(hour) * 60))
+
+    def observe(self, fix):
+        """
+        Уточняет скорость часа по перемещению водителя. Точки трансляции
+        приходят каждые несколько секунд, поэтому скорость считается на
+        отрезке не короче _OBSERVED_INTERVAL[0] от опорной точки.
+        """
+        with self._lock:
+            anchor = self._anchors.get(fix.driver_id)
+            seconds = fix.ts - anchor.ts if anchor is not None else None
+            if seconds is not None and seconds < _OBSERVED_INTERVAL[0]:
+                return
+            self._anchors[fix.driver_id] = fix
+            if seconds is None or seconds > _OBSERVED_INTERVAL[1]:
+                return
+            distance = haversine_km(anchor.lat, anchor.lon, fix.lat, fix.lon) * self.detour
+            speed = distance / (seconds / 3600)
+            # Стоянки и скачки GPS не учитываем
+            if not _OBSERVED_SPEED[0] <= speed <= _OBSERVED_SPEED[1]:
+                return
+            hour = timeutils.from_epoch(fix.ts).hour
+            self._speeds[hour] += self.alpha * (speed - self._speeds[hour])
+
+    def dump(self):
+        with self._lock:
+            return json.dumps([round(speed, 2) for speed in self._speeds])
+
+    def load(self, value):
+        try:
+            speeds = [float(speed) for speed in json.loads(value)]
+        except (TypeError, ValueError):
+            return False
+        if len(speeds) != 24:
+            return False
+        with self._lock:
+            self._speeds = speeds
+        return True
+
+
+@dataclass
+class EtaWatch:
+    order_id: int
+    chat_id: int
+    message_id: int
+    driver_id: int
+    lat: float
+    lon: float
+    header: str
+    started: float
+    text: str = ''
+
+
+class EtaNotifier:
+    def __init__(self, bot, tracker, model=None, connect=repository.connect,
+                 edit_interval=ETA_EDIT_SECONDS, watch_seconds=ETA_WATCH_SECONDS):
+        self.bot = bot
+        self.tracker = tracker
+        self.model = model or SpeedModel()
+        self.edit_interval = edit_interval
+        self.watch_seconds = watch_seconds
+        self._connect = connect
+        self._watches: Dict[int, EtaWatch] = {}
+        self._by_driver: Dict[int, Set[int]] = {}
+        self._next_edit: Dict[int, float] = {}  # чат -> время, раньше которого не редактируем
+        self._lock = threading.Lock()
+        self._model_loaded = False
+        tracker.add_listener(self.on_fix)
+        tracker.add_sweeper(self.sweep)
+
+    def _ensure_model(self):
+        if self._model_loaded:
+            return
+        self._model_loaded = True
+        conn = self._connect()
+        try:
+            value = repository.get_meta(conn, SpeedModel.META_KEY)
+        finally:
+            conn.close()
+        if value:
+            self.model.load(value)
+
+    def _save_model(self):
+        conn = self._connect()
+        try:
+            repository.set_meta(conn, SpeedModel.META_KEY, self.model.dump())
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения модели скоростей: {e}")
+        finally:
+            conn.close()
+
+    def eta_text(self, watch, fix, now=None):
+        now = now or time.time()
+        if fix is None or not self.tracker.is_fresh(fix, now):
+            return "⏱ Водитель скоро прибудет на место посадки."
+        distance = haversine_km(fix.lat, fix.lon, watch.lat, watch.lon)
+        if distance <= ARRIVING_KM:
+            return "⏱ Водитель подъезжает к месту посадки."
+        minutes = self.model.travel_minutes(distance, timeutils.from_epoch(now).hour)
+        return f"⏱ Водитель прибудет примерно через {minutes} мин ({distance:.1f} км)."
+
+    def start(self, order_id, chat_id, driver_id, header, pickup=None):
+        """
+        Отправляет клиенту сообщение о назначенном водителе. Если известна
+        геопозиция точки А (lat, lon), сообщение будет обновляться.
+        """
+        if pickup is None or pickup[0] is None:
+            return self.bot.send_message(chat_id, header + "Водитель скоро прибудет на место посадки.", parse_mode="HTML")
+        self._ensure_model()
+        now = time.time()
+        watch = EtaWatch(order_id, chat_id, 0, driver_id, pickup[0], pickup[1], header, now)
+        watch.text = self.eta_text(watch, self.tracker.get(driver_id), now)
+        message = self.bot.send_message(chat_id, header + watch.text, parse_mode="HTML")
+        watch.message_id = message.message_id
+        with self._lock:
+            self._drop(order_id)
+            self._watches[order_id] = watch
+            self._by_driver.setdefault(driver_id, set()).add(order_id)
+            self._next_edit[chat_id] = now + self.edit_interval
+        metrics.registry.inc('eta_watches_total', result='started')
+        # Просроченные слежения снимает поток записи геопозиций, даже если точек нет
+        self.tracker.start()
+        return message
+
+    def on_fix(self, fix, previous):
+        """Новая точка водителя (вызывается LocationTracker)"""
+        self.model.observe(fix)
+        if fix.driver_id not in self._by_driver:
+            return
+        now = time.time()
+        due = []
+        expired = []
+        with self._lock:
+            for order_id in self._by_driver.get(fix.driver_id, ()):
+                watch = self._watches[order_id]
+                if now - watch.started > self.watch_seconds:
+                    expired.append(order_id)
+                    continue
+                if now < self._next_edit.get(watch.chat_id, 0):
+                    continue
+                text = self.eta_text(watch, fix, now)
+                if text == watch.text:
+                    continue
+                # Слот правки занимаем до вызова API, чтобы параллельные точки не редактировали дважды
+                self._next_edit[watch.chat_id] = now + self.edit_interval
+                watch.text = text
+                due.append(watch)
+        for order_id in expired:
+            self.stop(order_id)
+        for watch in due:
+            self._edit(watch, watch.header + watch.text)
+
+    def _edit(self, watch, text):
+        try:
+            self.bot.edit_message_text(text, watch.chat_id, watch.message_id, parse_mode="HTML")
+            metrics.registry.inc('eta_edits_total', result='sent')
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', self.edit_interval)
+                with self._lock:
+                    self._next_edit[watch.chat_id] = time.time() + retry_after
+                metrics.registry.inc('eta_edits_total', result='throttled')
+            elif 'message is not modified' not in str(e):
+                logger.error(f"Ошибка обновления времени подачи для заказа {watch.order_id}: {e}")
+                metrics.registry.inc('eta_edits_total', result='failed')
+        except Exception as e:
+            logger.error(f"Ошибка обновления времени подачи для заказа {watch.order_id}: {e}")
+            metrics.registry.inc('eta_edits_total', result='failed')
+
+    def _drop(self, order_id) -> Optional[EtaWatch]:
+        watch = self._watches.pop(order_id, None)
+        if watch is not None:
+            orders = self._by_driver.get(watch.driver_id)
+            if orders is not None:
+                orders.discard(order_id)
+                if not orders:
+                    del self._by_driver[watch.driver_id]
+            if all(other.chat_id != watch.chat_id for other in self._watches.values()):
+                self._next_edit.pop(watch.chat_id, None)
+        return watch
+
+    def stop(self, order_id, final_text=None, save=True):
+        """Прекращает обновления; final_text заменяет строку с временем подачи"""
+        with self._lock:
+            watch = self._drop(order_id)
+        if watch is None:
+            return False
+        if final_text:
+            self._edit(watch, watch.header + final_text)
+        metrics.registry.inc('eta_watches_total', result='stopped')
+        if save:
+            self._save_model()
+        return True
+
+    def stop_all(self, order_ids=None):
+        """Прекращает слежение за заказами order_ids (по умолчанию - за всеми)"""
+        with self._lock:
+            order_ids = list(self._watches if order_ids is None else order_ids)
+        stopped = [order_id for order_id in order_ids if self.stop(order_id, save=False)]
+        if stopped:
+            self._save_model()
+        return len(stopped)
+    
+    def sweep(self, now=None):
+        """Снимает слежения старше watch_seconds (вызывается потоком записи LocationTracker)"""
+        now = now or time.time()
+        with self._lock:
+            expired = [order_id for order_id, watch in self._watches.items() if now - watch.started > self.watch_seconds]
+        stopped = self.stop_all(expired)
+        if stopped:
+            metrics.registry.inc('eta_watches_total', stopped, result='expired')
+        return stopped
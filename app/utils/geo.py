@@ -0,0 +1,349 @@
+"""
+Геопозиции водителей.
+
+Водитель включает трансляцию геопозиции (live location) в чате с ботом;
+Telegram присылает edited_message с новой точкой каждые несколько секунд.
+Обработка такого апдейта не должна ходить в базу:
+
+  * SpatialGrid - равномерная сетка (ячейка LOCATION_GRID_KM) в памяти,
+    хранит только последнюю точку каждого водителя. Поиск ближайших
+    обходит кольца ячеек вокруг точки и останавливается, как только
+    следующее кольцо заведомо дальше найденных водителей;
+  * LocationTracker - сетка, кэш Telegram ID -> водитель (клиенты, не
+    водители, запоминаются на LOCATION_NOT_DRIVER_SECONDS) и фоновая запись
+    последних точек в driver_locations пачкой раз в LOCATION_FLUSH_SECONDS.
+    При старте точки загружаются из базы, устаревшие (старше
+    LOCATION_STALE_SECONDS) в поиске не участвуют. Подписчики
+    (add_listener) получают каждую новую точку.
+"""
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.database import repository
+from app.utils import metrics
+from config import (
+    CITY_CENTER, CITY_RADIUS, LOCATION_GRID_KM, LOCATION_FLUSH_SECONDS, LOCATION_NOT_DRIVER_SECONDS,
+    LOCATION_STALE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Расстояние по поверхности Земли, км"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def within_city(lat, lon):
+    """Точка в зоне обслуживания (CITY_RADIUS от центра города)"""
+    return haversine_km(lat, lon, *CITY_CENTER) <= CITY_RADIUS
+
+
+@dataclass
+class DriverFix:
+    """Последняя известная точка водителя"""
+    driver_id: int
+    lat: float
+    lon: float
+    ts: float
+    # До какого времени водитель транслирует геопозицию (None - разовая точка)
+    live_until: Optional[float] = None
+
+
+class SpatialGrid:
+    """
+    Равномерная сетка ключ -> точка. Ячейка около cell_km по обеим осям на
+    широте origin_lat (для зоны в десятки километров искажение несущественно).
+    Не потокобезопасна - блокировку держит владелец.
+    """
+
+    def __init__(self, cell_km=LOCATION_GRID_KM, origin_lat=CITY_CENTER[0]):
+        self.cell_km = cell_km
+        self._cell_lat = cell_km / KM_PER_DEGREE
+        self._cell_lon = cell_km / (KM_PER_DEGREE * math.cos(math.radians(origin_lat)))
+        self._cells: Dict[Tuple[int, int], Dict[object, tuple]] = {}
+        self._points: Dict[object, tuple] = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, lat, lon):
+        return int(lat // self._cell_lat), int(lon // self._cell_lon)
+
+    def update(self, key, lat, lon, value=None):
+        cell = self._cell(lat, lon)
+        old = self._points.get(key)
+        if old is not None and old[2] != cell:
+            self._discard(key, old[2])
+        point = (lat, lon, cell, value)
+        self._points[key] = point
+        self._cells.setdefault(cell, {})[key] = point
+
+    def remove(self, key):
+        old = self._points.pop(key, None)
+        if old is not None:
+            self._discard(key, old[2])
+
+    def _discard(self, key, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(key, None)
+            if not members:
+                del self._cells[cell]
+
+    def get(self, key):
+        point = self._points.get(key)
+        return None if point is None else point[3]
+
+    def values(self):
+        return [point[3] for point in self._points.values()]
+
+    def nearest(self, lat, lon, k=1, max_km=None, predicate=None) -> List[Tuple[float, object, object]]:
+        """
+        До k ближайших точек: [(расстояние км, ключ, значение)] по возрастанию.
+        predicate(value) отсеивает точки (например, устаревшие).
+        """
+        if not self._points:
+            return []
+        max_km = max_km if max_km is not None else 3 * CITY_RADIUS
+        max_ring = int(math.ceil(max_km / self.cell_km)) + 1
+        cx, cy = self._cell(lat, lon)
+        found = []
+        seen = 0
+        for ring in range(max_ring + 1):
+            for cell in self._ring(cx, cy, ring):
+                members = self._cells.get(cell)
+                if not members:
+                    continue
+                for key, (plat, plon, _, value) in members.items():
+                    seen += 1
+                    if predicate is not None and not predicate(value):
+                        continue
+                    distance = haversine_km(lat, lon, plat, plon)
+                    if distance <= max_km:
+                        found.append((distance, key, value))
+            # Точки следующего кольца не ближе ring * cell_km
+            if len(found) >= k:
+                found.sort(key=lambda item: item[0])
+                if found[k - 1][0] <= ring * self.cell_km:
+                    break
+            if seen == len(self._points):
+                break
+        found.sort(key=lambda item: item[0])
+        return found[:k]
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+
+class LocationTracker:
+    def __init__(self, connect=repository.connect, cell_km=LOCATION_GRID_KM,
+                 flush_seconds=LOCATION_FLUSH_SECONDS, stale_seconds=LOCATION_STALE_SECONDS,
+                 not_driver_seconds=LOCATION_NOT_DRIVER_SECONDS):
+        self.grid = SpatialGrid(cell_km)
+        self.stale_seconds = stale_seconds
+        self.flush_seconds = flush_seconds
+        self.not_driver_seconds = not_driver_seconds
+        self._connect = connect
+        self._drivers: Dict[int, int] = {}  # Telegram ID -> drivers.id
+        self._not_drivers: Dict[int, float] = {}  # Telegram ID -> до какого времени помним промах
+        self._dirty: Dict[int, DriverFix] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._sweepers = []
+        self._loaded_at = None
+
+    def driver_id_for(self, user_id):
+        """
+        drivers.id одобренного водителя по Telegram ID. Запрос к базе только
+        при первом обращении; промах (клиент) запоминается на not_driver_seconds
+        """
+        driver_id = self._drivers.get(user_id)
+        if driver_id is not None:
+            return driver_id
+        now = time.time()
+        if self._not_drivers.get(user_id, 0) > now:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT id FROM drivers WHERE user_id = ? AND is_approved = 1', (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            self._not_drivers[user_id] = now + self.not_driver_seconds
+            return None
+        self._not_drivers.pop(user_id, None)
+        self._drivers[user_id] = row[0]
+        return row[0]
+
+    def add_listener(self, listener):
+        """listener(fix, previous) вызывается после каждой новой точки (например, для ETA)"""
+        self._listeners.append(listener)
+    
+    def add_sweeper(self, sweeper):
+        """sweeper(now) вызывается потоком записи раз в flush_seconds (очистка устаревшего)"""
+        self._sweepers.append(sweeper)
+    
+    def forget_user(self, user_id):
+        """Сбрасывает кэш после одобрения, отклонения или удаления водителя"""
+        self._not_drivers.pop(user_id, None)
+        driver_id = self._drivers.pop(user_id, None)
+        if driver_id is not None:
+            with self._lock:
+                self.grid.remove(driver_id)
+
+    def update(self, driver_id, lat, lon, live_period=None, ts=None) -> DriverFix:
+        """Новая точка водителя: только память, запись в базу - фоновым потоком"""
+        ts = ts or time.time()
+        with self._lock:
+            previous = self.grid.get(driver_id)
+            if live_period:
+                live_until = ts + live_period
+            elif previous is not None:
+                # edited_message не повторяет live_period - сохраняем срок трансляции
+                live_until = previous.live_until
+            else:
+                live_until = None
+            fix = DriverFix(driver_id, lat, lon, ts, live_until)
+            self.grid.update(driver_id, lat, lon, fix)
+            self._dirty[driver_id] = fix
+        metrics.registry.inc('driver_location_updates_total')
+        self.start()
+        for listener in self._listeners:
+            try:
+                listener(fix, previous)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика геопозиции водителя {driver_id}: {e}")
+        return fix
+
+    def get(self, driver_id) -> Optional[DriverFix]:
+        with self._lock:
+            return self.grid.get(driver_id)
+
+    def is_fresh(self, fix, now=None):
+        return (now or time.time()) - fix.ts <= self.stale_seconds
+
+    def nearest(self, lat, lon, k=5, max_km=None) -> List[Tuple[float, DriverFix]]:
+        """Ближайшие водители со свежей точкой: [(расстояние км, точка)]"""
+        now = time.time()
+        with self._lock:
+            found = self.grid.nearest(lat, lon, k, max_km, predicate=lambda fix: self.is_fresh(fix, now))
+        return [(distance, fix) for distance, _, fix in found]
+
+    def load(self, conn):
+        """Загружает свежие точки из базы (после перезапуска)"""
+        return self._load(conn, time.time() - self.stale_seconds)
+
+    def refresh(self, conn):
+        """
+        Догружает точки, записанные после load (резерв стал ведущим).
+        Прежний ведущий пишет точки с опозданием до flush_seconds, поэтому
+        окно начинается раньше времени загрузки.
+        """
+        if self._loaded_at is None:
+            return self.load(conn)
+        return self._load(conn, self._loaded_at - 2 * self.flush_seconds)
+
+    def _load(self, conn, since):
+        loaded_at = time.time()
+        rows = conn.execute(
+            'SELECT driver_id, lat, lon, updated_ts, live_until FROM driver_locations WHERE updated_ts >= ?',
+            (since,)
+        ).fetchall()
+        updated = 0
+        with self._lock:
+            for driver_id, lat, lon, updated_ts, live_until in rows:
+                current = self.grid.get(driver_id)
+                if current is not None and current.ts >= updated_ts:
+                    continue
+                self.grid.update(driver_id, lat, lon, DriverFix(driver_id, lat, lon, updated_ts, live_until))
+                updated += 1
+            self._loaded_at = loaded_at
+        return updated
+
+    def sweep(self, now=None):
+        """Удаляет устаревшие промахи кэша водителей и вызывает подписчиков add_sweeper"""
+        now = now or time.time()
+        expired = [user_id for user_id, until in list(self._not_drivers.items()) if until <= now]
+        for user_id in expired:
+            self._not_drivers.pop(user_id, None)
+        for sweeper in self._sweepers:
+            try:
+                sweeper(now)
+            except Exception as e:
+                logger.error(f"Ошибка очистки устаревших данных геопозиций: {e}")
+        return len(expired)
+    
+    def flush(self):
+        """Записывает накопленные точки одним executemany"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany(
+                'INSERT INTO driver_locations (driver_id, lat, lon, updated_ts, live_until) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(driver_id) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, '
+                'updated_ts = excluded.updated_ts, live_until = excluded.live_until',
+                [(fix.driver_id, fix.lat, fix.lon, fix.ts, fix.live_until) for fix in dirty.values()]
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи геопозиций водителей: {e}")
+            # Вернем точки в очередь, если за это время не пришли более новые
+            with self._lock:
+                for driver_id, fix in dirty.items():
+                    self._dirty.setdefault(driver_id, fix)
+            return 0
+        finally:
+            conn.close()
+        return len(dirty)
+
+    def start(self):
+        """Запускает фоновую запись, если она еще не запущена"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='driver-locations', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_seconds):
+            self.flush()
+            self.sweep()
+        self.flush()
+
+    def stop(self):
+        """Останавливает фоновую запись, сохранив накопленное"""
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._wakeup.clear()
@@ -1,5 +1,6 @@
 from app.database import Session, User, Driver, Order, Review
 from sqlalchemy import func
+from app.utils import templates
 from config import CITY_NAME, CITY_RADIUS
 import json
 
@@ -22,73 +23,31 @@ def save_user_data(user_id, username, first_name, last_name):
         user.last_name = last_name
     
     session.commit()
-    user_id = user.id
-    session.close()
-    return user_id
+    return user.id
 
 def get_user_by_id(user_id):
-    """Получает пользователя по Telegram ID"""
-    session = Session()
-    user = session.query(User).filter(User.user_id == user_id).first()
-    session.close()
-    return user
+    """Получает пользователя по Telegram ID (в сессии текущего апдейта)"""
+    return Session().query(User).filter(User.user_id == user_id).first()
 
 def get_driver_by_id(user_id):
-    """Получает водителя по Telegram ID"""
-    session = Session()
-    driver = session.query(Driver).filter(Driver.user_id == user_id).first()
-    session.close()
-    return driver
+    """Получает водителя по Telegram ID (в сессии текущего апдейта)"""
+    return Session().query(Driver).filter(Driver.user_id == user_id).first()
 
 def format_order_info(order):
     """Форматирует информацию о заказе для отображения"""
-    status_map = {
-        "NEW": "Новый",
-        "PRICE_OFFERED": "Предложена цена",
-        "ACCEPTED": "Принят",
-        "DECLINED": "Отклонен",
-        "IN_PROGRESS": "Выполняется",
-        "COMPLETED": "Завершен",
-        "CANCELLED": "Отменен"
-    }
-    
-    text = f"🚕 <b>Заказ #{order.id}</b>\n\n"
-    text += f"📍 <b>Откуда:</b> {order.from_address}\n"
-    text += f"🏁 <b>Куда:</b> {order.to_address}\n"
-    
-    if order.comment:
-        text += f"💬 <b>Комментарий:</b> {order.comment}\n"
-    
-    if order.price:
-        text += f"💰 <b>Цена:</b> {order.price} руб.\n"
-    
-    if order.counter_offer:
-        text += f"💸 <b>Встречное предложение:</b> {order.counter_offer} руб.\n"
-    
-    text += f"📊 <b>Статус:</b> {status_map.get(order.status, order.status)}\n"
-    text += f"🕒 <b>Создан:</b> {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-    
-    if order.completed_at:
-        text += f"✅ <b>Завершен:</b> {order.completed_at.strftime('%d.%m.%Y %H:%M')}\n"
-    
-    return text
+    return templates.ORDER_CARD.render(order)
 
 def format_driver_info(driver):
     """Форматирует информацию о водителе для отображения"""
-    status_map = {
-        "ON_DUTY": "На линии",
-        "ON_ORDER": "На заказе",
-        "OFF_DUTY": "Дома"
-    }
-    
     text = f"👨‍✈️ <b>Водитель:</b> {driver.first_name}\n"
     text += f"🚗 <b>Номер авто:</b> {driver.car_number}\n"
-    text += f"📊 <b>Статус:</b> {status_map.get(driver.status, driver.status)}\n"
+    text += f"📊 <b>Статус:</b> {templates.driver_status_text(driver.status)}\n"
     
-    # Расчет рейтинга
-    session = Session()
-    avg_rating = session.query(func.avg(Review.rating)).filter(Review.driver_id == driver.id).scalar()
-    session.close()
+    # Рейтинг: у водителей из repository.get_drivers_with_stats он уже посчитан
+    if hasattr(driver, 'avg_rating'):
+        avg_rating = driver.avg_rating
+    else:
+        avg_rating = calculate_ratings([driver.id]).get(driver.id)
     
     if avg_rating:
         text += f"⭐ <b>Рейтинг:</b> {avg_rating:.1f}/5.0\n"
@@ -97,10 +56,20 @@ def format_driver_info(driver):
 
 def calculate_rating(driver_id):
     """Рассчитывает средний рейтинг водителя"""
-    session = Session()
-    avg_rating = session.query(func.avg(Review.rating)).filter(Review.driver_id == driver_id).scalar() or 0
-    session.close()
-    return avg_rating
+    return calculate_ratings([driver_id]).get(driver_id) or 0
+
+def calculate_ratings(driver_ids):
+    """Средние рейтинги нескольких водителей одним запросом: {driver_id: рейтинг}"""
+    driver_ids = list(driver_ids)
+    if not driver_ids:
+        return {}
+    rows = (
+        Session().query(Review.driver_id, func.avg(Review.rating))
+        .filter(Review.driver_id.in_(driver_ids))
+        .group_by(Review.driver_id)
+        .all()
+    )
+    return dict(rows)
 
 def is_within_city_radius(address):
     """
@@ -115,18 +84,17 @@ def get_admin_order_view(order):
     """Форматирует информацию о заказе для админа"""
     text = format_order_info(order)
     
-    session = Session()
-    client = session.query(User).filter(User.id == order.client_id).first()
+    # Заказ из ORM (связи client/driver) или repository.BoardOrder
+    client = order.client
     
     if client:
         text += f"\n👤 <b>Клиент:</b> {client.first_name or ''} {client.last_name or ''}\n"
         text += f"📱 <b>Телефон:</b> {client.phone_number or 'Не указан'}\n"
     
     if order.driver_id:
-        driver = session.query(Driver).filter(Driver.id == order.driver_id).first()
+        driver = order.driver
         if driver:
             text += f"\n🚕 <b>Водитель:</b> {driver.first_name}\n"
             text += f"🚗 <b>Номер авто:</b> {driver.car_number}\n"
     
-    session.close()
     return text
@@ -0,0 +1,124 @@
+"""
+Выбор ведущего экземпляра через блокировку файла рядом с базой.
+
+Polling ведет только экземпляр, удерживающий flock на файле
+<база>.leader.lock. Остальные (горячий резерв) заранее импортируют
+обработчики, проверяют схему и прогревают кэши, а затем ждут блокировку.
+Ядро снимает блокировку при завершении процесса (в том числе по kill -9),
+поэтому резерв перехватывает polling практически сразу.
+
+Проверка двумя процессами без Telegram:
+
+    python -m app.utils.leader    # в двух терминалах, затем Ctrl+C в первом
+"""
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: выбор ведущего недоступен
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def default_lock_path():
+    from app.database.repository import DATABASE_PATH
+    if DATABASE_PATH == ':memory:':
+        return None
+    return os.path.abspath(DATABASE_PATH) + '.leader.lock'
+
+
+class LeaderLock:
+    """Эксклюзивная блокировка файла; держится, пока открыт дескриптор"""
+
+    def __init__(self, path=None):
+        self.path = path or default_lock_path()
+        self._fd = None
+
+    @property
+    def supported(self):
+        return fcntl is not None and self.path is not None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """Пытается стать ведущим без ожидания"""
+        if self.is_leader:
+            return True
+        if not self.supported:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._take(fd)
+        return True
+
+    def acquire(self, poll_interval=0.2, stop_event=None):
+        """
+        Ждет, пока блокировка освободится. Возвращает False, если ожидание
+        прервано через stop_event.
+        """
+        while not self.try_acquire():
+            if stop_event is not None and stop_event.wait(poll_interval):
+                return False
+            if stop_event is None:
+                time.sleep(poll_interval)
+        return True
+
+    def _take(self, fd):
+        # PID ведущего - для диагностики (cat taxi.db.leader.lock)
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        os.fsync(fd)
+        self._fd = fd
+
+    def holder_pid(self):
+        """PID текущего ведущего по содержимому файла (может быть устаревшим)"""
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+def wait_for_leadership(lock, stop_event=None):
+    """Блокирует до получения роли ведущего, с записью в лог"""
+    if not lock.supported:
+        logger.warning("Выбор ведущего недоступен (нет fcntl или база в памяти), работаю как ведущий")
+        return True
+    if lock.try_acquire():
+        logger.info(f"Экземпляр ведущий (блокировка {lock.path})")
+        return True
+    logger.info(f"Горячий резерв: ведущий PID {lock.holder_pid()}, жду освобождения {lock.path}")
+    started = time.perf_counter()
+    if not lock.acquire(stop_event=stop_event):
+        return False
+    logger.info(f"Роль ведущего получена после {time.perf_counter() - started:.1f} с ожидания")
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(process)d - %(levelname)s - %(message)s')
+    demo_lock = LeaderLock()
+    wait_for_leadership(demo_lock)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        demo_lock.release()
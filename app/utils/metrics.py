@@ -0,0 +1,289 @@
+"""
+Метрики времени работы обработчиков.
+
+Для каждого обработчика копятся гистограммы полного времени, времени в БД
+и времени запросов к Telegram API. Данные хранятся в памяти процесса и
+отдаются в текстовом формате Prometheus через локальный HTTP-эндпоинт
+и админ-команду /metrics.
+
+Накладные расходы на горячем пути: два вызова perf_counter, bisect по
+короткому списку границ и обращение к thread-local.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for idx, bucket_count in enumerate(self.counts):
+            upper = self.buckets[idx] if idx < len(self.buckets) else self.buckets[-1]
+            if bucket_count and seen + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class MetricsRegistry:
+    """Реестр гистограмм и счетчиков процесса"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        return hist
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counter_value(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histograms(self, name):
+        """Возвращает [(labels, histogram)] для метрики name"""
+        return [(dict(labels), hist) for (hname, labels), hist in list(self._histograms.items()) if hname == name]
+
+    def render_prometheus(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        typed = set()
+        for (name, labels), hist in sorted(self._histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for idx, bucket_count in enumerate(counts):
+                cumulative += bucket_count
+                le = repr(hist.buckets[idx]) if idx < len(hist.buckets) else '+Inf'
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+registry = MetricsRegistry()
+
+# Контекст текущего обработчика: [время в БД, время в Telegram API]
+_local = threading.local()
+
+
+def add_db_time(seconds):
+    """Добавляет время работы с БД к текущему обработчику"""
+    ctx = getattr(_local, 'ctx', None)
+    if ctx is not None:
+        ctx[0] += seconds
+
+
+def add_api_time(seconds):
+    """Добавляет время запроса к Telegram API к текущему обработчику"""
+    ctx = getattr(_local, 'ctx', None)
+    if ctx is not None:
+        ctx[1] += seconds
+
+
+def timed(name):
+    """
+    Декоратор: замеряет обработчик и пишет гистограммы
+    handler_seconds, handler_db_seconds и handler_api_seconds.
+
+    Вложенные вызовы (обработчик вызывает другой обработчик) учитываются
+    во внешнем замере и отдельно не пишутся.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'ctx', None) is not None:
+                return func(*args, **kwargs)
+            ctx = _local.ctx = [0.0, 0.0]
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                registry.inc('handler_errors_total', handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                _local.ctx = None
+                registry.histogram('handler_seconds', handler=name).observe(elapsed)
+                registry.histogram('handler_db_seconds', handler=name).observe(ctx[0])
+                registry.histogram('handler_api_seconds', handler=name).observe(ctx[1])
+        return wrapper
+    return decorator
+
+
+def _handler_name(func):
+    return getattr(func, '__qualname__', None) or getattr(func, '__name__', 'handler')
+
+
+_original_make_request = apihelper._make_request
+
+
+def _timed_make_request(token, method_name, *args, **kwargs):
+    if method_name == 'getUpdates':
+        # Long polling висит до timeout и к обработчикам отношения не имеет
+        return _original_make_request(token, method_name, *args, **kwargs)
+    started = time.perf_counter()
+    try:
+        return _original_make_request(token, method_name, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        add_api_time(elapsed)
+        registry.histogram('telegram_api_seconds', method=method_name).observe(elapsed)
+
+
+def _wrap_handler(func, wrappers):
+    """Замер времени снаружи, внутри - wrappers по порядку (первый - ближе к замеру)"""
+    if getattr(func, '_metrics_timed', False):
+        return func
+    name = _handler_name(func)
+    wrapped = func
+    for wrap in reversed(wrappers):
+        wrapped = wrap(wrapped, name)
+    wrapped = timed(name)(wrapped)
+    wrapped._metrics_timed = True
+    return wrapped
+
+
+def instrument_bot(bot, wrappers=()):
+    """
+    Оборачивает все зарегистрированные обработчики бота замером времени.
+
+    wrappers - дополнительные обертки wrap(func, name) -> func, которые
+    ставятся тем же проходом внутри замера (например, session_scope для
+    app/handlers), чтобы обработчик оборачивался один раз.
+
+    Вызывается после регистрации обработчиков. Обработчики следующего шага
+    (register_next_step_handler) оборачиваются в момент регистрации.
+    """
+    handler_lists = (
+        bot.message_handlers,
+        bot.edited_message_handlers,
+        bot.callback_query_handlers,
+        bot.inline_handlers,
+    )
+    for handlers in handler_lists:
+        for handler in handlers:
+            handler['function'] = _wrap_handler(handler['function'], wrappers)
+
+    if not getattr(bot.register_next_step_handler, '_metrics_timed', False):
+        original_register = bot.register_next_step_handler
+
+        def register_next_step_handler(message, callback, *args, **kwargs):
+            return original_register(message, _wrap_handler(callback, wrappers), *args, **kwargs)
+
+        register_next_step_handler._metrics_timed = True
+        bot.register_next_step_handler = register_next_step_handler
+
+    apihelper._make_request = _timed_make_request
+
+
+def handler_summary(limit=15):
+    """Сводка по обработчикам, отсортированная по суммарному времени"""
+    rows = []
+    db = {labels['handler']: hist for labels, hist in registry.histograms('handler_db_seconds')}
+    api = {labels['handler']: hist for labels, hist in registry.histograms('handler_api_seconds')}
+    for labels, hist in registry.histograms('handler_seconds'):
+        name = labels['handler']
+        if not hist.count:
+            continue
+        rows.append({
+            'handler': name,
+            'count': hist.count,
+            'total': hist.sum,
+            'p50': hist.quantile(0.5),
+            'p95': hist.quantile(0.95),
+            'db_avg': db[name].sum / db[name].count if name in db and db[name].count else 0.0,
+            'api_avg': api[name].sum / api[name].count if name in api and api[name].count else 0.0,
+        })
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    return rows[:limit]
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем лог бота запросами скрейпера
+        pass
+
+
+def start_metrics_server(host='127.0.0.1', port=9108):
+    """Запускает HTTP-эндпоинт /metrics в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,241 @@
+"""
+Уведомления администраторов по категориям.
+
+Раньше каждая смена статуса водителя, каждый новый и завершенный заказ
+сразу уходили сообщением каждому администратору. NotificationRouter
+решает для каждого администратора и категории (CATEGORIES), что делать с
+событием:
+
+  * 'immediate' - отправить сразу, как раньше;
+  * 'digest' - отложить в сводку: раз в NOTIFY_DIGEST_SECONDS фоновый поток
+    собирает накопленное одним сообщением на администратора и отправляет
+    через Broadcaster (общий лимит скорости Telegram). События с одинаковым
+    ключом склеиваются: в сводке остается последнее и число повторов
+    (например, водитель несколько раз переключил статус);
+  * 'off' - не присылать.
+
+Политики по умолчанию - NOTIFY_DEFAULTS, свои настройки администратора
+хранятся в admin_notification_settings и читаются в память один раз.
+Кнопки сообщений в сводку не попадают, поэтому категории с действиями
+(ACTION_CATEGORIES: новый заказ, ответ на цену) в сводку не откладываются -
+только сразу или выкл., а заявки водителей (с фотографиями) всегда
+приходят сразу.
+"""
+import html
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.database import repository
+from app.utils import metrics
+from app.utils.broadcast import Notification
+from config import NOTIFY_DEFAULTS, NOTIFY_DIGEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+IMMEDIATE = 'immediate'
+DIGEST = 'digest'
+OFF = 'off'
+POLICIES = (IMMEDIATE, DIGEST, OFF)
+
+# Категория -> название в /notify и в сводке
+CATEGORIES = {
+    'new_order': "Новые заказы",
+    'price_response': "Ответы клиентов на цену",
+    'driver_status': "Статусы водителей",
+    'order_completed': "Завершенные заказы",
+}
+
+# Сообщения этих категорий несут кнопки ("Установить цену", "Назначить
+# водителя"), которые потерялись бы в сводке
+ACTION_CATEGORIES = ('new_order', 'price_response')
+
+# Предел длины сообщения Telegram с запасом
+MESSAGE_LIMIT = 4000
+
+
+def allowed_policies(category):
+    """Политики, доступные категории, в порядке переключения кнопкой"""
+    if category in ACTION_CATEGORIES:
+        return (IMMEDIATE, OFF)
+    return POLICIES
+
+
+@dataclass
+class PendingEvent:
+    """Событие в очереди сводки"""
+    category: str
+    text: str
+    first_ts: float
+    count: int = 1
+
+
+class NotificationRouter:
+    def __init__(self, bot, broadcaster, recipients, connect=repository.connect,
+                 interval=NOTIFY_DIGEST_SECONDS, defaults=NOTIFY_DEFAULTS):
+        self.bot = bot
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self.defaults = dict(defaults)
+        # Telegram ID администраторов, которым идут уведомления
+        self._recipients = recipients
+        self._connect = connect
+        self._settings: Optional[Dict[Tuple[int, str], str]] = None
+        # Администратор -> OrderedDict (категория, ключ) -> PendingEvent
+        self._pending: Dict[int, OrderedDict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _load_settings(self):
+        if self._settings is not None:
+            return self._settings
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT admin_user_id, category, policy FROM admin_notification_settings').fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка чтения настроек уведомлений: {e}")
+            rows = []
+        finally:
+            conn.close()
+        self._settings = {(admin_id, category): policy for admin_id, category, policy in rows}
+        return self._settings
+
+    def policy(self, admin_id, category) -> str:
+        settings = self._load_settings()
+        policy = settings.get((admin_id, category), self.defaults.get(category, IMMEDIATE))
+        # Сохраненная ранее сводка для категории с кнопками - отправка сразу
+        if policy not in allowed_policies(category):
+            return IMMEDIATE
+        return policy
+
+    def policies(self, admin_id) -> Dict[str, str]:
+        """Политики администратора по всем категориям"""
+        return {category: self.policy(admin_id, category) for category in CATEGORIES}
+
+    def set_policy(self, admin_id, category, policy):
+        if category not in CATEGORIES or policy not in allowed_policies(category):
+            raise ValueError(f"Неизвестная категория или политика: {category}, {policy}")
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO admin_notification_settings (admin_user_id, category, policy) VALUES (?, ?, ?) '
+                'ON CONFLICT(admin_user_id, category) DO UPDATE SET policy = excluded.policy',
+                (admin_id, category, policy)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._load_settings()[admin_id, category] = policy
+        if policy != DIGEST:
+            # Накопленное по категории больше не нужно ни сводкой, ни сразу
+            with self._lock:
+                pending = self._pending.get(admin_id)
+                if pending:
+                    for key in [key for key in pending if key[0] == category]:
+                        del pending[key]
+
+    def notify(self, category, text, parse_mode=None, reply_markup=None, key=None, digest_text=None):
+        """
+        Событие категории category для всех администраторов.
+
+        key - ключ склейки в сводке (None - не склеивать); digest_text - строка
+        для сводки вместо полного текста. Тексты сводки идут в HTML.
+        """
+        line = digest_text or (text if parse_mode == 'HTML' else html.escape(text, quote=False))
+        now = time.time()
+        for admin_id in self._recipients():
+            policy = self.policy(admin_id, category)
+            metrics.registry.inc('admin_notifications_total', category=category, policy=policy)
+            if policy == IMMEDIATE:
+                try:
+                    self.bot.send_message(admin_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки сообщения админу {admin_id}: {e}")
+            elif policy == DIGEST:
+                self._enqueue(admin_id, category, key, line, now)
+
+    def _enqueue(self, admin_id, category, key, line, now):
+        with self._lock:
+            pending = self._pending.setdefault(admin_id, OrderedDict())
+            # Без ключа каждое событие уникально
+            slot = (category, key if key is not None else object())
+            event = pending.pop(slot, None)
+            if event is None:
+                event = PendingEvent(category, line, now)
+            else:
+                event.text = line
+                event.count += 1
+                metrics.registry.inc('admin_notifications_merged_total', category=category)
+            # Последнее событие - в конец своей категории
+            pending[slot] = event
+        self._ensure_flusher()
+
+    def pending_count(self, admin_id=None) -> int:
+        with self._lock:
+            if admin_id is not None:
+                return len(self._pending.get(admin_id, ()))
+            return sum(len(pending) for pending in self._pending.values())
+
+    def digest_messages(self, events: List[PendingEvent], now=None) -> List[str]:
+        """Сводка по категориям, разложенная по сообщениям не длиннее MESSAGE_LIMIT"""
+        now = now or time.time()
+        minutes = max(1, round((now - min(event.first_ts for event in events)) / 60))
+        messages = [f"🔔 <b>Сводка за {minutes} мин</b>\n"]
+        for category, title in CATEGORIES.items():
+            lines = [
+                event.text + (f" (×{event.count})" if event.count > 1 else "")
+                for event in events if event.category == category
+            ]
+            if not lines:
+                continue
+            block = [f"\n<b>{title}: {len(lines)}</b>\n"] + [f"• {line}\n" for line in lines]
+            for part in block:
+                if len(messages[-1]) + len(part) > MESSAGE_LIMIT:
+                    messages.append('')
+                messages[-1] += part
+        return messages
+
+    def flush(self) -> int:
+        """Отправляет накопленные сводки. Возвращает число отправленных сообщений"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        notifications = []
+        for admin_id, events in pending.items():
+            if events:
+                notifications.extend(
+                    Notification(admin_id, text, {'parse_mode': 'HTML'})
+                    for text in self.digest_messages(list(events.values()))
+                )
+        if not notifications:
+            return 0
+        result = self.broadcaster.send(notifications)
+        metrics.registry.inc('admin_digests_total', result.sent)
+        return result.sent
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='admin-digests', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки уведомлений: {e}")
+
+    def stop(self):
+        """Останавливает фоновый поток и отправляет накопленное"""
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._wakeup.clear()
+        self.flush()
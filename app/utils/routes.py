@@ -0,0 +1,128 @@
+"""
+Недавние маршруты клиентов для повтора поездки.
+
+Для каждого клиента в памяти хранится до RECENT_ROUTES последних
+маршрутов (откуда, куда, способ оплаты) - LRU: повторный заказ по тому же
+маршруту поднимает его наверх, самый давний вытесняется. Маршруты клиента
+читаются из базы одним запросом при первом обращении (последние
+HISTORY_ORDERS заказов) и дальше обновляются при создании заказов.
+Частые маршруты (count) отмечаются как избранные. Число клиентов в кэше
+тоже ограничено (MAX_CLIENTS, вытесняются давно не заказывавшие).
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.database import repository
+from app.utils import metrics
+from config import RECENT_ROUTES
+
+# Сколько последних заказов читать при загрузке и сколько клиентов держать в памяти
+HISTORY_ORDERS = 50
+MAX_CLIENTS = 5000
+# С какого числа поездок маршрут считается избранным
+FAVOURITE_COUNT = 2
+
+
+@dataclass
+class Route:
+    from_address: str
+    to_address: str
+    payment_method: Optional[str] = None
+    from_lat: Optional[float] = None
+    from_lon: Optional[float] = None
+    count: int = 1
+
+    @property
+    def favourite(self):
+        return self.count >= FAVOURITE_COUNT
+
+    def order_data(self):
+        """Поля заказа для user_order_data"""
+        return {
+            'from_address': self.from_address,
+            'to_address': self.to_address,
+            'payment_method': self.payment_method,
+            'from_lat': self.from_lat,
+            'from_lon': self.from_lon,
+        }
+
+
+class RecentRoutes:
+    def __init__(self, connect=repository.connect, size=RECENT_ROUTES, max_clients=MAX_CLIENTS):
+        self.size = size
+        self.max_clients = max_clients
+        self._connect = connect
+        # Telegram ID -> OrderedDict (откуда, куда) -> Route, последние в конце
+        self._clients: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id):
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT o.from_address, o.to_address, o.payment_method, o.from_lat, o.from_lon
+                FROM orders o
+                JOIN users u ON u.id = o.client_id
+                WHERE u.user_id = ?
+                ORDER BY o.id DESC
+                LIMIT ?
+            ''', (user_id, HISTORY_ORDERS)).fetchall()
+        finally:
+            conn.close()
+        routes = OrderedDict()
+        # От старых к новым, чтобы последний заказ оказался в конце
+        for from_address, to_address, payment_method, from_lat, from_lon in reversed(rows):
+            if not from_address or not to_address:
+                continue
+            self._touch(routes, Route(from_address, to_address, payment_method, from_lat, from_lon))
+        # Обрезаем после подсчета, чтобы число поездок учитывало всю историю
+        self._trim(routes)
+        return routes
+
+    def _touch(self, routes, route):
+        """Маршрут в конец списка клиента (способ оплаты и точка А - из последнего заказа)"""
+        key = (route.from_address, route.to_address)
+        previous = routes.pop(key, None)
+        if previous is not None:
+            route.count += previous.count
+        routes[key] = route
+
+    def _trim(self, routes):
+        while len(routes) > self.size:
+            routes.popitem(last=False)
+
+    def get(self, user_id) -> List[Route]:
+        """Маршруты клиента, последний первым"""
+        with self._lock:
+            routes = self._clients.get(user_id)
+            if routes is not None:
+                self._clients.move_to_end(user_id)
+                metrics.registry.inc('recent_routes_cache_total', result='hit')
+                return list(reversed(routes.values()))
+        metrics.registry.inc('recent_routes_cache_total', result='miss')
+        routes = self._load(user_id)
+        with self._lock:
+            # Пока читали базу, маршрут мог добавить record()
+            routes = self._clients.setdefault(user_id, routes)
+            self._clients.move_to_end(user_id)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return list(reversed(routes.values()))
+
+    def record(self, user_id, from_address, to_address, payment_method=None, from_lat=None, from_lon=None):
+        """Новый заказ клиента. Если маршруты клиента еще не загружены, их прочитает get()"""
+        if not from_address or not to_address:
+            return
+        with self._lock:
+            routes = self._clients.get(user_id)
+            if routes is None:
+                return
+            self._touch(routes, Route(from_address, to_address, payment_method, from_lat, from_lon))
+            self._trim(routes)
+            self._clients.move_to_end(user_id)
+
+
+# Общий кэш маршрутов
+cache = RecentRoutes()
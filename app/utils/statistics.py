@@ -0,0 +1,197 @@
+"""
+Статистика для администратора.
+
+collect_statistics() собирает снимок несколькими запросами, каждый из
+которых читает только индекс, вместо отдельного COUNT на каждый показатель:
+
+  * счетчики по статусам - GROUP BY по индексу (status, created_at);
+  * выручка и средний чек - агрегат по индексу earnings (date_ts, amount);
+  * заказы и выручка за сегодня, месяц, по часам и по дням - группировка
+    по часам диапазона индексов created_ts и date_ts;
+  * выручка по водителям за месяц.
+
+Часы и дни считаются по местному времени (app.utils.timeutils).
+Снимок кэшируется на STATS_CACHE_SECONDS: повторные нажатия кнопки
+не обращаются к базе. Создание заказа, назначение цены и завершение
+поездки сбрасывают кэш (cache.invalidate()), остальные изменения
+статусов видны после истечения срока снимка.
+"""
+import datetime
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from app.database import repository
+from app.utils import metrics, timeutils
+from config import STATS_CACHE_SECONDS
+
+# Сколько дней в разбивке по дням и сколько водителей в рейтинге выручки
+DAILY_DAYS = 7
+TOP_DRIVERS = 5
+
+
+@dataclass
+class DriverRevenue:
+    driver_id: int
+    first_name: Optional[str]
+    car_number: Optional[str]
+    orders: int
+    revenue: float
+
+
+@dataclass
+class StatisticsSnapshot:
+    generated_at: datetime.datetime
+    orders_total: int = 0
+    orders_completed: int = 0
+    orders_cancelled: int = 0
+    orders_active: int = 0
+    orders_today: int = 0
+    orders_month: int = 0
+    clients: int = 0
+    drivers: int = 0
+    revenue_total: float = 0.0
+    revenue_today: float = 0.0
+    revenue_month: float = 0.0
+    avg_price: float = 0.0
+    # Заказы сегодня по часам (0-23)
+    hourly_orders: List[int] = field(default_factory=lambda: [0] * 24)
+    # Последние DAILY_DAYS дней: (дата, заказов, выручка), старые первыми
+    daily: List[Tuple[datetime.date, int, float]] = field(default_factory=list)
+    # Выручка водителей за месяц, по убыванию
+    drivers_revenue: List[DriverRevenue] = field(default_factory=list)
+
+
+def _hour_buckets(cursor, sql, origin):
+    """{местное время начала часа: значение} для запроса с группировкой по часам от origin"""
+    cursor.execute(sql, (origin, origin))
+    return {timeutils.from_epoch(origin + bucket * 3600): value for bucket, value in cursor.fetchall()}
+
+
+def collect_statistics(conn, now=None) -> StatisticsSnapshot:
+    """Снимок статистики по текущему состоянию базы"""
+    now = timeutils.to_local(now)
+    starts = timeutils.period_starts(now)
+    today = now.date()
+    first_day = today - datetime.timedelta(days=DAILY_DAYS - 1)
+    since = min(starts['month'], timeutils.to_epoch(timeutils.local_midnight(first_day)))
+    snapshot = StatisticsSnapshot(generated_at=now)
+    cursor = conn.cursor()
+    
+    # Счетчики по статусам - по индексу (status, created_at)
+    cursor.execute('SELECT status, COUNT(*) FROM orders GROUP BY status')
+    by_status = dict(cursor.fetchall())
+    snapshot.orders_total = sum(by_status.values())
+    snapshot.orders_completed = by_status.get('COMPLETED', 0)
+    snapshot.orders_cancelled = by_status.get('CANCELLED', 0)
+    snapshot.orders_active = sum(by_status.get(status, 0) for status in repository.ACTIVE_STATUSES)
+    
+    # Пользователи и выручка за все время (одна строка заработка на завершенный заказ)
+    cursor.execute('''
+        SELECT (SELECT COUNT(*) FROM users),
+               (SELECT COUNT(*) FROM drivers WHERE is_approved = 1),
+               SUM(amount), AVG(amount)
+        FROM earnings
+    ''')
+    row = cursor.fetchone()
+    snapshot.clients = row[0] or 0
+    snapshot.drivers = row[1] or 0
+    snapshot.revenue_total = row[2] or 0
+    snapshot.avg_price = row[3] or 0
+    
+    # Заказы и выручка по часам с начала периода; часы складываются
+    # в сутки уже в Python (не больше ~750 строк)
+    orders_by_hour = _hour_buckets(
+        cursor,
+        'SELECT (created_ts - ?) / 3600, COUNT(*) FROM orders WHERE created_ts >= ? GROUP BY 1',
+        since
+    )
+    revenue_by_hour = _hour_buckets(
+        cursor,
+        'SELECT (date_ts - ?) / 3600, SUM(amount) FROM earnings WHERE date_ts >= ? GROUP BY 1',
+        since
+    )
+    month_start = timeutils.from_epoch(starts['month'])
+    day_start = timeutils.from_epoch(starts['day'])
+    daily_orders = defaultdict(int)
+    daily_revenue = defaultdict(float)
+    for hour, count in orders_by_hour.items():
+        daily_orders[hour.date()] += count
+        if hour >= month_start:
+            snapshot.orders_month += count
+        if hour >= day_start:
+            snapshot.orders_today += count
+            snapshot.hourly_orders[hour.hour] += count
+    for hour, amount in revenue_by_hour.items():
+        daily_revenue[hour.date()] += amount or 0
+        if hour >= month_start:
+            snapshot.revenue_month += amount or 0
+        if hour >= day_start:
+            snapshot.revenue_today += amount or 0
+    snapshot.daily = [
+        (day, daily_orders[day], daily_revenue[day])
+        for day in (first_day + datetime.timedelta(days=i) for i in range(DAILY_DAYS))
+    ]
+    
+    # Выручка водителей за месяц
+    cursor.execute('''
+        SELECT e.driver_id, d.first_name, d.car_number, COUNT(*), SUM(e.amount) AS revenue
+        FROM earnings e
+        LEFT JOIN drivers d ON d.id = e.driver_id
+        WHERE e.date_ts >= ?
+        GROUP BY e.driver_id
+        ORDER BY revenue DESC
+        LIMIT ?
+    ''', (starts['month'], TOP_DRIVERS))
+    snapshot.drivers_revenue = [DriverRevenue(*row) for row in cursor.fetchall()]
+    return snapshot
+
+
+class StatisticsCache:
+    """Снимок статистики с временем жизни; пересчет выполняет один поток"""
+
+    def __init__(self, ttl=STATS_CACHE_SECONDS, connect=repository.connect):
+        self.ttl = ttl
+        self._connect = connect
+        self._snapshot: Optional[StatisticsSnapshot] = None
+        self._expires = 0.0
+        # Растет при каждом invalidate(): снимок, начатый до записи, не кэшируется
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> StatisticsSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires:
+            metrics.registry.inc('statistics_cache_total', result='hit')
+            return snapshot
+        with self._lock:
+            # Пока ждали блокировку, снимок мог пересчитать другой поток
+            if self._snapshot is not None and time.monotonic() < self._expires:
+                metrics.registry.inc('statistics_cache_total', result='hit')
+                return self._snapshot
+            metrics.registry.inc('statistics_cache_total', result='miss')
+            generation = self._generation
+            started = time.perf_counter()
+            conn = self._connect()
+            try:
+                self._snapshot = collect_statistics(conn)
+            finally:
+                conn.close()
+            metrics.registry.histogram('statistics_collect_seconds').observe(time.perf_counter() - started)
+            if generation == self._generation:
+                self._expires = time.monotonic() + self.ttl
+            return self._snapshot
+
+    def invalidate(self):
+        self._generation += 1
+        self._expires = 0.0
+
+
+# Общий кэш для обоих наборов обработчиков
+cache = StatisticsCache()
+
+
+def get_statistics() -> StatisticsSnapshot:
+    return cache.get()
@@ -0,0 +1,48 @@
+"""
+Спрос и предложение в реальном времени.
+
+Число заказов без водителя и свободных водителей ведут триггеры базы
+(repository.COUNTERS) при каждом переходе статуса, поэтому текущее
+соотношение читается одним запросом к маленькой таблице counters, без
+COUNT по заказам и водителям. По соотношению подбирается рекомендуемый
+коэффициент цены (SURGE_STEPS); администратор видит его при установке
+цены и на доске активных заказов.
+"""
+from dataclasses import dataclass
+
+from app.database import repository
+from config import SURGE_STEPS
+
+
+def suggest_multiplier(open_orders, drivers):
+    """Коэффициент цены для open_orders заказов на drivers свободных водителей"""
+    if open_orders <= 0:
+        return 1.0
+    if drivers <= 0:
+        return SURGE_STEPS[-1][1]
+    ratio = open_orders / drivers
+    multiplier = 1.0
+    for threshold, value in SURGE_STEPS:
+        if ratio >= threshold:
+            multiplier = value
+    return multiplier
+
+
+@dataclass
+class SupplyDemand:
+    open_orders: int
+    drivers: int
+
+    @property
+    def ratio(self):
+        """Заказов на свободного водителя; None, если свободных водителей нет"""
+        return self.open_orders / self.drivers if self.drivers else None
+
+    @property
+    def multiplier(self):
+        return suggest_multiplier(self.open_orders, self.drivers)
+
+
+def current(conn) -> SupplyDemand:
+    counters = repository.get_counters(conn)
+    return SupplyDemand(counters['open_orders'], counters['available_drivers'])
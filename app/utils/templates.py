@@ -0,0 +1,379 @@
+"""
+Шаблоны текстов заказов.
+
+  * ORDER_STATUS_TEXT / DRIVER_STATUS_TEXT - общие неизменяемые таблицы
+    статусов (раньше в каждом обработчике был свой словарь);
+  * CardTemplate - карточка заказа для конкретной роли: строки формата
+    разбираются на куски при импорте, функции полей выбираются там же.
+    При отрисовке вычисляются только поля шаблона, и каждое экранируется
+    (HTML) один раз;
+  * render_cards - отрисовка списка заказов;
+  * price_batch_pages - новые заказы одним списком для назначения цен пачкой;
+  * statistics_text - сводка app.utils.statistics для администратора;
+  * demand_text - отчет о спросе app.utils.analytics;
+  * supply_text - спрос и предложение сейчас (app.utils.supply);
+  * utilization_text - загрузка водителей (app.utils.utilization).
+
+Заказ может быть sqlite3.Row, repository.BoardOrder или ORM-объектом.
+"""
+import datetime
+import html
+import math
+import sqlite3
+import string
+from types import MappingProxyType
+
+from config import DRIVER_STATUSES, STATS_CACHE_SECONDS
+
+ORDER_STATUS_TEXT = MappingProxyType({
+    "NEW": "Новый",
+    "PRICE_OFFERED": "Предложена цена",
+    "COUNTER_OFFERED": "Встречное предложение",
+    "ACCEPTED": "Принят",
+    "DECLINED": "Отклонен",
+    "IN_PROGRESS": "Выполняется",
+    "ARRIVED": "Водитель на месте",
+    "COMPLETED": "Завершен",
+    "CANCELLED": "Отменен",
+})
+
+DRIVER_STATUS_TEXT = MappingProxyType(dict(DRIVER_STATUSES))
+
+
+def order_status_text(status):
+    return ORDER_STATUS_TEXT.get(status, status)
+
+
+def driver_status_text(status):
+    return DRIVER_STATUS_TEXT.get(status, status)
+
+
+def _pieces(fmt):
+    """Строка формата, разобранная один раз: [(текст, поле или None, формат поля)]"""
+    pieces = []
+    for literal, field, spec, conversion in string.Formatter().parse(fmt):
+        if field is not None and (not field.isidentifier() or conversion):
+            raise ValueError(f"Некорректное поле шаблона: {field!r}")
+        pieces.append((literal, field, spec or ''))
+    return tuple(pieces)
+
+
+def _getter(order, keys=None):
+    """Функция доступа к полям заказа: sqlite3.Row по ключу, объекты по атрибуту"""
+    if isinstance(order, sqlite3.Row):
+        return dict(zip(keys or order.keys(), order)).get
+    if order is None:
+        return lambda name: None
+    return lambda name: getattr(order, name, None)
+
+
+def _format_time(value, fmt):
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime(fmt)
+    try:
+        return datetime.datetime.fromisoformat(value).strftime(fmt)
+    except ValueError:
+        return None
+
+
+def _text(value):
+    if not value:
+        return None
+    value = str(value)
+    # Большинство полей не содержит спецсимволов HTML
+    if '&' in value or '<' in value or '>' in value:
+        return html.escape(value, quote=False)
+    return value
+
+
+def _client_name(get):
+    client = get('client')
+    if client is not None:
+        get = _getter(client)
+    first_name, last_name = get('first_name'), get('last_name')
+    if not first_name and not last_name:
+        return None
+    return _text(f"{first_name or ''} {last_name or ''}")
+
+
+def _created_at(get):
+    value = get('created_at')
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d.%m.%Y %H:%M')
+    return _text(value)
+
+
+# Поля, которые выводятся как есть (с экранированием): поле шаблона -> столбец
+_TEXT_FIELDS = {
+    'from_address': 'from_address',
+    'to_address': 'to_address',
+    'comment': 'comment',
+    'price': 'price',
+    'counter_offer': 'counter_offer',
+}
+
+# Поля, требующие преобразования
+_COMPUTED_FIELDS = {
+    'id': lambda get: get('id'),
+    'client_name': _client_name,
+    'scheduled': lambda get: _format_time(get('scheduled_at'), '%d.%m %H:%M'),
+    'status': lambda get: ORDER_STATUS_TEXT.get(get('status'), get('status')),
+    'created_at': _created_at,
+    'completed_at': lambda get: _format_time(get('completed_at'), '%d.%m.%Y %H:%M'),
+}
+
+
+class CardTemplate:
+    """
+    Карточка заказа: заголовок и строки (поле, формат). Строка выводится,
+    только если поле заполнено. Вычисляются только поля, которые есть в шаблоне.
+    """
+
+    def __init__(self, title, lines):
+        # (поле строки или None для заголовка, разобранный формат)
+        self._lines = ((None, _pieces(title)),) + tuple((field, _pieces(fmt)) for field, fmt in lines)
+        used = {field for field, _ in lines}
+        used.update(name for _, pieces in self._lines for _, name, _ in pieces if name is not None)
+        used.discard('number')
+        # Только поля шаблона: (поле, столбец) и (поле, функция get -> значение)
+        self._text_fields = tuple((name, _TEXT_FIELDS[name]) for name in sorted(used) if name in _TEXT_FIELDS)
+        self._computed_fields = tuple(
+            (name, _COMPUTED_FIELDS[name]) for name in sorted(used) if name not in _TEXT_FIELDS
+        )
+
+    def render(self, order, number=None, get=None):
+        get = get or _getter(order)
+        values = {name: _text(get(column)) for name, column in self._text_fields}
+        for name, compute in self._computed_fields:
+            values[name] = compute(get)
+        values['number'] = get('id') if number is None else number
+        parts = []
+        for field, pieces in self._lines:
+            if field is None or values[field]:
+                for literal, name, spec in pieces:
+                    parts.append(literal)
+                    if name is not None:
+                        parts.append(format(values[name], spec))
+        return ''.join(parts)
+
+
+_FROM = ('from_address', "📍 <b>Откуда:</b> {from_address}\n")
+_TO = ('to_address', "🏁 <b>Куда:</b> {to_address}\n")
+_COMMENT = ('comment', "💬 <b>Комментарий:</b> {comment}\n")
+_PRICE = ('price', "💰 <b>Цена:</b> {price} руб.\n")
+_CLIENT = ('client_name', "👤 <b>Клиент:</b> {client_name}\n")
+_STATUS = ('status', "📊 <b>Статус:</b> {status}\n")
+_CREATED = ('created_at', "🕒 <b>Создан:</b> {created_at}\n")
+
+# Доска активных заказов администратора
+ADMIN_ACTIVE_CARD = CardTemplate("🚕 <b>Заказ #{number}</b> (ID: {id})\n\n", [
+    _CLIENT, _FROM, _TO, _COMMENT, _PRICE,
+    ('scheduled', "🕐 <b>Запланированное время:</b> {scheduled}\n"),
+    _STATUS,
+])
+
+# История заказов администратора
+ADMIN_HISTORY_CARD = CardTemplate("📋 <b>Заказ #{number}</b> (ID: {id})\n\n", [
+    _CLIENT, _FROM, _TO, _PRICE, _STATUS,
+])
+
+# "Мои заказы" клиента
+CLIENT_CARD = CardTemplate("🚕 <b>Заказ #{number}</b>\n\n", [
+    _FROM, _TO, _COMMENT, _PRICE,
+    ('counter_offer', "💸 <b>Ваше предложение:</b> {counter_offer} руб.\n"),
+    ('scheduled', "🕐 <b>Запланированное время:</b> {scheduled}\n"),
+    _STATUS, _CREATED,
+])
+
+# "Мои заказы" водителя
+DRIVER_CARD = CardTemplate("🚕 <b>Заказ #{number}</b> (ID: {id})\n\n", [
+    _FROM, _TO, _COMMENT, _PRICE,
+    ('scheduled', "🕐 <b>Время подачи:</b> {scheduled}\n"),
+    _STATUS, _CREATED,
+])
+
+# Общая карточка (app/utils/helpers.format_order_info)
+ORDER_CARD = CardTemplate("🚕 <b>Заказ #{number}</b>\n\n", [
+    _FROM, _TO, _COMMENT, _PRICE,
+    ('counter_offer', "💸 <b>Встречное предложение:</b> {counter_offer} руб.\n"),
+    _STATUS, _CREATED,
+    ('completed_at', "✅ <b>Завершен:</b> {completed_at}\n"),
+])
+
+
+# Короткая строка заказа в списке для назначения цен пачкой (/prices)
+PRICE_BATCH_CARD = CardTemplate("<b>ID {id}</b> · заказ #{number}\n", [
+    ('scheduled', "🕐 {scheduled}\n"),
+    ('from_address', "📍 {from_address}\n"),
+    ('to_address', "🏁 {to_address}\n"),
+    _COMMENT,
+])
+
+# Предел длины сообщения Telegram с запасом
+MESSAGE_LIMIT = 4000
+
+
+def render_cards(template, orders, numbers=None):
+    """Карточки списка заказов; numbers - {id заказа: номер у клиента}"""
+    orders = list(orders)
+    if not orders:
+        return []
+    numbers = numbers or {}
+    # Строки одного запроса имеют одинаковый набор столбцов
+    keys = tuple(orders[0].keys()) if isinstance(orders[0], sqlite3.Row) else None
+    texts = []
+    for order in orders:
+        get = _getter(order, keys)
+        texts.append(template.render(order, numbers.get(get('id')), get))
+    return texts
+
+
+def _bar(value, peak, width=10):
+    if not peak:
+        return ''
+    return '▇' * max(1, round(width * value / peak)) if value else ''
+
+
+def statistics_text(snapshot):
+    """Текст статистики администратора по StatisticsSnapshot"""
+    parts = [
+        "📊 <b>Статистика</b>\n\n",
+        "<b>Заказы:</b>\n",
+        f"Всего заказов: {snapshot.orders_total}\n",
+        f"Завершенных: {snapshot.orders_completed}\n",
+        f"Отмененных: {snapshot.orders_cancelled}\n",
+        f"Активных: {snapshot.orders_active}\n",
+        f"За сегодня: {snapshot.orders_today}\n",
+        f"За месяц: {snapshot.orders_month}\n\n",
+        "<b>Пользователи:</b>\n",
+        f"Клиентов: {snapshot.clients}\n",
+        f"Водителей: {snapshot.drivers}\n\n",
+        "<b>Финансы:</b>\n",
+        f"Общий доход: {snapshot.revenue_total:.2f} руб.\n",
+        f"За сегодня: {snapshot.revenue_today:.2f} руб.\n",
+        f"За месяц: {snapshot.revenue_month:.2f} руб.\n",
+        f"Средняя стоимость поездки: {snapshot.avg_price:.2f} руб.\n",
+    ]
+    
+    if any(snapshot.hourly_orders):
+        peak = max(snapshot.hourly_orders)
+        parts.append("\n<b>Сегодня по часам:</b>\n")
+        for hour, count in enumerate(snapshot.hourly_orders):
+            if count:
+                parts.append(f"<code>{hour:02d}:00 {count:>3}</code> {_bar(count, peak)}\n")
+    
+    if snapshot.daily:
+        peak = max(count for _, count, _ in snapshot.daily)
+        parts.append("\n<b>По дням:</b>\n")
+        for day, count, revenue in snapshot.daily:
+            parts.append(f"<code>{day:%d.%m} {count:>3}</code> {revenue:.0f} руб. {_bar(count, peak)}\n")
+    
+    if snapshot.drivers_revenue:
+        parts.append("\n<b>Выручка водителей за месяц:</b>\n")
+        for place, item in enumerate(snapshot.drivers_revenue, 1):
+            name = _text(item.first_name) or f"ID {item.driver_id}"
+            car = f" ({_text(item.car_number)})" if item.car_number else ""
+            parts.append(f"{place}. {name}{car}: {item.revenue:.2f} руб., поездок: {item.orders}\n")
+    
+    # Новые заказы, цены и завершения сбрасывают кэш, остальные изменения
+    # (отмены, отказы) видны после истечения его срока
+    parts.append(
+        f"\n<i>Обновлено {snapshot.generated_at:%H:%M:%S}; "
+        f"отмены и отказы могут отражаться с задержкой до {STATS_CACHE_SECONDS} с</i>"
+    )
+    return ''.join(parts)
+
+
+def supply_text(supply):
+    """Строки о текущем спросе и рекомендуемом коэффициенте цены"""
+    text = f"⚖️ Заказов без водителя: {supply.open_orders}, свободных водителей: {supply.drivers}\n"
+    if supply.multiplier > 1:
+        return text + f"📈 Высокий спрос: рекомендуемый коэффициент цены ×{supply.multiplier:g}\n"
+    return text + "Рекомендуемый коэффициент цены: ×1 (обычная цена)\n"
+
+
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+_SHADES = ' ░▒▓█'
+
+
+def _heatmap(matrix):
+    """Матрица день недели x час символами разной плотности"""
+    peak = max(max(row) for row in matrix)
+    lines = ["   " + "".join(str(hour // 10) if hour % 6 == 0 else ' ' for hour in range(24))]
+    lines.append("   " + "".join(str(hour % 10) if hour % 6 == 0 else ' ' for hour in range(24)))
+    for day, row in zip(WEEKDAYS, matrix):
+        cells = (_SHADES[min(len(_SHADES) - 1, math.ceil(value / peak * (len(_SHADES) - 1)))] if peak else ' ' for value in row)
+        lines.append(f"{day} {''.join(cells)}")
+    return '\n'.join(lines)
+
+
+def demand_text(report):
+    """Текст отчета о спросе по DemandReport"""
+    parts = [f"📉 <b>Спрос за {report.days} дн.</b>\n\n"]
+    if not report.orders:
+        parts.append("Заказов за период нет.")
+        return ''.join(parts)
+    
+    per_week = sum(report.by_weekday)
+    parts.append(f"Заказов: {report.orders} (в среднем {per_week:.1f} в неделю)\n")
+    parts.append(f"\n<b>По дням и часам</b> (время подачи):\n<pre>{_heatmap(report.matrix)}</pre>\n")
+    
+    peak = max(report.by_weekday)
+    parts.append("\n<b>Заказов в неделю по дням:</b>\n")
+    for day, value in zip(WEEKDAYS, report.by_weekday):
+        parts.append(f"<code>{day} {value:>5.1f}</code> {_bar(value, peak)}\n")
+    
+    if report.peaks:
+        parts.append("\n<b>Часы пик</b> (заказов в неделю):\n")
+        for weekday, hour, value in report.peaks:
+            parts.append(f"{WEEKDAYS[weekday]} {hour:02d}:00 - {value:.1f}\n")
+    
+    parts.append("\n<b>Предложенная цена:</b>\n")
+    parts.append(f"Принята в {report.accepted} из {report.offered} заказов ({report.conversion:.0%})\n")
+    
+    if report.destinations:
+        parts.append("\n<b>Направления:</b>\n")
+        for item in report.destinations:
+            price = f", средняя цена {item.avg_price:.0f} руб., принято {item.conversion:.0%}" if item.avg_price else ""
+            parts.append(f"{_text(item.name)}: {item.orders}{price}\n")
+    
+    parts.append(f"\n<i>Построено за {report.elapsed:.2f} с</i>")
+    return ''.join(parts)
+
+
+def price_batch_pages(cards, limit=MESSAGE_LIMIT):
+    """Карточки новых заказов, разложенные по сообщениям не длиннее limit"""
+    pages = [f"💰 <b>Новые заказы без цены: {len(cards)}</b>\n\n"]
+    for card in cards:
+        if len(pages[-1]) + len(card) + 1 > limit:
+            pages.append('')
+        pages[-1] += card + "\n"
+    return pages
+
+
+def _duration(seconds):
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    return f"{hours} ч {minutes:02d} мин" if hours else f"{minutes} мин"
+
+
+def utilization_text(report):
+    """Текст отчета о загрузке водителей по UtilizationReport"""
+    parts = [f"⏱ <b>Загрузка водителей за {report.days} дн.</b>\n\n"]
+    if not report.drivers:
+        parts.append("Водители за период на линию не выходили.")
+        return ''.join(parts)
+    
+    parts.append(
+        f"На линии: {_duration(report.idle_seconds + report.busy_seconds)}, "
+        f"на заказах: {_duration(report.busy_seconds)} ({report.utilization:.0%})\n"
+    )
+    for driver in report.drivers:
+        status = DRIVER_STATUS_TEXT.get(driver.status, driver.status)
+        parts.append(
+            f"\n<b>{_text(driver.first_name)}</b> ({_text(driver.car_number)}) - {status}\n"
+            f"На линии {_duration(driver.on_duty_seconds)}: на заказах {_duration(driver.busy_seconds)}, "
+            f"ожидание {_duration(driver.idle_seconds)} ({driver.utilization:.0%})\n"
+        )
+    return ''.join(parts)
@@ -0,0 +1,89 @@
+"""
+Время в базе и границы периодов.
+
+В базе встречаются три формата времени: CURRENT_TIMESTAMP SQLite
+('YYYY-MM-DD HH:MM:SS', UTC), isoformat с часовым поясом (completed_at,
+scheduled_at) и naive UTC из SQLAlchemy. Сравнивать их как строки нельзя,
+поэтому у таблиц есть столбцы *_ts с секундами Unix (заполняются
+триггерами, см. repository.init_schema), а запросы по периодам строятся
+по ним через границы из этого модуля.
+
+Сутки, неделя и месяц считаются по местному времени (config.TIMEZONE).
+"""
+import datetime
+from zoneinfo import ZoneInfo
+
+from config import TIMEZONE
+
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+PERIODS = ('day', 'week', 'month')
+
+
+def now_local():
+    return datetime.datetime.now(LOCAL_TZ)
+
+
+def to_epoch(value):
+    """Секунды Unix для datetime или строки из базы; naive время считается UTC"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+def from_epoch(ts):
+    """Местное время по секундам Unix"""
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, LOCAL_TZ)
+
+
+def to_local(now=None):
+    """Местное время; None - текущее, naive считается UTC"""
+    if now is None:
+        return now_local()
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=datetime.timezone.utc)
+    return now.astimezone(LOCAL_TZ)
+
+
+def local_midnight(date):
+    """Начало суток date по местному времени"""
+    return datetime.datetime.combine(date, datetime.time.min, tzinfo=LOCAL_TZ)
+
+
+def period_start(period, now=None):
+    """Начало текущих суток ('day'), недели с понедельника ('week') или месяца ('month')"""
+    today = to_local(now).date()
+    if period == 'day':
+        return local_midnight(today)
+    if period == 'week':
+        return local_midnight(today - datetime.timedelta(days=today.weekday()))
+    if period == 'month':
+        return local_midnight(today.replace(day=1))
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+def period_starts(now=None):
+    """Начала всех периодов PERIODS в секундах Unix"""
+    return {period: to_epoch(period_start(period, now)) for period in PERIODS}
+
+
+def split_by_day(start_ts, end_ts):
+    """[(местная дата, секунд)] - полуинтервал [start_ts, end_ts), разрезанный по местной полуночи"""
+    parts = []
+    while start_ts < end_ts:
+        date = from_epoch(start_ts).date()
+        boundary = min(end_ts, to_epoch(local_midnight(date + datetime.timedelta(days=1))))
+        parts.append((date, boundary - start_ts))
+        start_ts = boundary
+    return parts
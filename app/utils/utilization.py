@@ -0,0 +1,166 @@
+"""
+Загрузка водителей: время на линии, на заказах и в ожидании.
+
+Каждую смену drivers.status триггер записывает в driver_shifts: закрывает
+открытый интервал водителя и открывает новый (см. repository.init_schema),
+поэтому журнал полон при любом пути записи - кнопки водителя, назначение
+на заказ, админка, SQLAlchemy.
+
+roll_up() переносит закрытые, еще не учтенные интервалы в суточные итоги
+driver_shift_daily (интервал режется по местной полуночи) и помечает их
+учтенными, так что каждый интервал обрабатывается один раз - в том числе
+при одновременном вызове из нескольких процессов. Отчет читает
+только итоги и открытые интервалы (не больше одного на водителя).
+
+Статусы: ON_DUTY - свободен на линии, ON_ORDER и ARRIVED - занят заказом,
+остальные (OFF_DUTY) в загрузку не входят.
+"""
+import datetime
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.utils import metrics, timeutils
+from config import UTILIZATION_DAYS
+
+logger = logging.getLogger(__name__)
+
+IDLE_STATUSES = ('ON_DUTY',)
+BUSY_STATUSES = ('ON_ORDER', 'ARRIVED')
+# Сколько интервалов переносить в итоги за одну транзакцию
+BATCH_SIZE = 5000
+
+
+def _kind(status):
+    if status in BUSY_STATUSES:
+        return 'busy'
+    if status in IDLE_STATUSES:
+        return 'idle'
+    return None
+
+
+def _add(totals, driver_id, status, start_ts, end_ts, since_day=None):
+    kind = _kind(status)
+    if kind is None:
+        return
+    for day, seconds in timeutils.split_by_day(start_ts, end_ts):
+        if since_day is None or day >= since_day:
+            totals[driver_id, day.isoformat()][kind] += seconds
+
+
+def roll_up(conn, batch=BATCH_SIZE) -> int:
+    """Переносит закрытые интервалы в суточные итоги. Возвращает число обработанных интервалов"""
+    processed = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, driver_id, status, started_ts, ended_ts FROM driver_shifts '
+            'WHERE rolled_up = 0 AND ended_ts IS NOT NULL ORDER BY id LIMIT ?',
+            (batch,)
+        ).fetchall()
+        if not rows:
+            break
+        # Интервал сначала захватывается условным UPDATE: если roll_up идет
+        # параллельно в другом соединении, учтет интервал только тот, чей
+        # UPDATE изменил строку. Захват и итоги фиксируются одним commit
+        totals = defaultdict(lambda: {'idle': 0, 'busy': 0})
+        for shift_id, driver_id, status, started_ts, ended_ts in rows:
+            claimed = conn.execute(
+                'UPDATE driver_shifts SET rolled_up = 1 WHERE id = ? AND rolled_up = 0', (shift_id,)
+            ).rowcount
+            if claimed == 1:
+                _add(totals, driver_id, status, started_ts, ended_ts)
+                processed += 1
+        conn.executemany(
+            'INSERT INTO driver_shift_daily (driver_id, day, idle_seconds, busy_seconds) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(driver_id, day) DO UPDATE SET '
+            'idle_seconds = idle_seconds + excluded.idle_seconds, busy_seconds = busy_seconds + excluded.busy_seconds',
+            [(driver_id, day, value['idle'], value['busy']) for (driver_id, day), value in totals.items()]
+        )
+        conn.commit()
+        if len(rows) < batch:
+            break
+    if processed:
+        metrics.registry.inc('driver_shifts_rolled_up_total', processed)
+    return processed
+
+
+@dataclass
+class DriverUtilization:
+    driver_id: int
+    first_name: str
+    car_number: str
+    status: Optional[str] = None
+    idle_seconds: int = 0
+    busy_seconds: int = 0
+
+    @property
+    def on_duty_seconds(self):
+        return self.idle_seconds + self.busy_seconds
+
+    @property
+    def utilization(self):
+        """Доля времени на линии, занятая заказами"""
+        return self.busy_seconds / self.on_duty_seconds if self.on_duty_seconds else 0.0
+
+
+@dataclass
+class UtilizationReport:
+    generated_at: datetime.datetime
+    days: int
+    drivers: List[DriverUtilization] = field(default_factory=list)
+
+    @property
+    def idle_seconds(self):
+        return sum(driver.idle_seconds for driver in self.drivers)
+
+    @property
+    def busy_seconds(self):
+        return sum(driver.busy_seconds for driver in self.drivers)
+
+    @property
+    def utilization(self):
+        on_duty = self.idle_seconds + self.busy_seconds
+        return self.busy_seconds / on_duty if on_duty else 0.0
+
+
+def utilization_report(conn, days=UTILIZATION_DAYS, now=None) -> UtilizationReport:
+    """Загрузка водителей за последние days суток, включая текущие"""
+    try:
+        roll_up(conn)
+    except Exception as e:
+        # Отчет по уже посчитанным итогам лучше, чем никакого
+        logger.error(f"Ошибка переноса интервалов смен в итоги: {e}")
+        conn.rollback()
+    now = timeutils.to_local(now)
+    since_day = now.date() - datetime.timedelta(days=days - 1)
+    totals = defaultdict(lambda: {'idle': 0, 'busy': 0})
+    for driver_id, day, idle_seconds, busy_seconds in conn.execute(
+        'SELECT driver_id, day, idle_seconds, busy_seconds FROM driver_shift_daily WHERE day >= ?',
+        (since_day.isoformat(),)
+    ):
+        totals[driver_id, day]['idle'] += idle_seconds
+        totals[driver_id, day]['busy'] += busy_seconds
+    # Текущие интервалы еще не закрыты - считаем их до текущего момента
+    now_ts = timeutils.to_epoch(now)
+    for driver_id, status, started_ts in conn.execute(
+        'SELECT driver_id, status, started_ts FROM driver_shifts WHERE ended_ts IS NULL'
+    ):
+        _add(totals, driver_id, status, started_ts, now_ts, since_day)
+
+    report = UtilizationReport(generated_at=now, days=days)
+    drivers = {
+        row[0]: DriverUtilization(row[0], row[1], row[2], row[3])
+        for row in conn.execute('SELECT id, first_name, car_number, status FROM drivers WHERE is_approved = 1')
+    }
+    for (driver_id, _), value in totals.items():
+        driver = drivers.get(driver_id)
+        if driver is None:
+            continue
+        driver.idle_seconds += value['idle']
+        driver.busy_seconds += value['busy']
+    report.drivers = sorted(
+        (driver for driver in drivers.values() if driver.on_duty_seconds),
+        key=lambda driver: (-driver.on_duty_seconds, driver.driver_id)
+    )
+    return report
@@ -0,0 +1,352 @@
+"""
+Бенчмарк горячих путей БД на больших синтетических базах.
+
+Строит taxi.db заданного размера с реалистичным распределением:
+  * заказы за --days дней, больше заказов в последние месяцы и в часы пик;
+  * старые заказы завершены/отменены/отклонены, активные - только за
+    последние сутки;
+  * отзывы на часть завершенных заказов, заработок на каждый завершенный.
+
+Затем замеряет обработчики (active_orders, list_registered_drivers,
+driver_earnings, show_statistics) вызовом без Telegram (поддельный Bot API
+из loadtest.py) и для каждого выводит медиану, p95, число SQL-запросов
+за вызов и самые затратные запросы.
+
+Результаты сравниваются с сохраненной базовой линией: рост медианы больше
+--tolerance или рост числа запросов считается регрессией (код выхода 1).
+
+Запуск:
+    python benchmark.py --orders 200000 --save-baseline
+    python benchmark.py --orders 200000
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from loadtest import FakeTelegramAPI, UpdateFactory, percentile
+
+logger = logging.getLogger('benchmark')
+
+DEFAULT_BASELINE = os.path.join(PROJECT_ROOT, 'benchmark_baseline.json')
+
+# Вес часа суток в числе заказов (утренний и вечерний пик)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 10, 7, 5, 5, 6, 6, 5, 6, 8, 10, 10, 9, 7, 5, 3, 2]
+ACTIVE_STATUSES = ['NEW', 'PRICE_OFFERED', 'COUNTER_OFFERED', 'ACCEPTED', 'IN_PROGRESS']
+ACTIVE_WEIGHTS = [30, 20, 5, 25, 20]
+FINAL_STATUSES = ['COMPLETED', 'CANCELLED', 'DECLINED']
+FINAL_WEIGHTS = [80, 12, 8]
+RATING_WEIGHTS = [2, 3, 8, 22, 65]
+
+
+def _sql_ts(dt):
+    """Формат CURRENT_TIMESTAMP SQLite"""
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_database(path, orders, clients, drivers, days, active, seed):
+    """Создает синтетическую базу по пути path"""
+    import taxi_bot
+
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    taxi_bot.init_db()
+
+    from config import POPULAR_DESTINATIONS, CITY_NAME
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    cursor.executemany(
+        'INSERT INTO users (user_id, username, first_name, last_name, registration_date) VALUES (?, ?, ?, ?, ?)',
+        [
+            (5_000_000_000 + i, f"client{i}", f"Клиент{i}", None, _sql_ts(now - datetime.timedelta(days=rng.uniform(0, days))))
+            for i in range(clients)
+        ]
+    )
+    driver_user_base = 6_000_000_000
+    cursor.executemany(
+        'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+        [(driver_user_base + i, f"driver{i}", f"Водитель{i}") for i in range(drivers)]
+    )
+    cursor.executemany(
+        '''INSERT INTO drivers (user_id, first_name, license_number, car_registration, car_number, status, is_approved)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        [
+            (
+                driver_user_base + i, f"Водитель{i}", f"39 00 {i:06d}", f"39 01 {i:06d}", f"А{i:03d}АА39",
+                rng.choice(['ON_DUTY', 'ON_ORDER', 'OFF_DUTY']),
+                0 if i >= drivers - max(1, drivers // 20) else 1,
+            )
+            for i in range(drivers)
+        ]
+    )
+    approved_driver_ids = [row[0] for row in cursor.execute('SELECT id FROM drivers WHERE is_approved = 1')]
+    client_ids = [row[0] for row in cursor.execute('SELECT id FROM users WHERE user_id < ?', (driver_user_base,))]
+    # Постоянные клиенты заказывают заметно чаще остальных
+    client_weights = [1.0 / (rank + 1) ** 0.6 for rank in range(len(client_ids))]
+    hours = list(range(24))
+
+    order_rows = []
+    for i in range(orders):
+        is_active = i >= orders - active
+        if is_active:
+            created = now - datetime.timedelta(minutes=rng.uniform(0, 24 * 60))
+            status = rng.choices(ACTIVE_STATUSES, ACTIVE_WEIGHTS)[0]
+        else:
+            # Квадратный корень смещает заказы к последним месяцам (рост сервиса)
+            age_days = days * (1 - rng.random() ** 0.5)
+            day = (now - datetime.timedelta(days=age_days)).date()
+            created = datetime.datetime.combine(day, datetime.time(rng.choices(hours, HOUR_WEIGHTS)[0], rng.randrange(60)))
+            status = rng.choices(FINAL_STATUSES, FINAL_WEIGHTS)[0]
+        scheduled = created + datetime.timedelta(minutes=rng.randint(30, 24 * 60))
+        driver_id = None
+        price = None
+        completed = None
+        if status in ('COMPLETED', 'IN_PROGRESS') or (status == 'CANCELLED' and rng.random() < 0.3):
+            driver_id = rng.choice(approved_driver_ids)
+        if status != 'NEW':
+            price = float(rng.randrange(500, 4000, 50))
+        if status == 'COMPLETED':
+            completed = (scheduled + datetime.timedelta(minutes=rng.randint(15, 90))).replace(tzinfo=datetime.timezone.utc)
+        order_rows.append((
+            rng.choices(client_ids, client_weights)[0],
+            driver_id,
+            f"{CITY_NAME}, ул. Ленина, {rng.randint(1, 80)}",
+            rng.choice(POPULAR_DESTINATIONS),
+            scheduled.isoformat(),
+            rng.choice(['CASH', 'CARD']),
+            rng.choice([None, None, None, 'С ребенком', 'Багаж']),
+            price,
+            status,
+            _sql_ts(created),
+            completed.isoformat() if completed else None,
+        ))
+    order_rows.sort(key=lambda row: row[9])
+    cursor.executemany(
+        '''INSERT INTO orders (client_id, driver_id, from_address, to_address, scheduled_at, payment_method,
+                               comment, price, status, created_at, completed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        order_rows
+    )
+
+    completed_orders = cursor.execute(
+        "SELECT id, client_id, driver_id, price, completed_at FROM orders WHERE status = 'COMPLETED'"
+    ).fetchall()
+    cursor.executemany(
+        'INSERT INTO earnings (driver_id, order_id, amount, date) VALUES (?, ?, ?, ?)',
+        [
+            (driver_id, order_id, price, _sql_ts(datetime.datetime.fromisoformat(completed_at)))
+            for order_id, _, driver_id, price, completed_at in completed_orders
+        ]
+    )
+    cursor.executemany(
+        'INSERT INTO reviews (order_id, client_id, driver_id, rating, created_at) VALUES (?, ?, ?, ?, ?)',
+        [
+            (order_id, client_id, driver_id, rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+             _sql_ts(datetime.datetime.fromisoformat(completed_at)))
+            for order_id, client_id, driver_id, _, completed_at in completed_orders
+            if rng.random() < 0.6
+        ]
+    )
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def dataset_matches(path, params):
+    """Проверяет, что база по пути path построена с теми же параметрами"""
+    if not os.path.exists(path):
+        return False
+    try:
+        conn = sqlite3.connect(path)
+        row = conn.execute("SELECT value FROM benchmark_meta WHERE key = 'params'").fetchone()
+        conn.close()
+    except sqlite3.Error:
+        return False
+    return bool(row) and json.loads(row[0]) == params
+
+
+def mark_dataset(path, params):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE IF NOT EXISTS benchmark_meta (key TEXT PRIMARY KEY, value TEXT)')
+    conn.execute("INSERT OR REPLACE INTO benchmark_meta (key, value) VALUES ('params', ?)", (json.dumps(params),))
+    conn.commit()
+    conn.close()
+
+
+def busiest_driver_user_id(path):
+    conn = sqlite3.connect(path)
+    row = conn.execute('''
+        SELECT d.user_id FROM earnings e JOIN drivers d ON d.id = e.driver_id
+        GROUP BY e.driver_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    conn.close()
+    return row[0]
+
+
+def benchmark_cases(taxi_bot, driver_user_id):
+    """Замеряемые обработчики: имя -> (функция, текст сообщения, пользователь)"""
+    return {
+        'active_orders': (taxi_bot.active_orders, "📊 Активные заказы", taxi_bot.ADMIN_ID),
+        'list_registered_drivers': (taxi_bot.list_registered_drivers, "🚖 Зарегистрированные водители", taxi_bot.ADMIN_ID),
+        'driver_earnings': (taxi_bot.driver_earnings, "💰 Мой заработок", driver_user_id),
+        'show_statistics': (taxi_bot.show_statistics, "📈 Статистика", taxi_bot.ADMIN_ID),
+    }
+
+
+def run_case(func, message, repeat, instrumentation, reset=None):
+    """
+    Прогоняет обработчик repeat раз (после прогрева) и собирает статистику.
+    reset вызывается перед каждым вызовом вне замера - сбрасывает кэши,
+    чтобы замерялась работа с базой, а не попадание в кэш.
+    """
+    if reset:
+        reset()
+    func(message)
+    instrumentation.reset_query_stats()
+    samples = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        started = time.perf_counter()
+        func(message)
+        samples.append(time.perf_counter() - started)
+    queries = instrumentation.query_summary(limit=1000)
+    return {
+        'median': statistics.median(samples),
+        'p95': percentile(samples, 0.95),
+        'queries': sum(row['count'] for row in queries) / repeat,
+        'top_queries': [
+            {'sql': row['sql'], 'ms': row['total'] / repeat * 1000, 'count': row['count'] / repeat}
+            for row in queries[:3]
+        ],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Возвращает [(имя, статус, изменение медианы)] относительно базовой линии"""
+    verdicts = []
+    for name, result in results.items():
+        base = (baseline or {}).get('results', {}).get(name)
+        if not base:
+            verdicts.append((name, 'new', None))
+            continue
+        change = result['median'] / base['median'] - 1 if base['median'] else 0.0
+        if result['queries'] > base['queries'] + 0.5:
+            status = 'REGRESSION (queries)'
+        elif change > tolerance:
+            status = 'REGRESSION'
+        elif change < -tolerance:
+            status = 'faster'
+        else:
+            status = 'ok'
+        verdicts.append((name, status, change))
+    return verdicts
+
+
+def print_report(results, verdicts, baseline):
+    print()
+    print(f"{'обработчик':<26}{'медиана':>10}{'p95':>10}{'запросов':>10}{'база':>10}{'изм.':>9}  статус")
+    for name, status, change in verdicts:
+        result = results[name]
+        base = (baseline or {}).get('results', {}).get(name)
+        print(
+            f"{name:<26}{result['median'] * 1000:>10.2f}{result['p95'] * 1000:>10.2f}{result['queries']:>10.0f}"
+            f"{format(base['median'] * 1000, '.2f') if base else '-':>10}"
+            f"{(f'{change * 100:+.0f}%' if change is not None else '-'):>9}  {status}"
+        )
+    print()
+    for name, result in results.items():
+        print(f"{name}:")
+        for query in result['top_queries']:
+            print(f"  {query['ms']:8.2f} мс  x{query['count']:<7.0f} {query['sql'][:100]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей БД")
+    parser.add_argument('--orders', type=int, default=100000, help="число заказов в синтетической базе")
+    parser.add_argument('--clients', type=int, default=None, help="число клиентов (по умолчанию orders / 15)")
+    parser.add_argument('--drivers', type=int, default=40, help="число водителей")
+    parser.add_argument('--days', type=int, default=365, help="глубина истории, дней")
+    parser.add_argument('--active', type=int, default=40, help="число активных заказов")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5, help="прогонов каждого обработчика")
+    parser.add_argument('--db-dir', help="каталог для синтетической базы (переиспользуется между запусками)")
+    parser.add_argument('--rebuild', action='store_true', help="пересоздать базу")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="файл базовой линии")
+    parser.add_argument('--save-baseline', action='store_true', help="сохранить результаты как базовую линию")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимый рост медианы (доля)")
+    args = parser.parse_args()
+
+    params = {
+        'orders': args.orders,
+        'clients': args.clients or max(1, args.orders // 15),
+        'drivers': args.drivers,
+        'days': args.days,
+        'active': args.active,
+        'seed': args.seed,
+    }
+    db_dir = args.db_dir or os.path.join(tempfile.gettempdir(), f"taxi-bench-{args.orders}-{args.seed}")
+    os.makedirs(db_dir, exist_ok=True)
+    # taxi_bot открывает taxi.db в рабочем каталоге
+    os.chdir(db_dir)
+    path = os.path.abspath('taxi.db')
+
+    FakeTelegramAPI(keep_messages=False).install()
+
+    import taxi_bot
+    from app.database import instrumentation
+    from app.utils.statistics import cache as statistics_cache
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if args.rebuild or not dataset_matches(path, params):
+        logger.info(f"Строим базу {path}: {params}")
+        started = time.perf_counter()
+        build_database(path, **params)
+        mark_dataset(path, params)
+        logger.info(f"База построена за {time.perf_counter() - started:.1f} с")
+    # Миграции текущей версии кода
+    taxi_bot.init_db()
+
+    updates = UpdateFactory()
+    results = {}
+    for name, (func, text, user_id) in benchmark_cases(taxi_bot, busiest_driver_user_id(path)).items():
+        message = updates.message(user_id, text).message
+        results[name] = run_case(func, message, args.repeat, instrumentation, reset=statistics_cache.invalidate)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            logger.warning(f"Базовая линия снята на других параметрах {baseline.get('params')}, сравнение пропущено")
+            baseline = None
+
+    verdicts = compare(results, baseline, args.tolerance)
+    print_report(results, verdicts, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'params': params, 'results': results}, f, ensure_ascii=False, indent=2)
+        logger.info(f"Базовая линия сохранена в {args.baseline}")
+    elif any(status.startswith('REGRESSION') for _, status, _ in verdicts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,93 @@ ADMIN_ID = 916948327
 ADMIN_IDS = [916948327, 8386636652]  # Список всех администраторов
 DATABASE_URL = "sqlite:///taxi.db"
 
+# Метрики (HTTP-эндпоинт в формате Prometheus, 0 - отключить)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+# Порог медленного запроса (мс), для таких запросов сохраняется EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = 50
+# Сколько SQL-запросов может выполнить обработчик одного апдейта (app/)
+HANDLER_QUERY_BUDGET = 15
+# Горячий резерв: polling ведет только экземпляр, удерживающий блокировку
+# файла рядом с базой; остальные ждут и перехватывают работу
+LEADER_ELECTION = True
+# Окна отсева повторов (с): повторная доставка update_id и двойное нажатие
+# одной и той же инлайн-кнопки
+DEDUPE_UPDATE_SECONDS = 600
+DEDUPE_CALLBACK_SECONDS = 5
+# Массовые рассылки: сообщений в секунду (лимит Telegram ~30) и потоков отправки
+BROADCAST_RATE = 25
+BROADCAST_WORKERS = 8
+# Время жизни снимка статистики администратора (с)
+STATS_CACHE_SECONDS = 30
+# За сколько последних дней строится отчет о спросе (/demand)
+ANALYTICS_DAYS = 90
+# За сколько последних дней показывать загрузку водителей (/utilization)
+UTILIZATION_DAYS = 7
+# Уведомления администраторов: политика по умолчанию для каждой категории
+# ('immediate' - сразу, 'digest' - сводкой раз в NOTIFY_DIGEST_SECONDS, 'off' - не присылать)
+NOTIFY_DEFAULTS = {
+    'new_order': 'immediate',
+    'price_response': 'immediate',
+    'driver_status': 'digest',
+    'order_completed': 'digest',
+}
+NOTIFY_DIGEST_SECONDS = 300
+# Сколько последних маршрутов клиента предлагать для повтора поездки
+RECENT_ROUTES = 5
+# Геопозиции водителей: размер ячейки сетки (км), период записи в базу (с)
+# и возраст точки, после которого водитель не участвует в поиске ближайших (с)
+LOCATION_GRID_KM = 0.5
+LOCATION_FLUSH_SECONDS = 5
+LOCATION_STALE_SECONDS = 600
+# Сколько помнить, что Telegram ID - не водитель (геопозиции клиентов), с
+LOCATION_NOT_DRIVER_SECONDS = 300
+# Время подачи: средняя скорость по городу (км/ч), во сколько раз путь по
+# дорогам длиннее прямой, не чаще одной правки сообщения клиента за
+# ETA_EDIT_SECONDS и не дольше ETA_WATCH_SECONDS после назначения (с)
+ETA_SPEED_KMH = 30
+ETA_DETOUR_FACTOR = 1.35
+ETA_EDIT_SECONDS = 20
+ETA_WATCH_SECONDS = 3600
+
 # Настройки города
 CITY_NAME = "Светлогорск"
 CITY_RADIUS = 10  # в километрах
+# Центр города (широта, долгота) для проверки зоны обслуживания по геопозиции
+CITY_CENTER = (54.9439, 20.1520)
+# Улицы города для подсказок адресов (дополняются адресами из заказов)
+CITY_STREETS = [
+    "Калининградский проспект",
+    "ул. Ленина",
+    "ул. Октябрьская",
+    "ул. Морская",
+    "ул. Пионерская",
+    "ул. Гагарина",
+    "ул. Курортная",
+    "ул. Токарева",
+    "ул. Пушкина",
+    "ул. Горького",
+    "ул. Верещагина",
+    "ул. Лесная",
+    "ул. Садовая",
+    "ул. Балтийская",
+    "ул. Станционная",
+    "ул. Мичурина",
+    "ул. Фруктовая",
+    "ул. Нахимова",
+    "ул. Железнодорожная",
+    "Майский проезд",
+]
+# Часовой пояс города: границы суток, недель и месяцев в статистике
+TIMEZONE = "Europe/Kaliningrad"
+
+# Рекомендуемый коэффициент цены: (заказов без водителя на одного свободного
+# водителя, коэффициент) по возрастанию; без свободных водителей - последний
+SURGE_STEPS = [
+    (1.5, 1.2),
+    (2.5, 1.5),
+    (4, 2.0),
+]
 
 # Популярные направления
 POPULAR_DESTINATIONS = [
@@ -19,6 +103,27 @@ POPULAR_DESTINATIONS = [
     "г.Черняховск"
 ]
 
+# Другие населенные пункты области: распознаются, если клиент набрал город
+# назначения текстом
+KNOWN_SETTLEMENTS = [
+    "г.Пионерский",
+    "г.Светлый",
+    "г.Приморск",
+    "г.Гурьевск",
+    "г.Гвардейск",
+    "г.Полесск",
+    "г.Неман",
+    "г.Гусев",
+    "пос. Донское",
+    "пос. Приморье",
+    "пос. Рыбачий",
+    "пос. Морское",
+    "пос. Лесной",
+    "пос. Куликово",
+    "пос. Заостровье",
+    "пос. Отрадное",
+]
+
 # Статусы водителей
 DRIVER_STATUSES = {
     "ON_DUTY": "На линии",
@@ -0,0 +1,513 @@
+"""
+Нагрузочный тест бота без Telegram.
+
+Бот работает как обычно, но запросы к Bot API уходят в FakeTelegramAPI
+(apihelper.CUSTOM_REQUEST_SENDER): он отвечает с заданной задержкой,
+записывает исходящие сообщения и кнопки. Сценарии клиентов, администратора
+и водителей читают эти кнопки и отправляют следующие апдейты через
+bot.process_new_updates - так проходит полный цикл заказа:
+
+    клиент оформляет предзаказ -> админ назначает цену -> клиент соглашается
+    -> админ назначает водителя -> водитель на месте -> заказ выполнен
+    -> клиент ставит оценку
+
+База создается во временном каталоге (taxi.db в рабочей директории),
+рабочая база не затрагивается.
+
+Запуск:
+    python loadtest.py --clients 50 --drivers 5 --workers 4 --latency-ms 40
+"""
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import telebot
+from telebot import apihelper, types, util
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+logger = logging.getLogger('loadtest')
+
+CLIENT_ID_BASE = 7_000_000_000
+DRIVER_ID_BASE = 7_100_000_000
+
+
+class _FakeResponse:
+    """Минимальный ответ в духе requests.Response для apihelper"""
+
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, payload):
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+Delivered = collections.namedtuple('Delivered', 'message_id text buttons ts')
+
+
+class FakeTelegramAPI:
+    """
+    Поддельный Bot API.
+
+    Каждый вызов ждет latency +- jitter секунд, записывается в счетчики,
+    а отправленные/отредактированные сообщения кладутся во входящие чата
+    вместе с callback_data inline-кнопок.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, keep_messages=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.keep_messages = keep_messages
+        self.calls = collections.Counter()
+        self.inbox = collections.defaultdict(list)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def install(self):
+        apihelper.CUSTOM_REQUEST_SENDER = self
+        return self
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        params = params or {}
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        self.calls[name] += 1
+
+        result = True
+        if name in ('sendMessage', 'sendPhoto', 'editMessageText', 'editMessageReplyMarkup'):
+            chat_id = int(params.get('chat_id') or 0)
+            if name.startswith('edit') and params.get('message_id'):
+                message_id = int(params['message_id'])
+            else:
+                message_id = next(self._message_ids)
+            text = params.get('text') or params.get('caption') or ''
+            result = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': text,
+            }
+            if self.keep_messages and name != 'editMessageReplyMarkup':
+                self._deliver(chat_id, message_id, text, params.get('reply_markup'))
+        elif name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'loadtest', 'username': 'loadtest_bot'}
+        return _FakeResponse({'ok': True, 'result': result})
+
+    def _deliver(self, chat_id, message_id, text, reply_markup):
+        buttons = []
+        if reply_markup:
+            markup = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+            for row in markup.get('inline_keyboard', []):
+                buttons.extend(button['callback_data'] for button in row if 'callback_data' in button)
+        with self._cond:
+            self.inbox[chat_id].append(Delivered(message_id, text, buttons, time.perf_counter()))
+            self._cond.notify_all()
+
+    def position(self, chat_id):
+        with self._cond:
+            return len(self.inbox[chat_id])
+
+    def wait_for(self, chat_id, predicate, start=0, timeout=30.0):
+        """Ждет сообщение чата с индексом >= start, удовлетворяющее predicate"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            index = start
+            while True:
+                messages = self.inbox[chat_id]
+                while index < len(messages):
+                    if predicate(messages[index]):
+                        return index, messages[index]
+                    index += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"чат {chat_id}: нет ожидаемого сообщения")
+                self._cond.wait(remaining)
+
+    def next_message(self, chat_id, index, timeout):
+        """Следующее сообщение чата или None по таймауту"""
+        try:
+            return self.wait_for(chat_id, lambda message: True, index, timeout)
+        except TimeoutError:
+            return None
+
+
+class UpdateFactory:
+    """Собирает апдейты Telegram от имени пользователей"""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._ids = itertools.count(1_000_000)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"U{user_id % 100000}"}
+
+    def message(self, user_id, text):
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return types.Update.de_json({'update_id': next(self._update_ids), 'message': message})
+
+    def callback(self, user_id, message_id, data):
+        return types.Update.de_json({
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._ids)),
+                'chat_instance': str(user_id),
+                'from': self._user(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '',
+                },
+            },
+        })
+
+
+class _ErrorCounter(telebot.ExceptionHandler):
+    """Считает исключения обработчиков, отдельно - блокировки SQLite"""
+
+    def __init__(self):
+        self.errors = collections.Counter()
+        self.locked = 0
+        self._lock = threading.Lock()
+
+    def handle(self, exception):
+        with self._lock:
+            self.errors[type(exception).__name__] += 1
+            if 'locked' in str(exception):
+                self.locked += 1
+        logger.debug(f"Ошибка обработчика: {exception!r}")
+        return True
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _has_button(prefix):
+    return lambda message: any(data.startswith(prefix) for data in message.buttons)
+
+
+def _contains(*parts):
+    return lambda message: any(part in message.text for part in parts)
+
+
+class LoadTest:
+    def __init__(self, bot, api, args):
+        self.bot = bot
+        self.api = api
+        self.args = args
+        self.updates = UpdateFactory()
+        self.stop = threading.Event()
+        self.step_latency = collections.defaultdict(list)
+        self.sent_updates = 0
+        self.completed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    # --- отправка апдейтов ---
+
+    def _process(self, update):
+        with self._lock:
+            self.sent_updates += 1
+        self.bot.process_new_updates([update])
+
+    def wait_next_step(self, chat_id, timeout=None):
+        """Ждет, пока бот зарегистрирует обработчик следующего шага для чата"""
+        deadline = time.monotonic() + (timeout or self.args.step_timeout)
+        handlers = self.bot.next_step_backend.handlers
+        while chat_id not in handlers:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"чат {chat_id}: нет обработчика следующего шага")
+            time.sleep(0.001)
+
+    def ask(self, user_id, text, predicate, step):
+        """Отправляет текст и ждет ответ бота, засекая время ответа"""
+        if not text.startswith('/'):
+            self.wait_next_step(user_id)
+        start = self.api.position(user_id)
+        started = time.perf_counter()
+        self._process(self.updates.message(user_id, text))
+        _, message = self.api.wait_for(user_id, predicate, start, self.args.step_timeout)
+        self.step_latency[step].append(message.ts - started)
+        return message
+
+    def press(self, user_id, message_id, data, predicate, step):
+        """Нажимает inline-кнопку и ждет ответ бота"""
+        start = self.api.position(user_id)
+        started = time.perf_counter()
+        self._process(self.updates.callback(user_id, message_id, data))
+        _, message = self.api.wait_for(user_id, predicate, start, self.args.step_timeout)
+        self.step_latency[step].append(message.ts - started)
+        return message
+
+    def think(self):
+        if self.args.think_ms:
+            time.sleep(random.uniform(0, self.args.think_ms) / 1000.0)
+
+    # --- сценарии ---
+
+    def client(self, user_id):
+        try:
+            self._client_trip(user_id)
+            with self._lock:
+                self.completed += 1
+        except TimeoutError as e:
+            logger.warning(f"Сценарий клиента прерван: {e}")
+            with self._lock:
+                self.failed += 1
+
+    def _client_trip(self, user_id):
+        tz = ZoneInfo('Europe/Kaliningrad')
+        when = datetime.datetime.now(tz) + datetime.timedelta(hours=2, minutes=random.randint(0, 600))
+
+        self.ask(user_id, '/order', _contains('дату и время'), 'order_start')
+        self.think()
+        self.ask(user_id, when.strftime('%d.%m %H:%M'), _contains('Точка А'), 'schedule')
+        self.think()
+        self.ask(user_id, f"ул. Ленина, {random.randint(1, 60)}", _contains('направление'), 'from_address')
+        self.think()
+        destination = random.choice(self.destinations)
+        reply = self.ask(user_id, destination, _contains('улицу', 'комментарий'), 'destination')
+        if 'улицу' in reply.text:
+            self.think()
+            self.ask(user_id, f"ул. Мира, {random.randint(1, 40)}", _contains('комментарий'), 'to_street')
+        self.think()
+        self.ask(user_id, '-', _contains('способ оплаты'), 'comment')
+        self.think()
+        confirm = self.ask(user_id, random.choice(["💵 Наличные", "💳 Перевод на карту"]),
+                           _has_button('confirm_preorder'), 'payment')
+        self.press(user_id, confirm.message_id, 'confirm_preorder', _contains('создан'), 'confirm')
+
+        _, offer = self.api.wait_for(user_id, _has_button('accept_price:'), 0, self.args.trip_timeout)
+        data = next(d for d in offer.buttons if d.startswith('accept_price:'))
+        self.think()
+        self.press(user_id, offer.message_id, data, _contains('Вы приняли цену'), 'accept_price')
+
+        _, rating = self.api.wait_for(user_id, _has_button('rate:'), 0, self.args.trip_timeout)
+        data = random.choice([d for d in rating.buttons if d.startswith('rate:')])
+        self.think()
+        self.press(user_id, rating.message_id, data, _contains('Спасибо за оценку'), 'rate')
+        self.ask(user_id, '-', _contains('Спасибо'), 'review_comment')
+
+    def admin(self, admin_id):
+        """Админ по очереди обрабатывает кнопки цены и назначения водителя"""
+        index = 0
+        while not self.stop.is_set():
+            item = self.api.next_message(admin_id, index, 0.2)
+            if item is None:
+                continue
+            index, message = item
+            index += 1
+            for data in message.buttons:
+                try:
+                    if data.startswith('set_price:'):
+                        self.think()
+                        self.press(admin_id, message.message_id, data, _contains('Введите цену'), 'set_price')
+                        price = random.randrange(600, 2500, 50)
+                        self.ask(admin_id, str(price), _contains('установлена'), 'price_input')
+                    elif data.startswith('assign_driver:'):
+                        order_id = data.split(':')[1]
+                        self.think()
+                        choice = self.press(admin_id, message.message_id, data,
+                                            _has_button(f"select_driver:{order_id}:"), 'assign_driver')
+                        self.press(admin_id, choice.message_id, random.choice(choice.buttons),
+                                   _contains('назначен на заказ'), 'select_driver')
+                except TimeoutError as e:
+                    logger.warning(f"Админ: {e}")
+
+    def driver(self, driver_user_id):
+        """Водитель подтверждает прибытие и завершает поездку"""
+        index = 0
+        while not self.stop.is_set():
+            item = self.api.next_message(driver_user_id, index, 0.2)
+            if item is None:
+                continue
+            index, message = item
+            index += 1
+            for data in message.buttons:
+                try:
+                    if data.startswith('driver_arrived:'):
+                        self.think()
+                        self.press(driver_user_id, message.message_id, data,
+                                   _has_button('complete_order:'), 'driver_arrived')
+                    elif data.startswith('complete_order:'):
+                        if self.args.ride_ms:
+                            time.sleep(self.args.ride_ms / 1000.0)
+                        self.press(driver_user_id, message.message_id, data,
+                                   _contains('успешно завершен'), 'complete_order')
+                except TimeoutError as e:
+                    logger.warning(f"Водитель: {e}")
+
+    # --- запуск ---
+
+    def run(self, admin_id, driver_user_ids, client_ids):
+        from config import POPULAR_DESTINATIONS
+        self.destinations = POPULAR_DESTINATIONS
+
+        agents = [threading.Thread(target=self.admin, args=(admin_id,), daemon=True)]
+        agents += [threading.Thread(target=self.driver, args=(uid,), daemon=True) for uid in driver_user_ids]
+        for agent in agents:
+            agent.start()
+
+        clients = []
+        started = time.perf_counter()
+        for user_id in client_ids:
+            thread = threading.Thread(target=self.client, args=(user_id,), daemon=True)
+            thread.start()
+            clients.append(thread)
+            if self.args.ramp_ms:
+                time.sleep(self.args.ramp_ms / 1000.0)
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.stop.set()
+        for agent in agents:
+            agent.join(1.0)
+        return elapsed
+
+
+def seed_drivers(taxi_bot, count):
+    """Создает одобренных водителей на линии"""
+    conn = taxi_bot.get_db_connection()
+    cursor = conn.cursor()
+    user_ids = []
+    for i in range(count):
+        user_id = DRIVER_ID_BASE + i
+        cursor.execute(
+            'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            (user_id, f"driver{i}", f"Водитель {i}")
+        )
+        cursor.execute(
+            '''INSERT OR IGNORE INTO drivers (user_id, first_name, license_number, car_registration,
+                                              car_number, status, is_approved)
+               VALUES (?, ?, ?, ?, ?, 'ON_DUTY', 1)''',
+            (user_id, f"Водитель {i}", f"39 00 {i:06d}", f"39 01 {i:06d}", f"А{i:03d}АА39")
+        )
+        user_ids.append(user_id)
+    conn.commit()
+    conn.close()
+    return user_ids
+
+
+def print_report(test, api, errors, elapsed, metrics, instrumentation):
+    trips = test.completed
+    print()
+    print(f"Клиентов: {test.args.clients}, завершено поездок: {trips}, прервано: {test.failed}")
+    print(f"Время: {elapsed:.2f} с, поездок/с: {trips / elapsed:.2f}, "
+          f"апдейтов: {test.sent_updates} ({test.sent_updates / elapsed:.1f}/с), "
+          f"вызовов API: {sum(api.calls.values())}")
+
+    all_samples = [value for samples in test.step_latency.values() for value in samples]
+    print()
+    print(f"Время ответа бота, мс: p50 {percentile(all_samples, 0.5) * 1000:.1f}, "
+          f"p99 {percentile(all_samples, 0.99) * 1000:.1f}, max {max(all_samples, default=0) * 1000:.1f}")
+    print(f"{'шаг':<18}{'n':>6}{'p50':>10}{'p99':>10}")
+    for step, samples in sorted(test.step_latency.items()):
+        print(f"{step:<18}{len(samples):>6}{percentile(samples, 0.5) * 1000:>10.1f}"
+              f"{percentile(samples, 0.99) * 1000:>10.1f}")
+
+    print()
+    print(f"{'обработчик':<36}{'n':>6}{'p50':>9}{'p99':>9}{'БД p99':>9}")
+    db = {labels['handler']: hist for labels, hist in metrics.registry.histograms('handler_db_seconds')}
+    for labels, hist in sorted(metrics.registry.histograms('handler_seconds'), key=lambda item: -item[1].sum):
+        name = labels['handler']
+        db_p99 = db[name].quantile(0.99) if name in db else 0.0
+        print(f"{name[:35]:<36}{hist.count:>6}{hist.quantile(0.5) * 1000:>9.1f}"
+              f"{hist.quantile(0.99) * 1000:>9.1f}{db_p99 * 1000:>9.1f}")
+
+    db_total = sum(hist.sum for _, hist in metrics.registry.histograms('handler_db_seconds'))
+    handler_total = sum(hist.sum for _, hist in metrics.registry.histograms('handler_seconds'))
+    print()
+    print(f"БД: {db_total:.2f} с из {handler_total:.2f} с работы обработчиков "
+          f"({db_total / handler_total * 100 if handler_total else 0:.0f}%), "
+          f"ошибок 'database is locked': {errors.locked}, "
+          f"медленных запросов: {metrics.registry.counter_value('db_slow_queries_total')}")
+    if errors.errors:
+        print("Ошибки обработчиков: " + ", ".join(f"{name}={count}" for name, count in errors.errors.most_common()))
+    top = instrumentation.query_summary(limit=5)
+    if top:
+        print("Самые затратные запросы:")
+        for row in top:
+            print(f"  {row['total'] * 1000:8.1f} мс  x{row['count']:<6} {row['sql'][:90]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без Telegram")
+    parser.add_argument('--clients', type=int, default=30, help="число клиентов (по одной поездке)")
+    parser.add_argument('--drivers', type=int, default=5, help="число водителей на линии")
+    parser.add_argument('--workers', type=int, default=4, help="потоков обработки апдейтов у бота")
+    parser.add_argument('--latency-ms', type=float, default=30.0, help="задержка ответа Bot API")
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help="разброс задержки Bot API")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="пауза пользователя между действиями (макс.)")
+    parser.add_argument('--ride-ms', type=float, default=0.0, help="длительность поездки")
+    parser.add_argument('--ramp-ms', type=float, default=5.0, help="интервал запуска клиентов")
+    parser.add_argument('--step-timeout', type=float, default=30.0, help="таймаут ответа на шаг, с")
+    parser.add_argument('--trip-timeout', type=float, default=120.0, help="таймаут ожидания цены/завершения, с")
+    parser.add_argument('--db-dir', help="каталог для taxi.db (по умолчанию временный)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # taxi_bot открывает taxi.db в рабочем каталоге
+    os.chdir(args.db_dir or tempfile.mkdtemp(prefix='taxi-loadtest-'))
+
+    api = FakeTelegramAPI(args.latency_ms / 1000.0, args.jitter_ms / 1000.0).install()
+
+    import taxi_bot
+    from app.database import instrumentation
+    from app.utils import metrics
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    bot = taxi_bot.bot
+    bot.worker_pool = util.ThreadPool(bot, num_threads=args.workers)
+    errors = _ErrorCounter()
+    bot.exception_handler = errors
+
+    taxi_bot.init_db()
+    driver_user_ids = seed_drivers(taxi_bot, args.drivers)
+    client_ids = [CLIENT_ID_BASE + i for i in range(args.clients)]
+
+    logger.info(f"База: {os.path.abspath('taxi.db')}")
+    test = LoadTest(bot, api, args)
+    elapsed = test.run(taxi_bot.ADMIN_ID, driver_user_ids, client_ids)
+    bot.worker_pool.close()
+
+    print_report(test, api, errors, elapsed, metrics, instrumentation)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,288 @@
-import telebot
+"""
+Единая точка входа бота.
+
+    python main.py            # обработчики из app/handlers (как и до main.py)
+    python main.py --taxi     # основной бот (taxi_bot.py)
+
+Тяжелые модули (telebot, SQLAlchemy, обработчики) импортируются только
+внутри launch(). При старте:
+  * DDL выполняется, только если версия схемы (PRAGMA user_version)
+    устарела;
+  * set_my_commands вызывается, только если список команд изменился
+    (хэш хранится в bot_meta);
+  * get_me вызывается, только если сменился токен (имя бота кэшируется);
+  * время каждого этапа пишется в лог и в метрику startup_seconds;
+  * если LEADER_ELECTION включен, polling ведет только экземпляр,
+    удерживающий блокировку файла рядом с базой (app/utils/leader.py).
+    Второй экземпляр остается горячим резервом: обработчики загружены,
+    кэши прогреты (геопозиции водителей, подсказки адресов), и после
+    смерти ведущего он догружает только новое и сразу начинает polling.
+
+run.py и bot.py оставлены как обертки для старых скриптов деплоя и, как
+раньше, запускают обработчики из app/handlers.
+"""
+import argparse
+import hashlib
+import json
 import logging
-from config import BOT_TOKEN
-from app.database import init_db
-from app.handlers import (
-    register_user_handlers,
-    register_admin_handlers,
-    register_driver_handlers,
-    register_order_handlers
-)
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import time
+
+# Команды бота: (команда, описание)
+COMMANDS = [
+    ("/start", "Начать работу с ботом"),
+    ("/help", "Показать справку"),
+    ("/order", "Заказать такси"),
+    ("/profile", "Ваш профиль"),
+    ("/driver", "Меню водителя"),
+    ("/admin", "Админ-панель (только для администраторов)"),
+]
+
 logger = logging.getLogger(__name__)
 
-def main():
-    """Основная функция запуска бота"""
-    logger.info("Запуск бота Такси Светлогорск39")
+
+class StartupTimer:
+    """Замер этапов запуска"""
     
-    # Инициализация базы данных
-    init_db()
-    logger.info("База данных инициализирована")
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
     
-    # Создание экземпляра бота
-    bot = telebot.TeleBot(BOT_TOKEN, parse_mode='HTML')
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+    
+    @property
+    def total(self):
+        return self.last - self.started
     
-    # Регистрация обработчиков
+    def report(self):
+        from app.utils import metrics
+        for phase, seconds in self.phases:
+            metrics.registry.histogram('startup_seconds', phase=phase).observe(seconds)
+        metrics.registry.histogram('startup_seconds', phase='total').observe(self.total)
+        details = ", ".join(f"{phase} {seconds * 1000:.0f}" for phase, seconds in self.phases)
+        logger.info(f"Запуск занял {self.total * 1000:.0f} мс ({details})")
+
+
+def commands_hash(commands=COMMANDS, bot_id=''):
+    """Хэш списка команд для конкретного бота: новый токен на той же базе получает команды"""
+    payload = json.dumps([bot_id, commands], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def sync_commands(bot, conn, commands=COMMANDS):
+    """Вызывает set_my_commands, только если список команд изменился. Возвращает True, если вызывал"""
+    from telebot.types import BotCommand
+    from app.database import repository
+    
+    digest = commands_hash(commands, bot.token.split(':', 1)[0])
+    if repository.get_meta(conn, 'commands_hash') == digest:
+        return False
+    bot.set_my_commands([BotCommand(command, description) for command, description in commands])
+    repository.set_meta(conn, 'commands_hash', digest)
+    conn.commit()
+    return True
+
+
+def bot_identity(bot, conn):
+    """Имя бота: из bot_meta, а get_me - только для нового токена"""
+    from app.database import repository
+    
+    bot_id = bot.token.split(':', 1)[0]
+    cached = repository.get_meta(conn, 'bot_identity')
+    if cached:
+        identity = json.loads(cached)
+        if identity.get('id') == bot_id:
+            return identity
+    bot_info = bot.get_me()
+    identity = {'id': bot_id, 'username': bot_info.username, 'first_name': bot_info.first_name}
+    repository.set_meta(conn, 'bot_identity', json.dumps(identity, ensure_ascii=False))
+    conn.commit()
+    return identity
+
+
+def build_app_bot():
+    """Бот на обработчиках app/handlers"""
+    import telebot
+    from config import BOT_TOKEN
+    from app.database import session_scope
+    from app.handlers.user_handlers import register_user_handlers
+    from app.handlers.admin_handlers import register_admin_handlers
+    from app.handlers.driver_handlers import register_driver_handlers
+    from app.handlers.order_handlers import register_order_handlers
+    from app.utils import metrics
+    from app.utils.dedupe import install_dedupe
+    
+    bot = telebot.TeleBot(BOT_TOKEN, parse_mode='HTML')
     register_user_handlers(bot)
     register_admin_handlers(bot)
     register_driver_handlers(bot)
     register_order_handlers(bot)
     
-    logger.info("Обработчики зарегистрированы")
+    # Замер времени, одна сессия БД на апдейт и бюджет запросов обработчика
+    metrics.instrument_bot(bot, wrappers=(session_scope,))
+    install_dedupe(bot)
+    return bot
+
+
+def build_taxi_bot():
+    """Основной бот (taxi_bot.py)"""
+    import taxi_bot
+    return taxi_bot.bot
+
+
+def warm_up(bot):
+    """
+    Прогрев резерва: страницы горячих таблиц и индексов в кэше ОС,
+    геопозиции водителей и индекс подсказок адресов в памяти
+    """
+    from app.database import repository
+    from app.utils import addresses
     
-    # Установка имени бота
-    bot_info = bot.get_me()
-    logger.info(f"Бот запущен: @{bot_info.username} ({bot_info.first_name})")
+    tracker = getattr(bot, 'locations', None)
+    conn = repository.connect()
+    try:
+        repository.get_active_board(conn)
+        if tracker is not None:
+            logger.info(f"Загружено геопозиций водителей: {tracker.load(conn)}")
+        try:
+            logger.info(f"Загружено адресов для подсказок: {addresses.index.load(conn)}")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки адресов для подсказок: {e}")
+    finally:
+        conn.close()
+
+
+def refresh_caches(bot):
+    """Резерв стал ведущим: догружает только то, что записал прежний ведущий"""
+    from app.database import repository
+    from app.utils import addresses
+    
+    tracker = getattr(bot, 'locations', None)
+    conn = repository.connect()
+    try:
+        if tracker is not None:
+            logger.info(f"Обновлено геопозиций водителей: {tracker.refresh(conn)}")
+        try:
+            logger.info(f"Новых заказов в подсказках адресов: {addresses.index.refresh(conn)}")
+        except Exception as e:
+            logger.error(f"Ошибка обновления подсказок адресов: {e}")
+    finally:
+        conn.close()
+
+
+def run_polling(bot, leader=False):
+    """
+    Polling с перезапуском при ошибках. При конфликте 409 ведущий (держит
+    блокировку) продолжает попытки - второй poller запущен без выбора
+    ведущего и должен уступить; без блокировки экземпляр останавливается.
+    """
+    backoff = 5
+    while True:
+        try:
+            bot.polling(none_stop=True, interval=1, timeout=30, long_polling_timeout=30)
+            backoff = 5  # сброс после успешного цикла
+        except Exception as e:
+            msg = str(e)
+            if 'Conflict: terminated by other getUpdates request' in msg or '409' in msg:
+                if not leader:
+                    logger.error("Конфликт 409: уже запущен другой экземпляр бота. Останавливаю текущий.")
+                    break
+                logger.error("Конфликт 409: getUpdates вызывает экземпляр без выбора ведущего")
+            logger.error(f"Ошибка при polling: {e}")
+            logger.info(f"Перезапуск polling через {backoff} секунд...")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+def launch(app=True, bot=None, timer=None):
+    """
+    Запускает бота. bot передает taxi_bot.py при запуске напрямую
+    (python taxi_bot.py), чтобы модуль не импортировался второй раз.
+    """
+    timer = timer or StartupTimer()
+    logger.info("Запуск бота Такси Светлогорск39")
+    
+    if bot is None:
+        bot = build_app_bot() if app else build_taxi_bot()
+    timer.mark('импорт')
+    
+    from config import METRICS_HOST, METRICS_PORT, LEADER_ELECTION
+    from app.database import repository
+    from app.utils import metrics
+    from app.utils.leader import LeaderLock, wait_for_leadership
+    
+    conn = repository.connect()
+    try:
+        repository.ensure_schema(conn)
+        timer.mark('схема')
+        
+        if sync_commands(bot, conn):
+            logger.info("Команды бота обновлены")
+        timer.mark('команды')
+        
+        identity = bot_identity(bot, conn)
+        timer.mark('get_me')
+    finally:
+        conn.close()
+    
+    warm_up(bot)
+    timer.mark('прогрев')
+    timer.report()
     
-    # Запуск бота
+    lock = LeaderLock() if LEADER_ELECTION else None
     try:
+        if lock is not None:
+            wait_for_leadership(lock)
+            metrics.registry.inc('leader_elections_total')
+            # Кэши загружены при прогреве; ведущий продолжает с точек и заказов прежнего
+            refresh_caches(bot)
+        
+        # Эндпоинт метрик (только у ведущего, у резерва порт занят)
+        if METRICS_PORT:
+            try:
+                metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                logger.error(f"Не удалось запустить эндпоинт метрик: {e}")
+        
+        logger.info(f"Бот запущен: @{identity['username']} ({identity['first_name']})")
         logger.info("Бот начал прослушивание сообщений")
-        bot.set_my_commands([
-            telebot.types.BotCommand("/start", "Начать работу с ботом"),
-            telebot.types.BotCommand("/help", "Показать справку"),
-            telebot.types.BotCommand("/order", "Заказать такси"),
-            telebot.types.BotCommand("/profile", "Ваш профиль"),
-            telebot.types.BotCommand("/driver", "Меню водителя"),
-            telebot.types.BotCommand("/admin", "Админ-панель (только для администраторов)")
-        ])
-        bot.polling(none_stop=True)
+        run_polling(bot, leader=lock is not None and lock.is_leader)
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен пользователем")
     except Exception as e:
-        logger.error(f"Произошла ошибка: {e}")
+        logger.error(f"Критическая ошибка: {e}")
+        import traceback
+        logger.error(f"Трассировка: {traceback.format_exc()}")
     finally:
-        logger.info("Бот остановлен")
+        tracker = getattr(bot, 'locations', None)
+        if tracker is not None:
+            tracker.stop()
+        # Накопленные сводки администраторам отправляются перед выходом
+        notifier = getattr(bot, 'notifications', None)
+        if notifier is not None:
+            notifier.stop()
+        if lock is not None:
+            lock.release()
+        logger.info("Бот завершил работу")
+
+
+def main(argv=None):
+    timer = StartupTimer()
+    parser = argparse.ArgumentParser(description="Бот Такси Светлогорск39")
+    stack = parser.add_mutually_exclusive_group()
+    stack.add_argument('--app', action='store_true', help="обработчики из app/handlers (по умолчанию)")
+    stack.add_argument('--taxi', action='store_true', help="основной бот taxi_bot.py")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    launch(app=not args.taxi, timer=timer)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,9 +4,11 @@ import telebot
 import logging
 import os
 import sys
-import sqlite3
 import json
+import html
 import datetime
+import math
+import re
 from zoneinfo import ZoneInfo
 
 # Настройка логирования
@@ -18,6 +20,22 @@ logger = logging.getLogger(__name__)
 
 # Импортируем конфигурацию
 from config import BOT_TOKEN, ADMIN_ID, ADMIN_IDS, POPULAR_DESTINATIONS, CITY_NAME, CITY_RADIUS, DRIVER_STATUSES
+from app.database import events
+from app.database import instrumentation
+from app.database import repository
+from app.utils import addresses
+from app.utils import metrics
+from app.utils import routes
+from app.utils import statistics
+from app.utils import supply
+from app.utils import templates
+from app.utils import utilization
+from app.utils.broadcast import Broadcaster, BroadcastResult, Notification, dedupe_notifications
+from app.utils.dedupe import install_dedupe
+from app.utils.eta import EtaNotifier
+from app.utils.geo import LocationTracker, within_city
+from app.utils.notifications import ACTION_CATEGORIES, CATEGORIES, NotificationRouter, allowed_policies
+from app.keyboards.registry import cached_keyboard, inline_template
 
 # Функция для проверки прав администратора
 def is_admin(user_id):
@@ -35,8 +53,14 @@ def is_admin(user_id):
         return False
 
 # Функция для отправки сообщения всем администраторам
-def send_to_admins(text, parse_mode=None, reply_markup=None):
-    """Отправляет сообщение всем администраторам"""
+def send_to_admins(text, parse_mode=None, reply_markup=None, category=None, key=None, digest_text=None):
+    """
+    Отправляет сообщение всем администраторам. С category решение принимает
+    маршрутизатор уведомлений: сразу, в сводку или никак (настройки /notify)
+    """
+    if category is not None:
+        notifier.notify(category, text, parse_mode, reply_markup, key=key, digest_text=digest_text)
+        return
     for admin_id in ADMIN_IDS:
         try:
             bot.send_message(admin_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
@@ -54,118 +78,14 @@ def send_photo_to_admins(photo, caption=None):
 
 # Создание базы данных SQLite
 def init_db():
-    conn = sqlite3.connect('taxi.db')
-    cursor = conn.cursor()
-    
-    # Создаем таблицу пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER UNIQUE NOT NULL,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        phone_number TEXT,
-        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Создаем таблицу водителей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS drivers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER UNIQUE NOT NULL,
-        first_name TEXT NOT NULL,
-        license_number TEXT NOT NULL,
-        car_registration TEXT NOT NULL,
-        car_number TEXT NOT NULL,
-        car_photos TEXT,
-        status TEXT DEFAULT 'OFF_DUTY',
-        is_approved INTEGER DEFAULT 0,
-        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Создаем таблицу заказов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        client_id INTEGER,
-        driver_id INTEGER,
-        from_address TEXT NOT NULL,
-        to_address TEXT NOT NULL,
-        scheduled_at TEXT,
-        payment_method TEXT,
-        comment TEXT,
-        price REAL,
-        counter_offer REAL,
-        status TEXT DEFAULT 'NEW',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        completed_at TIMESTAMP,
-        FOREIGN KEY (client_id) REFERENCES users (id),
-        FOREIGN KEY (driver_id) REFERENCES drivers (id)
-    )
-    ''')
-    
-    # Миграция: добавляем столбец payment_method, если отсутствует (для существующих БД)
-    try:
-        cursor.execute("PRAGMA table_info(orders)")
-        cols = [row[1] for row in cursor.fetchall()]
-        if 'payment_method' not in cols:
-            cursor.execute('ALTER TABLE orders ADD COLUMN payment_method TEXT')
-        if 'scheduled_at' not in cols:
-            cursor.execute('ALTER TABLE orders ADD COLUMN scheduled_at TEXT')
-    except Exception as e:
-        logger.error(f"Ошибка миграции orders.payment_method: {e}")
-    
-    # Таблица администраторов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS admins (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER UNIQUE NOT NULL,
-        first_name TEXT,
-        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Создаем таблицу отзывов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS reviews (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER UNIQUE,
-        client_id INTEGER,
-        driver_id INTEGER,
-        rating INTEGER NOT NULL,
-        comment TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (order_id) REFERENCES orders (id),
-        FOREIGN KEY (client_id) REFERENCES users (id),
-        FOREIGN KEY (driver_id) REFERENCES drivers (id)
-    )
-    ''')
-    
-    # Создаем таблицу заработка
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS earnings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        driver_id INTEGER,
-        order_id INTEGER UNIQUE,
-        amount REAL NOT NULL,
-        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (driver_id) REFERENCES drivers (id),
-        FOREIGN KEY (order_id) REFERENCES orders (id)
-    )
-    ''')
-    
-    conn.commit()
+    conn = get_db_connection()
+    if repository.ensure_schema(conn):
+        logger.info("База данных инициализирована")
     conn.close()
-    logger.info("База данных инициализирована")
 
 # Функции для работы с базой данных
 def get_db_connection():
-    conn = sqlite3.connect('taxi.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return repository.connect()
 
 def save_user_data(user_id, username, first_name, last_name):
     conn = get_db_connection()
@@ -212,30 +132,43 @@ def get_driver_by_id(user_id):
     conn.close()
     return driver
 
-# Создание клавиатур
+# Создание клавиатур (статические строятся и сериализуются один раз)
+@cached_keyboard
 def get_main_keyboard():
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add(telebot.types.KeyboardButton("🚕 Заказать предварительно такси"))
+    markup.add(telebot.types.KeyboardButton("🔁 Повторить поездку"))
     markup.add(telebot.types.KeyboardButton("📝 Мои заказы"), telebot.types.KeyboardButton("🤝 Стать нашим партнером"))
     markup.add(telebot.types.KeyboardButton("📞 Связаться с нами"))
     return markup
 
+@cached_keyboard
 def get_admin_keyboard():
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(telebot.types.KeyboardButton("📊 Активные заказы"))
+    markup.add(telebot.types.KeyboardButton("📊 Активные заказы"), telebot.types.KeyboardButton("💰 Цены пачкой"))
     markup.add(telebot.types.KeyboardButton("🚖 Зарегистрированные водители"), telebot.types.KeyboardButton("📋 История заказов"))
     markup.add(telebot.types.KeyboardButton("📈 Статистика"), telebot.types.KeyboardButton("🗑️ Очистить заказы"))
-    markup.add(telebot.types.KeyboardButton("➕ Добавить администратора"))
+    markup.add(telebot.types.KeyboardButton("📉 Аналитика спроса"), telebot.types.KeyboardButton("⏱ Загрузка водителей"))
+    markup.add(telebot.types.KeyboardButton("➕ Добавить администратора"), telebot.types.KeyboardButton("🔔 Уведомления"))
     markup.add(telebot.types.KeyboardButton("🔙 Главное меню"))
     return markup
 
+@cached_keyboard
 def get_driver_keyboard():
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(telebot.types.KeyboardButton("🚗 Изменить статус"), telebot.types.KeyboardButton("📍 На месте"))
+    markup.add(telebot.types.KeyboardButton("🚗 Изменить статус"))
     markup.add(telebot.types.KeyboardButton("📋 Мои заказы"), telebot.types.KeyboardButton("💰 Мой заработок"))
+    markup.add(telebot.types.KeyboardButton("📍 Отправить геопозицию", request_location=True))
     markup.add(telebot.types.KeyboardButton("🔙 Главное меню"))
     return markup
 
+@cached_keyboard
+def get_pickup_location_keyboard():
+    markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(telebot.types.KeyboardButton("📍 Отправить геопозицию", request_location=True))
+    return markup
+
+@cached_keyboard
 def get_popular_destinations_keyboard():
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
     for destination in POPULAR_DESTINATIONS:
@@ -244,8 +177,48 @@ def get_popular_destinations_keyboard():
     markup.add(telebot.types.KeyboardButton("🔙 Назад"))
     return markup
 
+@cached_keyboard
+def get_yes_no_keyboard():
+    markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(telebot.types.KeyboardButton("✅ Да"), telebot.types.KeyboardButton("❌ Нет"))
+    return markup
+
+@inline_template('query')
+def get_address_search_keyboard(query):
+    # Открывает инлайн-режим бота с подсказками адресов в поле ввода
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(telebot.types.InlineKeyboardButton("🔎 Найти адрес", switch_inline_query_current_chat=query))
+    return markup
+
+@inline_template('order_id')
+def get_price_response_keyboard(order_id):
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(
+        telebot.types.InlineKeyboardButton("✅ Согласен", callback_data=f"accept_price:{order_id}"),
+        telebot.types.InlineKeyboardButton("❌ Не согласен", callback_data=f"decline_price:{order_id}")
+    )
+    markup.add(telebot.types.InlineKeyboardButton("💰 Предложить свою цену", callback_data=f"counter_offer:{order_id}"))
+    return markup
+
+@inline_template('order_id')
+def get_rating_keyboard(order_id):
+    markup = telebot.types.InlineKeyboardMarkup()
+    for i in range(1, 6):
+        markup.add(telebot.types.InlineKeyboardButton(f"⭐ {i}", callback_data=f"rate:{order_id}:{i}"))
+    return markup
+
 # Создание экземпляра бота
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode='HTML')
+# Массовые рассылки с ограничением скорости
+broadcaster = Broadcaster(bot)
+# Уведомления администраторов: сразу или сводкой, по настройкам каждого
+notifier = NotificationRouter(bot, broadcaster, lambda: ADMIN_IDS)
+bot.notifications = notifier
+# Последние геопозиции водителей (сетка в памяти, запись в базу в фоне)
+locations = LocationTracker()
+bot.locations = locations
+# Обновляемое время подачи в сообщении клиенту о назначенном водителе
+eta = EtaNotifier(bot, locations)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("driver_arrived:"))
 def driver_arrived_callback(call):
@@ -274,6 +247,7 @@ def driver_arrived_callback(call):
     
     # Обновляем статус водителя на ARRIVED
     cursor.execute('UPDATE drivers SET status = ? WHERE id = ?', ('ARRIVED', driver['id']))
+    events.log_order_event(cursor, order_id, events.EVENT_ARRIVED, actor_id=user_id, driver_id=driver['id'])
     conn.commit()
     
     # Уведомляем клиента о прибытии
@@ -284,6 +258,7 @@ def driver_arrived_callback(call):
     
     # Снимаем кнопки прежнего сообщения
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+    eta.stop(order_id, "🚗 Водитель на месте.")
     
     if client_user_id:
         try:
@@ -299,6 +274,8 @@ def driver_arrived_callback(call):
 # Временное хранилище данных
 user_order_data = {}
 driver_registration_data = {}
+# Маршруты, предложенные клиенту для повтора (номер кнопки -> маршрут)
+repeat_offers = {}
 
 # Обработчики команд
 @bot.message_handler(commands=['start'])
@@ -356,6 +333,58 @@ def admin_command(message):
         reply_markup=get_admin_keyboard()
     )
 
+@bot.message_handler(commands=['metrics'])
+def metrics_command(message):
+    """Сводка времени работы обработчиков (только для администраторов)"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
+    
+    rows = metrics.handler_summary()
+    if not rows:
+        bot.send_message(message.chat.id, "Метрик пока нет.")
+        return
+    
+    text = "⏱ <b>Время обработчиков</b> (p50 / p95, среднее БД / API, мс)\n\n"
+    for row in rows:
+        text += (
+            f"<code>{row['handler']}</code>\n"
+            f"  вызовов: {row['count']}, "
+            f"{row['p50'] * 1000:.0f} / {row['p95'] * 1000:.0f}, "
+            f"БД {row['db_avg'] * 1000:.1f}, API {row['api_avg'] * 1000:.0f}\n"
+        )
+    bot.send_message(message.chat.id, text, parse_mode="HTML")
+
+@bot.message_handler(commands=['slowqueries'])
+def slow_queries_command(message):
+    """Статистика запросов к БД и планы медленных запросов (только для администраторов)"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
+    
+    rows = instrumentation.query_summary(limit=10)
+    if not rows:
+        bot.send_message(message.chat.id, "Запросов пока не было.")
+        return
+    
+    text = "🐢 <b>Запросы к БД</b> (вызовов, среднее / макс. мс, строк, шагов VM)\n\n"
+    for row in rows:
+        text += (
+            f"<code>{html.escape(row['sql'][:200])}</code>\n"
+            f"  {row['count']}, {row['avg'] * 1000:.2f} / {row['max'] * 1000:.1f}, "
+            f"{row['rows']}, {row['steps']}\n"
+        )
+    
+    plans = instrumentation.slow_query_plans()[:5]
+    if plans:
+        text += "\n<b>Планы медленных запросов:</b>\n"
+        for item in plans:
+            text += f"\n<code>{html.escape(item['sql'][:200])}</code> ({item['elapsed'] * 1000:.0f} мс)\n"
+            for line in item['plan']:
+                text += f"  {html.escape(line)}\n"
+    
+    bot.send_message(message.chat.id, text[:4000], parse_mode="HTML")
+
 @bot.message_handler(commands=['order'])
 @bot.message_handler(func=lambda message: message.text == "🚕 Заказать предварительно такси")
 def order_taxi(message):
@@ -380,6 +409,50 @@ def order_taxi(message):
     )
     bot.register_next_step_handler(message, process_schedule_datetime)
 
+def _route_button_text(route):
+    from_address = route.from_address
+    # Город точки А и так понятен
+    if from_address.lower().startswith(CITY_NAME.lower() + ', '):
+        from_address = from_address[len(CITY_NAME) + 2:]
+    text = f"{'⭐ ' if route.favourite else ''}{from_address} → {route.to_address}"
+    return text if len(text) <= 60 else text[:59] + '…'
+
+@bot.message_handler(commands=['repeat'])
+@bot.message_handler(func=lambda message: message.text == "🔁 Повторить поездку")
+def repeat_trip(message):
+    """Заказ по одному из последних маршрутов: адреса и оплата уже известны"""
+    user_id = message.from_user.id
+    recent = routes.cache.get(user_id)
+    if not recent:
+        bot.send_message(message.chat.id, "У вас пока нет поездок для повтора. Оформите заказ через «🚕 Заказать предварительно такси».")
+        return
+    
+    repeat_offers[user_id] = recent
+    markup = telebot.types.InlineKeyboardMarkup()
+    for i, route in enumerate(recent):
+        markup.add(telebot.types.InlineKeyboardButton(_route_button_text(route), callback_data=f"repeat_route:{i}"))
+    bot.send_message(message.chat.id, "Выберите маршрут:", reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("repeat_route:"))
+def repeat_route_callback(call):
+    user_id = call.from_user.id
+    recent = repeat_offers.pop(user_id, None)
+    try:
+        route = recent[int(call.data.split(":")[1])]
+    except (TypeError, ValueError, IndexError):
+        bot.answer_callback_query(call.id, "Список маршрутов устарел, откройте его заново")
+        return
+    
+    user_order_data[user_id] = route.order_data()
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(
+        f"🔁 {html.escape(route.from_address)} → {html.escape(route.to_address)}",
+        call.message.chat.id,
+        call.message.message_id
+    )
+    bot.send_message(call.message.chat.id, "Укажите дату и время подачи такси (например: 10.09 14:30):")
+    bot.register_next_step_handler(call.message, process_schedule_datetime)
+
 def process_schedule_datetime(message):
     user_id = message.from_user.id
     text = message.text.strip()
@@ -405,10 +478,23 @@ def process_schedule_datetime(message):
         bot.register_next_step_handler(message, process_schedule_datetime)
         return
     
-    user_order_data.setdefault(user_id, {})['scheduled_at'] = dt.isoformat()
+    data = user_order_data.setdefault(user_id, {})
+    data['scheduled_at'] = dt.isoformat()
+    
+    # Повтор поездки: адреса уже заполнены - сразу к оплате или подтверждению
+    if data.get('to_address'):
+        if data.get('payment_method'):
+            send_preorder_confirmation(message.chat.id, data)
+        else:
+            ask_payment_method(message)
+        return
     
-    # Далее точка А: только ручной ввод
-    bot.send_message(message.chat.id, "Точка А должна быть в Светлогорске (и 10 км). Введите корректный адрес:")
+    # Далее точка А: ручной ввод или геопозиция
+    bot.send_message(
+        message.chat.id,
+        "Точка А должна быть в Светлогорске (и 10 км). Введите корректный адрес или отправьте геопозицию:",
+        reply_markup=get_pickup_location_keyboard()
+    )
     bot.register_next_step_handler(message, process_manual_from_address)
 
 def process_preorder_destination(message):
@@ -417,15 +503,17 @@ def process_preorder_destination(message):
         bot.send_message(message.chat.id, "Отмена.", reply_markup=get_main_keyboard())
         return
     
-    if message.text not in POPULAR_DESTINATIONS:
+    # Только точное название: догадку по опечатке здесь переспросить негде
+    destination = addresses.destinations.exact(message.text)
+    if destination not in POPULAR_DESTINATIONS:
         bot.send_message(message.chat.id, "Пожалуйста, выберите один из предложенных вариантов.")
         bot.register_next_step_handler(message, process_preorder_destination)
         return
     
-    user_order_data[user_id]['to_address'] = message.text
+    user_order_data[user_id]['to_address'] = destination
     
     # Адрес отправления (точка А) вручную
-    bot.send_message(message.chat.id, "Введите адрес отправления (улица и дом):", reply_markup=None)
+    bot.send_message(message.chat.id, "Введите адрес отправления (улица и дом):", reply_markup=get_address_search_keyboard(f"{CITY_NAME}, "))
     bot.register_next_step_handler(message, process_preorder_from_address)
 
 def process_preorder_from_address(message):
@@ -453,8 +541,9 @@ def process_preorder_comment(message):
     if comment == '-':
         comment = None
     user_order_data[user_id]['comment'] = comment
-    
-    # Способ оплаты
+    ask_payment_method(message)
+
+def ask_payment_method(message):
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add(telebot.types.KeyboardButton("💵 Наличные"), telebot.types.KeyboardButton("💳 Перевод на карту"))
     bot.send_message(message.chat.id, "Выберите способ оплаты:", reply_markup=markup)
@@ -470,9 +559,10 @@ def process_preorder_payment(message):
     
     payment_method = 'CASH' if pm == "💵 Наличные" else 'CARD'
     user_order_data[user_id]['payment_method'] = payment_method
-    
-    # Подтверждение заказа
-    data = user_order_data[user_id]
+    send_preorder_confirmation(message.chat.id, user_order_data[user_id])
+
+def send_preorder_confirmation(chat_id, data):
+    payment_method = data['payment_method']
     text = (
         "Проверьте детали предзаказа:\n\n"
         f"Откуда: {data['from_address']}\n"
@@ -487,7 +577,7 @@ def process_preorder_payment(message):
         telebot.types.InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_preorder"),
         telebot.types.InlineKeyboardButton("❌ Отменить", callback_data="cancel_preorder")
     )
-    bot.send_message(message.chat.id, text, reply_markup=markup)
+    bot.send_message(chat_id, text, reply_markup=markup)
 
 @bot.callback_query_handler(func=lambda call: call.data in ("confirm_preorder","cancel_preorder"))
 def confirm_preorder_callback(call):
@@ -516,12 +606,18 @@ def confirm_preorder_callback(call):
     client_order_number = cursor.fetchone()[0] + 1
     
     cursor.execute(
-        'INSERT INTO orders (client_id, from_address, to_address, payment_method, comment, status, scheduled_at) VALUES (?,?,?,?,?,?,?)',
-        (u['id'], data['from_address'], data['to_address'], data.get('payment_method'), data.get('comment'), 'NEW', data.get('scheduled_at'))
+        'INSERT INTO orders (client_id, from_address, to_address, payment_method, comment, status, scheduled_at, from_lat, from_lon) VALUES (?,?,?,?,?,?,?,?,?)',
+        (u['id'], data['from_address'], data['to_address'], data.get('payment_method'), data.get('comment'), 'NEW', data.get('scheduled_at'), data.get('from_lat'), data.get('from_lon'))
     )
-    conn.commit()
     order_id = cursor.lastrowid
+    events.log_order_event(cursor, order_id, events.EVENT_CREATED, new_status='NEW', actor_id=user_id, preorder=True)
+    conn.commit()
     conn.close()
+    # Статистика администратора сразу учитывает новый заказ
+    statistics.cache.invalidate()
+    # Адрес из геопозиции (координаты текстом) в подсказки не попадает
+    addresses.index.add(None if data.get('from_lat') is not None else data['from_address'], data['to_address'])
+    routes.cache.record(user_id, data['from_address'], data['to_address'], data.get('payment_method'), data.get('from_lat'), data.get('from_lon'))
     
     bot.edit_message_text(
         f"✅ Предварительный заказ #{client_order_number} создан. Ожидайте цены.",
@@ -541,7 +637,7 @@ def confirm_preorder_callback(call):
     )
     markup = telebot.types.InlineKeyboardMarkup()
     markup.add(telebot.types.InlineKeyboardButton("💰 Установить цену", callback_data=f"set_price:{order_id}"))
-    send_to_admins(admin_text, parse_mode="HTML", reply_markup=markup)
+    send_to_admins(admin_text, parse_mode="HTML", reply_markup=markup, category='new_order')
     
     user_order_data.pop(user_id, None)
 
@@ -591,11 +687,7 @@ def process_from_address(message):
         user_order_data[user_id]['from_address'] = from_address
     
     # Запрашиваем адрес назначения
-    markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    for destination in POPULAR_DESTINATIONS:
-        markup.add(telebot.types.KeyboardButton(destination))
-    markup.add(telebot.types.KeyboardButton("✏️ Ввести другой адрес"))
-    markup.add(telebot.types.KeyboardButton("🔙 Назад"))
+    markup = get_popular_destinations_keyboard()
     
     bot.send_message(
         message.chat.id,
@@ -607,6 +699,31 @@ def process_from_address(message):
 def process_manual_from_address(message):
     """Обработка ручного ввода адреса отправления"""
     user_id = message.from_user.id
+    
+    # Геопозиция вместо адреса: проверяем расстояние до центра города
+    if message.location is not None:
+        lat, lon = message.location.latitude, message.location.longitude
+        if not within_city(lat, lon):
+            bot.send_message(
+                message.chat.id,
+                f"Точка находится за пределами зоны обслуживания ({CITY_NAME} и {CITY_RADIUS} км). Введите адрес или отправьте другую геопозицию:",
+                reply_markup=get_pickup_location_keyboard()
+            )
+            bot.register_next_step_handler(message, process_manual_from_address)
+            return
+        user_order_data[user_id]['from_lat'] = lat
+        user_order_data[user_id]['from_lon'] = lon
+        user_order_data[user_id]['from_address'] = f"{CITY_NAME}, геопозиция {lat:.5f}, {lon:.5f}"
+        markup = get_popular_destinations_keyboard()
+        bot.send_message(message.chat.id, "Выберите направление (точка Б) или введите другой адрес:", reply_markup=markup)
+        bot.register_next_step_handler(message, process_to_address)
+        return
+    
+    if not message.text:
+        bot.send_message(message.chat.id, "Введите адрес текстом или отправьте геопозицию:", reply_markup=get_pickup_location_keyboard())
+        bot.register_next_step_handler(message, process_manual_from_address)
+        return
+    
     from_address = message.text
     
     # Проверяем, что адрес в пределах города
@@ -623,11 +740,7 @@ def process_manual_from_address(message):
     # уже сохранено выше
     
     # Теперь выбор направления для точки Б
-    markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    for destination in POPULAR_DESTINATIONS:
-        markup.add(telebot.types.KeyboardButton(destination))
-    markup.add(telebot.types.KeyboardButton("✏️ Ввести другой адрес"))
-    markup.add(telebot.types.KeyboardButton("🔙 Назад"))
+    markup = get_popular_destinations_keyboard()
     bot.send_message(message.chat.id, "Выберите направление (точка Б) или введите другой адрес:", reply_markup=markup)
     bot.register_next_step_handler(message, process_to_address)
 
@@ -643,40 +756,73 @@ def process_to_address(message):
         bot.send_message(
             message.chat.id,
             "Пожалуйста, введите адрес назначения:",
-            reply_markup=None
+            reply_markup=get_address_search_keyboard("")
         )
         bot.register_next_step_handler(message, process_custom_to_address)
         return
     
-    # Если пользователь выбрал город из списка
-    if message.text in POPULAR_DESTINATIONS:
-        to_city = message.text
-        user_order_data[user_id]['to_city'] = to_city
-        
-        # Для аэропорта не спрашиваем адрес - он один
-        if "Аэропорт" in message.text:
-            user_order_data[user_id]['to_address'] = message.text
-            # Переходим сразу к комментарию
-            bot.send_message(message.chat.id, "Добавьте комментарий к заказу (необязательно). Если не нужен, отправьте '-':", reply_markup=None)
-            bot.register_next_step_handler(message, process_preorder_comment)
-            return
-        
-        bot.send_message(
-            message.chat.id,
-            f"Введите улицу и дом в пункте назначения ({to_city}):",
-            reply_markup=None
-        )
-        bot.register_next_step_handler(message, process_to_city_street)
+    # Город кнопкой или текстом ("калининград", "храброво"), возможно с адресом через запятую
+    head, _, street = (message.text or '').partition(',')
+    street = street.strip()
+    to_city = addresses.destinations.exact(head)
+    if to_city is not None:
+        accept_to_city(message, to_city, street)
+        return
+    
+    # Опечатка ("калиниград"): принимаем только после подтверждения клиентом
+    guess = addresses.destinations.match(head)
+    if guess is not None:
+        user_order_data[user_id]['to_guess'] = (guess, street)
+        bot.send_message(message.chat.id, f"Вы имели в виду «{guess}»?", reply_markup=get_yes_no_keyboard())
+        bot.register_next_step_handler(message, process_to_city_guess)
         return
     
     # Иначе просим выбрать город из списка
     bot.send_message(message.chat.id, "Пожалуйста, выберите город назначения кнопкой или введите другой адрес.")
     bot.register_next_step_handler(message, process_to_address)
-    return
+
+def process_to_city_guess(message):
+    user_id = message.from_user.id
+    guess, street = user_order_data.get(user_id, {}).pop('to_guess', (None, ''))
     
-    # Комментарий
-    bot.send_message(message.chat.id, "Добавьте комментарий к заказу (необязательно). Если не нужен, отправьте '-':", reply_markup=None)
-    bot.register_next_step_handler(message, process_preorder_comment)
+    if message.text == "✅ Да" and guess is not None:
+        accept_to_city(message, guess, street)
+        return
+    
+    if message.text == "❌ Нет" or guess is None:
+        markup = get_popular_destinations_keyboard()
+        bot.send_message(message.chat.id, "Выберите направление (точка Б) кнопкой или введите адрес еще раз:", reply_markup=markup)
+        bot.register_next_step_handler(message, process_to_address)
+        return
+    
+    # Вместо ответа клиент сразу набрал другой адрес
+    process_to_address(message)
+
+def accept_to_city(message, to_city, street):
+    """Город назначения выбран: полный адрес, аэропорт или запрос улицы"""
+    user_id = message.from_user.id
+    user_order_data[user_id]['to_city'] = to_city
+    
+    if street:
+        user_order_data[user_id]['to_address'] = f"{to_city}, {street}"
+        bot.send_message(message.chat.id, "Добавьте комментарий к заказу (необязательно). Если не нужен, отправьте '-':", reply_markup=None)
+        bot.register_next_step_handler(message, process_preorder_comment)
+        return
+    
+    # Для аэропорта не спрашиваем адрес - он один
+    if "Аэропорт" in to_city:
+        user_order_data[user_id]['to_address'] = to_city
+        # Переходим сразу к комментарию
+        bot.send_message(message.chat.id, "Добавьте комментарий к заказу (необязательно). Если не нужен, отправьте '-':", reply_markup=None)
+        bot.register_next_step_handler(message, process_preorder_comment)
+        return
+    
+    bot.send_message(
+        message.chat.id,
+        f"Введите улицу и дом в пункте назначения ({to_city}):",
+        reply_markup=get_address_search_keyboard(f"{to_city}, ")
+    )
+    bot.register_next_step_handler(message, process_to_city_street)
 
 def process_custom_to_address(message):
     user_id = message.from_user.id
@@ -701,23 +847,27 @@ def process_to_city_street(message):
     if not to_city:
         bot.send_message(message.chat.id, "Произошла ошибка выбора города. Повторите выбор.")
         # Вернемся к выбору города
-        markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-        for destination in POPULAR_DESTINATIONS:
-            markup.add(telebot.types.KeyboardButton(destination))
-        markup.add(telebot.types.KeyboardButton("✏️ Ввести другой адрес"))
-        markup.add(telebot.types.KeyboardButton("🔙 Назад"))
+        markup = get_popular_destinations_keyboard()
         bot.send_message(message.chat.id, "Выберите направление (точка Б) или введите другой адрес:", reply_markup=markup)
         bot.register_next_step_handler(message, process_to_address)
         return
     
-    # Формируем полный адрес назначения
-    to_address = f"{to_city}, {street}"
+    # Формируем полный адрес назначения (подсказка уже содержит город)
+    to_address = street if street.lower().startswith(to_city.lower()) else f"{to_city}, {street}"
     user_order_data[user_id]['to_address'] = to_address
     
     # Комментарий
     bot.send_message(message.chat.id, "Добавьте комментарий к заказу (необязательно). Если не нужен, отправьте '-':", reply_markup=None)
     bot.register_next_step_handler(message, process_preorder_comment)
 
+# Подсказки адресов в инлайн-режиме: "@бот морская" в поле ввода
+@bot.inline_handler(func=lambda query: True)
+def address_inline_query(query):
+    try:
+        bot.answer_inline_query(query.id, addresses.index.inline_results(query.query), cache_time=60)
+    except Exception as e:
+        logger.error(f"Ошибка ответа на инлайн-запрос адреса: {e}")
+
 def process_comment(message):
     user_id = message.from_user.id
     comment = message.text
@@ -786,14 +936,20 @@ def confirm_order_callback(call):
     client_order_number = client_orders_count + 1
     
     cursor.execute(
-        '''INSERT INTO orders (client_id, from_address, to_address, comment, status)
-           VALUES (?, ?, ?, ?, ?)''',
-        (user['id'], order_data['from_address'], order_data['to_address'], order_data.get('comment'), 'NEW')
+        '''INSERT INTO orders (client_id, from_address, to_address, comment, status, from_lat, from_lon)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        (user['id'], order_data['from_address'], order_data['to_address'], order_data.get('comment'), 'NEW',
+         order_data.get('from_lat'), order_data.get('from_lon'))
     )
+    order_id = cursor.lastrowid
+    events.log_order_event(cursor, order_id, events.EVENT_CREATED, new_status='NEW', actor_id=user_id)
     
     conn.commit()
-    order_id = cursor.lastrowid
     conn.close()
+    statistics.cache.invalidate()
+    # Адрес из геопозиции (координаты текстом) в подсказки не попадает
+    addresses.index.add(None if order_data.get('from_lat') is not None else order_data['from_address'], order_data['to_address'])
+    routes.cache.record(user_id, order_data['from_address'], order_data['to_address'], None, order_data.get('from_lat'), order_data.get('from_lon'))
     
     # Уведомляем пользователя
     bot.edit_message_text(
@@ -827,7 +983,8 @@ def confirm_order_callback(call):
     send_to_admins(
         admin_text,
         parse_mode="HTML",
-        reply_markup=markup
+        reply_markup=markup,
+        category='new_order'
     )
     
     # Очищаем временные данные
@@ -881,73 +1038,37 @@ def active_orders(message):
         bot.send_message(message.chat.id, "Доступ запрещен.")
         return
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT o.*, u.first_name, u.last_name, u.username
-        FROM orders o
-        JOIN users u ON o.client_id = u.id
-        WHERE o.status IN ('NEW', 'PRICE_OFFERED', 'COUNTER_OFFERED', 'ACCEPTED', 'IN_PROGRESS', 'ARRIVED')
-        ORDER BY o.created_at DESC
-    ''')
-    
-    orders = cursor.fetchall()
+    orders = repository.get_active_board(conn)
+    current_supply = supply.current(conn)
     conn.close()
     
     if not orders:
         bot.send_message(
             message.chat.id,
-            "Активных заказов нет.",
+            "Активных заказов нет.\n\n" + templates.supply_text(current_supply),
             reply_markup=get_admin_keyboard()
         )
         return
     
-    for order in orders:
-        # Получаем номер заказа для клиента
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order['id']))
-        client_order_number = cursor.fetchone()[0]
-        conn.close()
-        
-        order_text = f"🚕 <b>Заказ #{client_order_number}</b> (ID: {order['id']})\n\n"
-        order_text += f"👤 <b>Клиент:</b> {order['first_name']} {order['last_name'] or ''}\n"
-        order_text += f"📍 <b>Откуда:</b> {order['from_address']}\n"
-        order_text += f"🏁 <b>Куда:</b> {order['to_address']}\n"
-        
-        if order['comment']:
-            order_text += f"💬 <b>Комментарий:</b> {order['comment']}\n"
-        
-        if order['price']:
-            order_text += f"💰 <b>Цена:</b> {order['price']} руб.\n"
-        
-        # Добавляем запланированное время для админа
-        if order['scheduled_at']:
-            try:
-                scheduled_time = datetime.datetime.fromisoformat(order['scheduled_at']).strftime('%d.%m %H:%M')
-                order_text += f"🕐 <b>Запланированное время:</b> {scheduled_time}\n"
-            except:
-                pass
-        
-        status_map = {
-            "NEW": "Новый",
-            "PRICE_OFFERED": "Предложена цена", 
-            "ACCEPTED": "Принят",
-            "IN_PROGRESS": "Выполняется"
-        }
-        order_text += f"📊 <b>Статус:</b> {status_map.get(order['status'], order['status'])}\n"
-        
+    bot.send_message(message.chat.id, templates.supply_text(current_supply), reply_markup=get_admin_keyboard())
+    
+    order_texts = templates.render_cards(
+        templates.ADMIN_ACTIVE_CARD, orders,
+        {order.id: order.client_order_number for order in orders}
+    )
+    
+    for order, order_text in zip(orders, order_texts):
         # Добавляем кнопки действий
         markup = telebot.types.InlineKeyboardMarkup()
         
-        if order['status'] == 'NEW':
-            markup.add(telebot.types.InlineKeyboardButton("💰 Установить цену", callback_data=f"set_price:{order['id']}"))
-        elif order['status'] == 'ACCEPTED':
-            markup.add(telebot.types.InlineKeyboardButton("🚕 Назначить водителя", callback_data=f"assign_driver:{order['id']}"))
+        if order.status == 'NEW':
+            markup.add(telebot.types.InlineKeyboardButton("💰 Установить цену", callback_data=f"set_price:{order.id}"))
+        elif order.status == 'ACCEPTED':
+            markup.add(telebot.types.InlineKeyboardButton("🚕 Назначить водителя", callback_data=f"assign_driver:{order.id}"))
         
         # Кнопка: назначить следующий заказ текущему водителю (если уже назначен)
-        if order['driver_id']:
-            markup.add(telebot.types.InlineKeyboardButton("🚕 Назначить следующий заказ", callback_data=f"assign_next:{order['id']}"))
+        if order.driver_id:
+            markup.add(telebot.types.InlineKeyboardButton("🚕 Назначить следующий заказ", callback_data=f"assign_next:{order.id}"))
         
         bot.send_message(
             message.chat.id,
@@ -956,41 +1077,122 @@ def active_orders(message):
             reply_markup=markup
         )
 
-@bot.message_handler(func=lambda message: message.text == "📈 Статистика" and is_admin(message.from_user.id))
-def show_statistics(message):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@bot.message_handler(commands=['demand'])
+@bot.message_handler(func=lambda message: message.text == "📉 Аналитика спроса")
+def show_demand(message):
+    """Спрос по дням недели, часам и направлениям (только для администраторов)"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
     
-    # Общее количество заказов
-    cursor.execute('SELECT COUNT(*) FROM orders')
-    total_orders = cursor.fetchone()[0]
+    conn = get_db_connection()
+    try:
+        # NumPy загружается только при первом запросе отчета
+        from app.utils import analytics
+        text = templates.demand_text(analytics.demand_report(conn))
+    except Exception as e:
+        logger.error(f"Ошибка при построении отчета о спросе: {e}")
+        text = "❌ Не удалось построить отчет о спросе."
+    finally:
+        conn.close()
     
-    # Завершенные заказы
-    cursor.execute('SELECT COUNT(*) FROM orders WHERE status = "COMPLETED"')
-    completed_orders = cursor.fetchone()[0]
+    bot.send_message(message.chat.id, text, parse_mode="HTML", reply_markup=get_admin_keyboard())
+
+@bot.message_handler(commands=['utilization'])
+@bot.message_handler(func=lambda message: message.text == "⏱ Загрузка водителей")
+def show_utilization(message):
+    """Время водителей на линии, на заказах и в ожидании (только для администраторов)"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
     
-    # Активные заказы
-    cursor.execute('SELECT COUNT(*) FROM orders WHERE status IN ("NEW", "PRICE_OFFERED", "COUNTER_OFFERED", "ACCEPTED", "IN_PROGRESS", "ARRIVED")')
-    active_orders = cursor.fetchone()[0]
+    conn = get_db_connection()
+    try:
+        # Отчет читает суточные итоги; новые закрытые интервалы переносятся в них здесь же
+        text = templates.utilization_text(utilization.utilization_report(conn))
+    except Exception as e:
+        logger.error(f"Ошибка при построении отчета о загрузке водителей: {e}")
+        text = "❌ Не удалось построить отчет о загрузке водителей."
+    finally:
+        conn.close()
     
-    # Количество клиентов
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_clients = cursor.fetchone()[0]
+    bot.send_message(message.chat.id, text, parse_mode="HTML", reply_markup=get_admin_keyboard())
+
+# Подписи политик уведомлений
+NOTIFY_POLICY_TEXT = {'immediate': "🔔 сразу", 'digest': "📦 сводкой", 'off': "🔕 выкл."}
+
+def next_notify_policy(category, policy):
+    """Следующая политика по кнопке: сразу → сводкой → выкл. (для категорий с кнопками - без сводки)"""
+    policies = allowed_policies(category)
+    return policies[(policies.index(policy) + 1) % len(policies)]
+
+def get_notify_settings_keyboard(admin_id):
+    markup = telebot.types.InlineKeyboardMarkup()
+    for category, policy in notifier.policies(admin_id).items():
+        markup.add(telebot.types.InlineKeyboardButton(
+            f"{CATEGORIES[category]}: {NOTIFY_POLICY_TEXT[policy]}", callback_data=f"notify_policy:{category}"
+        ))
+    return markup
+
+def notify_settings_text(admin_id):
+    text = "🔔 <b>Уведомления</b>\n\n"
+    text += f"Сводка приходит раз в {notifier.interval // 60} мин одним сообщением, "
+    text += "повторные события (например, переключения статуса одного водителя) в ней склеиваются.\n"
+    pending = notifier.pending_count(admin_id)
+    if pending:
+        text += f"В следующей сводке: {pending}\n"
+    actions = ", ".join(CATEGORIES[category].lower() for category in ACTION_CATEGORIES)
+    text += f"\nНажмите на категорию, чтобы переключить: сразу → сводкой → выкл.\n"
+    return text + f"{actions.capitalize()} приходят с кнопками, поэтому только сразу или выкл."
+
+@bot.message_handler(commands=['notify'])
+@bot.message_handler(func=lambda message: message.text == "🔔 Уведомления")
+def notify_settings(message):
+    """Политики уведомлений администратора по категориям"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
     
-    # Количество водителей
-    cursor.execute('SELECT COUNT(*) FROM drivers WHERE is_approved = 1')
-    total_drivers = cursor.fetchone()[0]
+    bot.send_message(
+        message.chat.id,
+        notify_settings_text(message.from_user.id),
+        parse_mode="HTML",
+        reply_markup=get_notify_settings_keyboard(message.from_user.id)
+    )
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("notify_policy:") and is_admin(call.from_user.id))
+def notify_policy_callback(call):
+    category = call.data.split(":", 1)[1]
+    if category not in CATEGORIES:
+        bot.answer_callback_query(call.id, "Ошибка обработки")
+        return
     
-    conn.close()
+    admin_id = call.from_user.id
+    policy = next_notify_policy(category, notifier.policy(admin_id, category))
+    try:
+        notifier.set_policy(admin_id, category, policy)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения настроек уведомлений: {e}")
+        bot.answer_callback_query(call.id, "❌ Не удалось сохранить настройку")
+        return
     
-    stats_text = f"📊 <b>Статистика</b>\n\n"
-    stats_text += f"<b>Заказы:</b>\n"
-    stats_text += f"Всего заказов: {total_orders}\n"
-    stats_text += f"Завершенных: {completed_orders}\n" 
-    stats_text += f"Активных: {active_orders}\n\n"
-    stats_text += f"<b>Пользователи:</b>\n"
-    stats_text += f"Клиентов: {total_clients}\n"
-    stats_text += f"Водителей: {total_drivers}\n"
+    bot.answer_callback_query(call.id, f"{CATEGORIES[category]}: {NOTIFY_POLICY_TEXT[policy]}")
+    bot.edit_message_text(
+        notify_settings_text(admin_id),
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="HTML",
+        reply_markup=get_notify_settings_keyboard(admin_id)
+    )
+
+@bot.message_handler(func=lambda message: message.text == "📈 Статистика" and is_admin(message.from_user.id))
+def show_statistics(message):
+    # Снимок считается одним проходом по таблицам и кэшируется на несколько секунд
+    try:
+        stats_text = templates.statistics_text(statistics.get_statistics())
+    except Exception as e:
+        logger.error(f"Ошибка при сборе статистики: {e}")
+        stats_text = "❌ Не удалось собрать статистику."
     
     bot.send_message(
         message.chat.id,
@@ -1041,6 +1243,8 @@ def order_history(message):
     ''')
     
     orders = cursor.fetchall()
+    # Номера заказов у клиентов - одним запросом
+    client_order_numbers = repository.get_client_order_numbers(conn, [order['id'] for order in orders])
     conn.close()
     
     if not orders:
@@ -1051,28 +1255,7 @@ def order_history(message):
         )
         return
     
-    for order in orders:
-        # Получаем номер заказа для клиента
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order['id']))
-        client_order_number = cursor.fetchone()[0]
-        conn.close()
-        
-        order_text = f"📋 <b>Заказ #{client_order_number}</b> (ID: {order['id']})\n\n"
-        order_text += f"👤 <b>Клиент:</b> {order['first_name']} {order['last_name'] or ''}\n"
-        order_text += f"📍 <b>Откуда:</b> {order['from_address']}\n"
-        order_text += f"🏁 <b>Куда:</b> {order['to_address']}\n"
-        
-        if order['price']:
-            order_text += f"💰 <b>Цена:</b> {order['price']} руб.\n"
-        
-        status_map = {
-            "COMPLETED": "Завершен",
-            "CANCELLED": "Отменен"
-        }
-        order_text += f"📊 <b>Статус:</b> {status_map.get(order['status'], order['status'])}\n"
-        
+    for order_text in templates.render_cards(templates.ADMIN_HISTORY_CARD, orders, client_order_numbers):
         bot.send_message(
             message.chat.id,
             order_text,
@@ -1096,9 +1279,15 @@ def set_price_callback(call):
         reply_markup=None
     )
     
+    # Подсказка по текущему спросу: счетчики ведет база, это одно чтение
+    conn = get_db_connection()
+    current_supply = supply.current(conn)
+    conn.close()
+    
     bot.send_message(
         call.message.chat.id,
-        f"Введите цену для заказа ID {order_id} (только число в рублях):"
+        templates.supply_text(current_supply) +
+        f"\nВведите цену для заказа ID {order_id} (только число в рублях):"
     )
     
     bot.register_next_step_handler(call.message, lambda m: process_price_input(m, order_id))
@@ -1114,13 +1303,10 @@ def process_price_input(message, order_id):
             )
             return
         
-        # Обновляем заказ
+        # Получаем данные заказа и клиента
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('UPDATE orders SET price = ?, status = ? WHERE id = ?', (price, 'PRICE_OFFERED', order_id))
-        
-        # Получаем данные заказа и клиента
         cursor.execute('''
             SELECT o.*, u.user_id, u.first_name
             FROM orders o
@@ -1129,13 +1315,19 @@ def process_price_input(message, order_id):
         ''', (order_id,))
         
         order = cursor.fetchone()
-        conn.commit()
-        conn.close()
         
         if not order:
+            conn.close()
             bot.send_message(message.chat.id, "Ошибка: заказ не найден")
             return
         
+        # Обновляем заказ
+        cursor.execute('UPDATE orders SET price = ?, status = ? WHERE id = ?', (price, 'PRICE_OFFERED', order_id))
+        events.log_order_event(cursor, order_id, events.EVENT_PRICE_OFFERED, order['status'], 'PRICE_OFFERED', message.from_user.id, price=price)
+        conn.commit()
+        conn.close()
+        statistics.cache.invalidate()
+        
         # Получаем номер заказа для клиента
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -1151,32 +1343,179 @@ def process_price_input(message, order_id):
         )
         
         # Уведомляем клиента
-        client_text = f"💰 <b>Предложена цена за поездку</b>\n\n"
-        client_text += f"Заказ #{client_order_number}\n"
-        client_text += f"Цена: {price} руб.\n\n"
-        client_text += "Выберите действие:"
+        offer = price_offer_notification(order['user_id'], order_id, client_order_number, price)
+        bot.send_message(offer.chat_id, offer.text, **offer.kwargs)
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.add(
-            telebot.types.InlineKeyboardButton("✅ Согласен", callback_data=f"accept_price:{order_id}"),
-            telebot.types.InlineKeyboardButton("❌ Не согласен", callback_data=f"decline_price:{order_id}")
+    except ValueError:
+        bot.send_message(
+            message.chat.id,
+            "Ошибка: введите корректное число."
         )
-        markup.add(telebot.types.InlineKeyboardButton("💰 Предложить свою цену", callback_data=f"counter_offer:{order_id}"))
-        
+
+def price_offer_notification(client_user_id, order_id, client_order_number, price):
+    """Предложение цены клиенту с кнопками ответа"""
+    client_text = f"💰 <b>Предложена цена за поездку</b>\n\n"
+    client_text += f"Заказ #{client_order_number}\n"
+    client_text += f"Цена: {price} руб.\n\n"
+    client_text += "Выберите действие:"
+    return Notification(
+        client_user_id,
+        client_text,
+        {'parse_mode': "HTML", 'reply_markup': get_price_response_keyboard(order_id)}
+    )
+
+# Цены пачкой: "12:800 15:1200" - ID заказа и цена через двоеточие
+PRICE_PAIR_RE = re.compile(r'^(\d+):(\d+(?:\.\d+)?)$')
+
+def parse_price_batch(text):
+    """{ID заказа: цена} и нераспознанные фрагменты (повтор ID - тоже ошибка)"""
+    prices = {}
+    errors = []
+    # "12 : 800" и "12=800" приводим к "12:800"; пары разделяются пробелами, запятыми или ;
+    text = re.sub(r'\s*[:=]\s*', ':', (text or '').strip())
+    for token in re.split(r'[\s,;]+', text):
+        if not token:
+            continue
+        match = PRICE_PAIR_RE.match(token)
+        if match is None or float(match.group(2)) <= 0:
+            errors.append(token)
+            continue
+        order_id = int(match.group(1))
+        if order_id in prices:
+            errors.append(f"{token} (ID {order_id} указан дважды)")
+            continue
+        prices[order_id] = float(match.group(2))
+    return prices, errors
+
+@bot.message_handler(commands=['prices'])
+@bot.message_handler(func=lambda message: message.text == "💰 Цены пачкой")
+def show_price_batch(message):
+    """Все новые заказы одним списком; цены вводятся одним сообщением"""
+    if not is_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "Доступ запрещен.")
+        return
+    
+    conn = get_db_connection()
+    orders = repository.get_active_board(conn, statuses=('NEW',))
+    current_supply = supply.current(conn)
+    conn.close()
+    
+    if not orders:
         bot.send_message(
-            order['user_id'],
-            client_text,
-            parse_mode="HTML",
-            reply_markup=markup
+            message.chat.id,
+            "Новых заказов без цены нет.\n\n" + templates.supply_text(current_supply),
+            reply_markup=get_admin_keyboard()
         )
-        
-    except ValueError:
+        return
+    
+    # Старые заказы первыми: их клиенты ждут дольше
+    orders.sort(key=lambda order: order.id)
+    cards = templates.render_cards(
+        templates.PRICE_BATCH_CARD, orders,
+        {order.id: order.client_order_number for order in orders}
+    )
+    for page in templates.price_batch_pages(cards):
+        bot.send_message(message.chat.id, page, parse_mode="HTML")
+    
+    bot.send_message(
+        message.chat.id,
+        templates.supply_text(current_supply) +
+        "\nОтправьте цены одним сообщением: ID заказа и цена через двоеточие, "
+        "например <code>12:800 15:1200</code>.\nДля отмены отправьте «Отмена».",
+        parse_mode="HTML"
+    )
+    bot.register_next_step_handler(message, process_price_batch)
+
+def process_price_batch(message):
+    text = (message.text or '').strip()
+    if text.lower() == 'отмена' or text.startswith('/') or text == "🔙 Главное меню":
+        bot.send_message(message.chat.id, "Назначение цен отменено.", reply_markup=get_admin_keyboard())
+        return
+    
+    prices, errors = parse_price_batch(text)
+    if errors or not prices:
+        bad = ", ".join(html.escape(token) for token in errors[:10])
         bot.send_message(
             message.chat.id,
-            "Ошибка: введите корректное число."
+            (f"Не удалось разобрать: <code>{bad}</code>\n" if bad else "") +
+            "Ни одна цена не назначена. Отправьте цены еще раз (например <code>12:800 15:1200</code>) или «Отмена».",
+            parse_mode="HTML"
+        )
+        bot.register_next_step_handler(message, process_price_batch)
+        return
+    
+    # Все цены - одной транзакцией; заказ, который уже не новый (цену назначили
+    # параллельно или клиент отменил), пропускается
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        applied = []
+        for order_id, price in prices.items():
+            cursor.execute(
+                'UPDATE orders SET price = ?, status = ? WHERE id = ? AND status = ?',
+                (price, 'PRICE_OFFERED', order_id, 'NEW')
+            )
+            if cursor.rowcount:
+                applied.append(order_id)
+        events.log_order_events(cursor, [
+            (order_id, events.EVENT_PRICE_OFFERED, 'NEW', 'PRICE_OFFERED', message.from_user.id,
+             {'price': prices[order_id], 'batch': True})
+            for order_id in applied
+        ])
+        conn.commit()
+        statistics.cache.invalidate()
+        recipients = repository.get_price_offer_recipients(conn, applied)
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка назначения цен пачкой: {e}")
+        bot.send_message(message.chat.id, "❌ Не удалось назначить цены.", reply_markup=get_admin_keyboard())
+        return
+    finally:
+        conn.close()
+    
+    skipped = [order_id for order_id in prices if order_id not in applied]
+    lines = [
+        f"#{row['client_order_number']} (ID: {row['id']}) - {row['price']} руб."
+        for row in recipients
+    ]
+    header = f"✅ Цены установлены для заказов: <b>{len(applied)}</b>\n" + "\n".join(lines) + "\n"
+    if skipped:
+        header += "\nПропущены (заказ не найден или уже не новый): " + ", ".join(f"ID {order_id}" for order_id in skipped) + "\n"
+    
+    if not recipients:
+        bot.send_message(message.chat.id, header, parse_mode="HTML", reply_markup=get_admin_keyboard())
+        return
+    
+    notifications = [
+        price_offer_notification(row['client_user_id'], row['id'], row['client_order_number'], row['price'])
+        for row in recipients
+    ]
+    chat_id = message.chat.id
+    progress = bot.send_message(chat_id, header + "\n⏳ Отправляем предложения клиентам...", parse_mode="HTML")
+    
+    def finish(result):
+        failed_text = f"\nНе доставлено: <b>{result.failed}</b>" if result.failed else ""
+        bot.edit_message_text(
+            header + f"\nКлиентам отправлено предложений: <b>{result.sent}</b>{failed_text}",
+            chat_id=chat_id,
+            message_id=progress.message_id,
+            parse_mode="HTML"
         )
+        bot.send_message(chat_id, "Готово! Можете продолжить работу.", reply_markup=get_admin_keyboard())
+    
+    # Предложения уходят параллельно из пула рассылки, обработчик сразу освобождается
+    broadcaster.send_in_background(notifications, on_done=finish)
 
 # Обработчики ответов клиента на цену
+# Статусы, в которых цена по заказу уже принята
+PRICE_ACCEPTED_STATUSES = ('ACCEPTED', 'IN_PROGRESS', 'ARRIVED', 'COMPLETED')
+
+def price_answer_rejected_text(status):
+    """Ответ на кнопку принять/отклонить, когда заказ уже не ждет ответа на цену"""
+    if status in PRICE_ACCEPTED_STATUSES:
+        return "Цена по этому заказу уже принята"
+    return "Заказ больше не доступен"
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("accept_price:"))
 def accept_price_callback(call):
     parts = call.data.split(":")
@@ -1190,7 +1529,7 @@ def accept_price_callback(call):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT price, scheduled_at FROM orders WHERE id = ?', (order_id,))
+    cursor.execute('SELECT price, scheduled_at, status FROM orders WHERE id = ?', (order_id,))
     order = cursor.fetchone()
     
     if not order:
@@ -1198,7 +1537,13 @@ def accept_price_callback(call):
         conn.close()
         return
     
-    cursor.execute('UPDATE orders SET status = ? WHERE id = ?', ('ACCEPTED', order_id))
+    # Условное обновление: повторное принятие не откатывает статус заказа
+    cursor.execute('UPDATE orders SET status = ? WHERE id = ? AND status = ?', ('ACCEPTED', order_id, 'PRICE_OFFERED'))
+    if cursor.rowcount == 0:
+        bot.answer_callback_query(call.id, price_answer_rejected_text(order['status']))
+        conn.close()
+        return
+    events.log_order_event(cursor, order_id, events.EVENT_ACCEPTED, order['status'], 'ACCEPTED', call.from_user.id, price=order['price'])
     conn.commit()
     conn.close()
     
@@ -1247,7 +1592,7 @@ def accept_price_callback(call):
     )
     admin_markup = telebot.types.InlineKeyboardMarkup()
     admin_markup.add(telebot.types.InlineKeyboardButton("🚕 Назначить водителя", callback_data=f"assign_driver:{order_id}"))
-    send_to_admins(admin_text, reply_markup=admin_markup)
+    send_to_admins(admin_text, reply_markup=admin_markup, category='price_response')
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("decline_price:"))
 def decline_price_callback(call):
@@ -1262,7 +1607,7 @@ def decline_price_callback(call):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT price, client_id FROM orders WHERE id = ?', (order_id,))
+    cursor.execute('SELECT price, client_id, status FROM orders WHERE id = ?', (order_id,))
     order = cursor.fetchone()
     
     if not order:
@@ -1270,8 +1615,18 @@ def decline_price_callback(call):
         conn.close()
         return
     
-    cursor.execute('UPDATE orders SET status = ? WHERE id = ?', ('DECLINED', order_id))
+    # Условное обновление: принятый или назначенный заказ отклонить уже нельзя
+    cursor.execute(
+        'UPDATE orders SET status = ? WHERE id = ? AND status IN (?, ?)',
+        ('DECLINED', order_id, 'PRICE_OFFERED', 'COUNTER_OFFERED')
+    )
+    if cursor.rowcount == 0:
+        bot.answer_callback_query(call.id, price_answer_rejected_text(order['status']))
+        conn.close()
+        return
+    events.log_order_event(cursor, order_id, events.EVENT_DECLINED, order['status'], 'DECLINED', call.from_user.id, price=order['price'])
     conn.commit()
+    eta.stop(order_id)
     
     # Получаем номер заказа для клиента
     cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order_id))
@@ -1297,7 +1652,8 @@ def decline_price_callback(call):
     
     # Уведомляем админа
     send_to_admins(
-        f"❌ Клиент отклонил цену {order['price']} руб. за заказ #{client_order_number} (ID: {order_id})."
+        f"❌ Клиент отклонил цену {order['price']} руб. за заказ #{client_order_number} (ID: {order_id}).",
+        category='price_response'
     )
 
 # Обработчик назначения водителя
@@ -1310,11 +1666,18 @@ def assign_driver_callback(call):
     
     order_id = int(parts[1])
     
-    # Получаем список всех одобренных водителей (любой статус)
+    # Получаем список всех одобренных водителей (любой статус) с числом активных заказов
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM drivers WHERE is_approved = 1')
-    drivers = cursor.fetchall()
+    drivers = repository.get_drivers_with_stats(conn, approved=True)
+    pickup = conn.execute('SELECT from_lat, from_lon FROM orders WHERE id = ?', (order_id,)).fetchone()
+    conn.close()
+    
+    # Если известна геопозиция точки А - ближайшие водители сверху
+    distances = {}
+    if pickup and pickup['from_lat'] is not None and drivers:
+        nearest = locations.nearest(pickup['from_lat'], pickup['from_lon'], k=len(drivers))
+        distances = {fix.driver_id: distance for distance, fix in nearest}
+        drivers.sort(key=lambda driver: distances.get(driver.id, math.inf))
     
     if not drivers:
         bot.answer_callback_query(call.id, "Нет доступных водителей")
@@ -1322,7 +1685,6 @@ def assign_driver_callback(call):
             call.message.chat.id,
             "В данный момент нет доступных водителей на линии."
         )
-        conn.close()
         return
     
     # Удаляем кнопки из предыдущего сообщения
@@ -1335,23 +1697,43 @@ def assign_driver_callback(call):
     # Создаем клавиатуру с водителями
     markup = telebot.types.InlineKeyboardMarkup()
     for driver in drivers:
-        # Подсчитываем активные заказы водителя
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE driver_id = ? AND status IN ("IN_PROGRESS", "ACCEPTED")', (driver['id'],))
-        active_orders_count = cursor.fetchone()[0]
+        active_orders_count = driver.active_orders
         
         if active_orders_count > 0:
-            button_text = f"{driver['first_name']} - {driver['car_number']} ({active_orders_count} заказ{'а' if active_orders_count > 1 else ''})"
+            button_text = f"{driver.first_name} - {driver.car_number} ({active_orders_count} заказ{'а' if active_orders_count > 1 else ''})"
         else:
-            button_text = f"{driver['first_name']} - {driver['car_number']}"
-        markup.add(telebot.types.InlineKeyboardButton(button_text, callback_data=f"select_driver:{order_id}:{driver['id']}"))
+            button_text = f"{driver.first_name} - {driver.car_number}"
+        if driver.id in distances:
+            button_text += f" · {distances[driver.id]:.1f} км"
+        markup.add(telebot.types.InlineKeyboardButton(button_text, callback_data=f"select_driver:{order_id}:{driver.id}"))
     
     bot.send_message(
         call.message.chat.id,
         f"Выберите водителя для заказа ID {order_id}:",
         reply_markup=markup
     )
+
+# Геопозиция водителя: разовая точка или начало трансляции
+@bot.message_handler(content_types=['location'], func=lambda message: locations.driver_id_for(message.from_user.id) is not None)
+def driver_location(message):
+    driver_id = locations.driver_id_for(message.from_user.id)
+    location = message.location
+    locations.update(driver_id, location.latitude, location.longitude, live_period=location.live_period)
     
-    conn.close()
+    if location.live_period:
+        text = "📡 Трансляция геопозиции включена. Диспетчер будет предлагать вам ближайшие заказы."
+    else:
+        text = ("📍 Геопозиция получена.\n\n"
+                "Чтобы она обновлялась автоматически, включите трансляцию: 📎 → Геопозиция → Транслировать геопозицию.")
+    bot.send_message(message.chat.id, text, reply_markup=get_driver_keyboard())
+
+# Обновления трансляции приходят каждые несколько секунд - только память, без ответа
+@bot.edited_message_handler(content_types=['location'])
+def driver_location_update(message):
+    driver_id = locations.driver_id_for(message.from_user.id)
+    if driver_id is None:
+        return
+    locations.update(driver_id, message.location.latitude, message.location.longitude)
 
 # Кнопка водителя: На месте
 @bot.message_handler(func=lambda message: message.text == "📍 На месте" and get_driver_by_id(message.from_user.id))
@@ -1377,12 +1759,14 @@ def driver_arrived(message):
     
     # Обновляем статус водителя
     cursor.execute('UPDATE drivers SET status = ? WHERE id = ?', ('ARRIVED', driver['id']))
+    events.log_order_event(cursor, order['id'], events.EVENT_ARRIVED, actor_id=user_id, driver_id=driver['id'])
     conn.commit()
     
     # Уведомляем клиента
     cursor.execute('SELECT user_id FROM users WHERE id = ?', (order['client_id'],))
     client = cursor.fetchone()
     conn.close()
+    eta.stop(order['id'], "🚗 Водитель на месте.")
     if client:
         try:
             bot.send_message(client['user_id'], "🚗 Ваш водитель прибыл на место (точка А). Подходите, пожалуйста.")
@@ -1391,6 +1775,14 @@ def driver_arrived(message):
     
     bot.send_message(message.chat.id, "Статус обновлен: На месте.")
 
+def send_driver_assigned(client_user_id, order, driver, client_order_number):
+    """Сообщение клиенту о назначенном водителе; время подачи обновляется по геопозиции водителя"""
+    header = f"🚕 <b>Вам назначен водитель</b>\n\n"
+    header += f"Заказ #{client_order_number}\n"
+    header += f"Водитель: {driver['first_name']}\n"
+    header += f"Автомобиль: {driver['car_number']}\n\n"
+    eta.start(order['id'], client_user_id, driver['id'], header, pickup=(order['from_lat'], order['from_lon']))
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("select_driver:") and is_admin(call.from_user.id))
 def select_driver_callback(call):
     parts = call.data.split(":")
@@ -1416,6 +1808,7 @@ def select_driver_callback(call):
     
     # Обновляем заказ
     cursor.execute('UPDATE orders SET driver_id = ?, status = ? WHERE id = ?', (driver_id, 'IN_PROGRESS', order_id))
+    events.log_order_event(cursor, order_id, events.EVENT_ASSIGNED, order['status'], 'IN_PROGRESS', call.from_user.id, driver_id=driver_id)
     
     # Обновляем статус водителя на "На заказе" если он был "На линии" или "Дома"
     if driver['status'] in ('ON_DUTY', 'OFF_DUTY'):
@@ -1450,17 +1843,7 @@ def select_driver_callback(call):
     
     # Уведомляем клиента
     if client_user_id:
-        client_text = f"🚕 <b>Вам назначен водитель</b>\n\n"
-        client_text += f"Заказ #{client_order_number}\n"
-        client_text += f"Водитель: {driver['first_name']}\n"
-        client_text += f"Автомобиль: {driver['car_number']}\n\n"
-        client_text += "Водитель скоро прибудет на место посадки."
-        
-        bot.send_message(
-            client_user_id,
-            client_text,
-            parse_mode="HTML"
-        )
+        send_driver_assigned(client_user_id, order, driver, client_order_number)
     
     # Уведомляем водителя
     driver_text = f"🆕 <b>Вам назначен новый заказ</b>\n\n"
@@ -1581,6 +1964,7 @@ def assign_to_driver_callback(call):
 
     # Обновляем заказ и статус водителя
     cursor.execute('UPDATE orders SET driver_id = ?, status = ? WHERE id = ?', (driver_id, 'IN_PROGRESS', order_id))
+    events.log_order_event(cursor, order_id, events.EVENT_ASSIGNED, order['status'], 'IN_PROGRESS', call.from_user.id, driver_id=driver_id)
     if driver['status'] == 'ON_DUTY':
         cursor.execute('UPDATE drivers SET status = ? WHERE id = ?', ('ON_ORDER', driver_id))
 
@@ -1609,12 +1993,7 @@ def assign_to_driver_callback(call):
 
     # Уведомление клиента
     if client_user_id:
-        client_text = f"🚕 <b>Вам назначен водитель</b>\n\n"
-        client_text += f"Заказ #{client_order_number}\n"
-        client_text += f"Водитель: {driver['first_name']}\n"
-        client_text += f"Автомобиль: {driver['car_number']}\n\n"
-        client_text += "Водитель скоро прибудет на место посадки."
-        bot.send_message(client_user_id, client_text, parse_mode="HTML")
+        send_driver_assigned(client_user_id, order, driver, client_order_number)
 
     # Уведомление водителя
     driver_text = f"🆕 <b>Вам назначен новый заказ</b>\n\n"
@@ -1684,6 +2063,7 @@ def process_counter_offer(message, order_id):
             return
         
         cursor.execute('UPDATE orders SET counter_offer = ? WHERE id = ?', (price, order_id))
+        events.log_order_event(cursor, order_id, events.EVENT_COUNTER_OFFERED, actor_id=message.from_user.id, price=price)
         conn.commit()
         
         # Получаем номер заказа для клиента
@@ -1715,7 +2095,8 @@ def process_counter_offer(message, order_id):
             f"Предложение клиента: {price} руб.\n\n"
             f"Выберите действие:",
             parse_mode="HTML",
-            reply_markup=markup
+            reply_markup=markup,
+            category='price_response'
         )
         
     except ValueError:
@@ -1739,7 +2120,7 @@ def accept_counter_offer_callback(call):
     # Обновляем заказ - устанавливаем цену клиента как окончательную
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT counter_offer, client_id FROM orders WHERE id = ?', (order_id,))
+    cursor.execute('SELECT counter_offer, client_id, status FROM orders WHERE id = ?', (order_id,))
     order = cursor.fetchone()
     
     if not order or not order['counter_offer']:
@@ -1749,7 +2130,9 @@ def accept_counter_offer_callback(call):
     
     # Устанавливаем цену клиента как окончательную и меняем статус на принятый
     cursor.execute('UPDATE orders SET price = ?, status = ? WHERE id = ?', (order['counter_offer'], 'ACCEPTED', order_id))
+    events.log_order_event(cursor, order_id, events.EVENT_ACCEPTED, order['status'], 'ACCEPTED', call.from_user.id, price=order['counter_offer'], counter_offer=True)
     conn.commit()
+    statistics.cache.invalidate()
     
     # Получаем номер заказа для клиента
     cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order_id))
@@ -1801,7 +2184,7 @@ def decline_counter_offer_callback(call):
     # Получаем данные заказа
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT counter_offer, price, client_id FROM orders WHERE id = ?', (order_id,))
+    cursor.execute('SELECT counter_offer, price, client_id, status FROM orders WHERE id = ?', (order_id,))
     order = cursor.fetchone()
     
     if not order:
@@ -1810,8 +2193,18 @@ def decline_counter_offer_callback(call):
         return
     
     # Обновляем статус заказа на отклоненный
-    cursor.execute('UPDATE orders SET status = ? WHERE id = ?', ('DECLINED', order_id))
+    # Условное обновление: принятый или назначенный заказ отклонить уже нельзя
+    cursor.execute(
+        'UPDATE orders SET status = ? WHERE id = ? AND status IN (?, ?)',
+        ('DECLINED', order_id, 'PRICE_OFFERED', 'COUNTER_OFFERED')
+    )
+    if cursor.rowcount == 0:
+        bot.answer_callback_query(call.id, price_answer_rejected_text(order['status']))
+        conn.close()
+        return
+    events.log_order_event(cursor, order_id, events.EVENT_DECLINED, order['status'], 'DECLINED', call.from_user.id, price=order['counter_offer'], counter_offer=True)
     conn.commit()
+    eta.stop(order_id)
     
     # Получаем номер заказа для клиента
     cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order_id))
@@ -1891,7 +2284,7 @@ def process_admin_counter_offer(message, order_id):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT counter_offer, client_id FROM orders WHERE id = ?', (order_id,))
+        cursor.execute('SELECT counter_offer, client_id, status FROM orders WHERE id = ?', (order_id,))
         order = cursor.fetchone()
         
         if not order:
@@ -1901,7 +2294,9 @@ def process_admin_counter_offer(message, order_id):
         
         # Устанавливаем новую цену администратора и возвращаем статус к "предложена цена"
         cursor.execute('UPDATE orders SET price = ?, status = ? WHERE id = ?', (price, 'PRICE_OFFERED', order_id))
+        events.log_order_event(cursor, order_id, events.EVENT_PRICE_OFFERED, order['status'], 'PRICE_OFFERED', message.from_user.id, price=price, counter_offer=True)
         conn.commit()
+        statistics.cache.invalidate()
         
         # Получаем номер заказа для клиента
         cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order_id))
@@ -1931,12 +2326,7 @@ def process_admin_counter_offer(message, order_id):
             client_text += f"Новая цена диспетчера: {price} руб.\n\n"
             client_text += "Выберите действие:"
             
-            markup = telebot.types.InlineKeyboardMarkup()
-            markup.add(
-                telebot.types.InlineKeyboardButton("✅ Согласен", callback_data=f"accept_price:{order_id}"),
-                telebot.types.InlineKeyboardButton("❌ Не согласен", callback_data=f"decline_price:{order_id}")
-            )
-            markup.add(telebot.types.InlineKeyboardButton("💰 Предложить свою цену", callback_data=f"counter_offer:{order_id}"))
+            markup = get_price_response_keyboard(order_id)
             
             bot.send_message(
                 client_user_id,
@@ -2000,19 +2390,16 @@ def confirm_clear_orders_callback(call):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Получаем активные заказы с информацией о клиентах и водителях
-    cursor.execute('''
-        SELECT o.id, o.client_id, o.driver_id, u.user_id as client_user_id, d.user_id as driver_user_id
-        FROM orders o
-        LEFT JOIN users u ON o.client_id = u.id
-        LEFT JOIN drivers d ON o.driver_id = d.id
-        WHERE o.status NOT IN (?, ?)
-    ''', ('COMPLETED', 'CANCELLED'))
+    # Выборка и отмена в одной транзакции с блокировкой записи: заказ, созданный
+    # или завершенный между ними, не отменится без уведомления
+    cursor.execute('BEGIN IMMEDIATE')
     
-    active_orders = cursor.fetchall()
+    # Активные заказы с получателями и номерами заказов у клиентов - одним запросом
+    active_orders = repository.get_cancellation_recipients(conn)
     cleared_count = len(active_orders)
     
     if cleared_count == 0:
+        conn.close()
         bot.edit_message_text(
             "✅ Активных заказов нет.",
             chat_id=call.message.chat.id,
@@ -2020,75 +2407,108 @@ def confirm_clear_orders_callback(call):
         )
         return
     
-    # Отменяем все активные заказы
-    cursor.execute('UPDATE orders SET status = ? WHERE status NOT IN (?, ?)', ('CANCELLED', 'COMPLETED', 'CANCELLED'))
+    # Отменяем только выбранные заказы - тех, кого уведомим
+    cursor.executemany(
+        'UPDATE orders SET status = ? WHERE id = ? AND status NOT IN (?, ?)',
+        [('CANCELLED', order['id'], 'COMPLETED', 'CANCELLED') for order in active_orders]
+    )
+    events.log_order_events(cursor, [
+        (order['id'], events.EVENT_CANCELLED, order['status'], 'CANCELLED', call.from_user.id, {'bulk': True})
+        for order in active_orders
+    ])
     
-    # Освобождаем всех водителей (ставим статус "На линии")
-    cursor.execute('UPDATE drivers SET status = ? WHERE status = ?', ('ON_DUTY', 'ON_ORDER'))
+    # Освобождаем водителей отмененных заказов (ставим статус "На линии");
+    # о смене статуса сообщаем только тем, чей статус действительно изменился
+    released_driver_ids = set()
+    for driver_id in {order['driver_id'] for order in active_orders if order['driver_id']}:
+        cursor.execute(
+            'UPDATE drivers SET status = ? WHERE id = ? AND status IN (?, ?)',
+            ('ON_DUTY', driver_id, 'ON_ORDER', 'ARRIVED')
+        )
+        if cursor.rowcount:
+            released_driver_ids.add(driver_id)
     
     conn.commit()
     conn.close()
+    # Администратор сразу увидит обнуленные активные заказы
+    statistics.cache.invalidate()
+    eta.stop_all([order['id'] for order in active_orders])
     
-    # Уведомляем клиентов об отмене заказов
-    notified_clients = 0
+    # Одно уведомление на получателя: клиенту - все его отмененные номера
+    client_numbers = {}
+    driver_user_ids = {}
     for order in active_orders:
         if order['client_user_id']:
-            try:
-                # Получаем номер заказа для клиента
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order['id']))
-                client_order_number = cursor.fetchone()[0]
-                conn.close()
-                
-                bot.send_message(
-                    order['client_user_id'],
-                    f"❌ <b>Заказ отменен администратором</b>\n\n"
-                    f"Ваш заказ #{client_order_number} был отменен по техническим причинам.\n\n"
-                    f"Приносим извинения за неудобства. Вы можете создать новый заказ.",
-                    parse_mode="HTML",
-                    reply_markup=get_main_keyboard()
-                )
-                notified_clients += 1
-            except Exception as e:
-                logger.error(f"Ошибка уведомления клиента {order['client_user_id']}: {e}")
-    
-    # Уведомляем водителей об освобождении
-    notified_drivers = 0
-    for order in active_orders:
+            client_numbers.setdefault(order['client_user_id'], []).append(order['client_order_number'])
         if order['driver_user_id'] and order['driver_id']:
-            try:
-                bot.send_message(
-                    order['driver_user_id'],
-                    f"ℹ️ <b>Заказ отменен администратором</b>\n\n"
-                    f"Ваш текущий заказ был отменен по техническим причинам.\n"
-                    f"Ваш статус изменен на: <b>🟢 На линии</b>\n\n"
-                    f"Вы можете принимать новые заказы.",
-                    parse_mode="HTML",
-                    reply_markup=get_driver_keyboard()
-                )
-                notified_drivers += 1
-            except Exception as e:
-                logger.error(f"Ошибка уведомления водителя {order['driver_user_id']}: {e}")
-    
-    # Обновляем сообщение администратора
-    bot.edit_message_text(
-        f"✅ <b>Очистка завершена</b>\n\n"
-        f"Отменено заказов: <b>{cleared_count}</b>\n"
-        f"Уведомлено клиентов: <b>{notified_clients}</b>\n"
-        f"Уведомлено водителей: <b>{notified_drivers}</b>\n\n"
-        f"Все водители переведены в статус \"На линии\".",
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
-        parse_mode="HTML"
-    )
+            driver_user_ids[order['driver_user_id']] = order['driver_id'] in released_driver_ids
     
-    # Возвращаем админ-клавиатуру
-    bot.send_message(
-        call.message.chat.id,
-        "Готово! Можете продолжить работу.",
-        reply_markup=get_admin_keyboard()
-    )
+    notifications = []
+    for client_user_id, numbers in client_numbers.items():
+        numbers_text = ", ".join(f"#{number}" for number in sorted(numbers))
+        if len(numbers) == 1:
+            cancelled_text = f"Ваш заказ {numbers_text} был отменен"
+        else:
+            cancelled_text = f"Ваши заказы {numbers_text} были отменены"
+        notifications.append(Notification(
+            client_user_id,
+            f"❌ <b>Заказ отменен администратором</b>\n\n"
+            f"{cancelled_text} по техническим причинам.\n\n"
+            f"Приносим извинения за неудобства. Вы можете создать новый заказ.",
+            {'parse_mode': "HTML", 'reply_markup': get_main_keyboard()}
+        ))
+    for driver_user_id, released in driver_user_ids.items():
+        if released:
+            status_text = "Ваш статус изменен на: <b>🟢 На линии</b>\n\nВы можете принимать новые заказы."
+        else:
+            status_text = "Ваш статус не изменен."
+        notifications.append(Notification(
+            driver_user_id,
+            f"ℹ️ <b>Заказ отменен администратором</b>\n\n"
+            f"Ваш текущий заказ был отменен по техническим причинам.\n"
+            f"{status_text}",
+            {'parse_mode': "HTML", 'reply_markup': get_driver_keyboard()}
+        ))
+    notifications = dedupe_notifications(notifications)
+    notified_clients = len(client_numbers)
+    
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    header = f"Отменено заказов: <b>{cleared_count}</b>\n"
+    
+    def show_progress(result):
+        bot.edit_message_text(
+            f"⏳ <b>Очистка заказов</b>\n\n{header}"
+            f"Отправлено уведомлений: <b>{result.done}/{result.total}</b>",
+            chat_id=chat_id,
+            message_id=message_id,
+            parse_mode="HTML"
+        )
+    
+    def finish(result):
+        failed_text = f"Не доставлено: <b>{result.failed}</b>\n" if result.failed else ""
+        bot.edit_message_text(
+            f"✅ <b>Очистка завершена</b>\n\n{header}"
+            f"Уведомлено клиентов: <b>{notified_clients}</b>\n"
+            f"Уведомлено водителей: <b>{len(driver_user_ids)}</b>\n"
+            f"{failed_text}\n"
+            f"Водителей переведено в статус \"На линии\": <b>{len(released_driver_ids)}</b>",
+            chat_id=chat_id,
+            message_id=message_id,
+            parse_mode="HTML"
+        )
+        
+        # Возвращаем админ-клавиатуру
+        bot.send_message(
+            chat_id,
+            "Готово! Можете продолжить работу.",
+            reply_markup=get_admin_keyboard()
+        )
+    
+    show_progress(BroadcastResult(total=len(notifications)))
+    
+    # Рассылка идет в фоне, обработчик сразу освобождается
+    broadcaster.send_in_background(notifications, on_progress=show_progress, on_done=finish)
 
 @bot.callback_query_handler(func=lambda call: call.data == "cancel_clear_orders" and is_admin(call.from_user.id))
 def cancel_clear_orders_callback(call):
@@ -2130,53 +2550,21 @@ def my_orders(message):
         conn.close()
         return
     
-    for order in orders:
-        # Получаем номер заказа для клиента
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (user['id'], order['id']))
-        client_order_number = cursor.fetchone()[0]
-        
-        order_text = f"🚕 <b>Заказ #{client_order_number}</b>\n\n"
-        order_text += f"📍 <b>Откуда:</b> {order['from_address']}\n"
-        order_text += f"🏁 <b>Куда:</b> {order['to_address']}\n"
-        
-        if order['comment']:
-            order_text += f"💬 <b>Комментарий:</b> {order['comment']}\n"
-        
-        if order['price']:
-            order_text += f"💰 <b>Цена:</b> {order['price']} руб.\n"
-        
-        if order['counter_offer']:
-            order_text += f"💸 <b>Ваше предложение:</b> {order['counter_offer']} руб.\n"
-        
-        # Добавляем запланированное время
-        if order['scheduled_at']:
-            try:
-                scheduled_time = datetime.datetime.fromisoformat(order['scheduled_at']).strftime('%d.%m %H:%M')
-                order_text += f"🕐 <b>Запланированное время:</b> {scheduled_time}\n"
-            except:
-                pass
-        
-        status_map = {
-            "NEW": "Новый",
-            "PRICE_OFFERED": "Предложена цена",
-            "ACCEPTED": "Принят",
-            "DECLINED": "Отклонен",
-            "IN_PROGRESS": "Выполняется",
-            "COMPLETED": "Завершен",
-            "CANCELLED": "Отменен"
-        }
-        order_text += f"📊 <b>Статус:</b> {status_map.get(order['status'], order['status'])}\n"
-        order_text += f"🕒 <b>Создан:</b> {order['created_at']}\n"
-        
+    # Номера заказов и оставленные отзывы - пакетно, а не запросом на заказ
+    order_ids = [order['id'] for order in orders]
+    client_order_numbers = repository.get_client_order_numbers(conn, order_ids)
+    cursor.execute(
+        f'SELECT order_id FROM reviews WHERE order_id IN ({",".join("?" * len(order_ids))})',
+        order_ids
+    )
+    reviewed = {row['order_id'] for row in cursor.fetchall()}
+    order_texts = templates.render_cards(templates.CLIENT_CARD, orders, client_order_numbers)
+    
+    for order, order_text in zip(orders, order_texts):
         # Добавляем кнопку для оценки, если заказ завершен и еще не оценен
         markup = None
-        if order['status'] == "COMPLETED":
-            cursor.execute('SELECT * FROM reviews WHERE order_id = ?', (order['id'],))
-            review = cursor.fetchone()
-            if not review:
-                markup = telebot.types.InlineKeyboardMarkup()
-                for i in range(1, 6):
-                    markup.add(telebot.types.InlineKeyboardButton(f"⭐ {i}", callback_data=f"rate:{order['id']}:{i}"))
+        if order['status'] == "COMPLETED" and order['id'] not in reviewed:
+            markup = get_rating_keyboard(order['id'])
         
         bot.send_message(
             message.chat.id,
@@ -2229,6 +2617,7 @@ def process_rating(call):
         'INSERT INTO reviews (order_id, client_id, driver_id, rating) VALUES (?, ?, ?, ?)',
         (order_id, user['id'], order['driver_id'], rating)
     )
+    events.log_order_event(cursor, order_id, events.EVENT_RATED, actor_id=user_id, rating=rating)
     conn.commit()
     conn.close()
     
@@ -2616,6 +3005,8 @@ def approve_driver_new_callback(call):
     driver = cursor.fetchone()
     conn.commit()
     conn.close()
+    # До одобрения геопозиции этого пользователя считались клиентскими
+    locations.forget_user(driver_user_id)
     
     if not driver:
         bot.answer_callback_query(call.id, "Ошибка: водитель не найден")
@@ -2664,6 +3055,7 @@ def reject_driver_new_callback(call):
         # Удаляем водителя из БД
         cursor.execute('DELETE FROM drivers WHERE user_id = ?', (driver_user_id,))
         conn.commit()
+        locations.forget_user(driver_user_id)
     else:
         driver_name = "Неизвестный"
     
@@ -2699,11 +3091,12 @@ def list_registered_drivers(message):
         bot.send_message(message.chat.id, "Доступ запрещен.")
         return
     conn = get_db_connection()
-    cursor = conn.cursor()
+    drivers = repository.get_drivers_with_stats(conn)
+    conn.close()
     
-    # Получаем заявки на регистрацию водителей
-    cursor.execute('SELECT * FROM drivers WHERE is_approved = 0')
-    pending_drivers = cursor.fetchall()
+    # Заявки на регистрацию и одобренные водители
+    pending_drivers = [driver for driver in drivers if not driver.is_approved]
+    active_drivers = [driver for driver in drivers if driver.is_approved]
     
     if pending_drivers:
         bot.send_message(
@@ -2713,16 +3106,16 @@ def list_registered_drivers(message):
         )
         
         for driver in pending_drivers:
-            driver_text = f"👤 <b>Имя:</b> {driver['first_name']}\n"
-            driver_text += f"🚗 <b>Госномер:</b> {driver['car_number']}\n"
-            driver_text += f"📄 <b>Водительское удостоверение:</b> {driver['license_number']}\n"
-            driver_text += f"📝 <b>ПТС:</b> {driver['car_registration']}\n"
+            driver_text = f"👤 <b>Имя:</b> {driver.first_name}\n"
+            driver_text += f"🚗 <b>Госномер:</b> {driver.car_number}\n"
+            driver_text += f"📄 <b>Водительское удостоверение:</b> {driver.license_number}\n"
+            driver_text += f"📝 <b>ПТС:</b> {driver.car_registration}\n"
             
             # Кнопки для одобрения/отклонения
             markup = telebot.types.InlineKeyboardMarkup()
             markup.add(
-                telebot.types.InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_driver_new:{driver['user_id']}"),
-                telebot.types.InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_driver_new:{driver['user_id']}")
+                telebot.types.InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_driver_new:{driver.user_id}"),
+                telebot.types.InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_driver_new:{driver.user_id}")
             )
             
             bot.send_message(
@@ -2732,10 +3125,6 @@ def list_registered_drivers(message):
                 reply_markup=markup
             )
     
-    # Получаем всех одобренных водителей
-    cursor.execute('SELECT * FROM drivers WHERE is_approved = 1')
-    active_drivers = cursor.fetchall()
-    
     if active_drivers:
         bot.send_message(
             message.chat.id,
@@ -2744,24 +3133,12 @@ def list_registered_drivers(message):
         )
         
         for driver in active_drivers:
-            # Получаем средний рейтинг водителя
-            cursor.execute('SELECT AVG(rating) FROM reviews WHERE driver_id = ?', (driver['id'],))
-            avg_rating = cursor.fetchone()[0] or 0
-            
-            # Получаем общий заработок водителя
-            cursor.execute('SELECT SUM(amount) FROM earnings WHERE driver_id = ?', (driver['id'],))
-            total_earnings = cursor.fetchone()[0] or 0
-            
-            status_map = {
-                "ON_DUTY": "На линии",
-                "ON_ORDER": "На заказе",
-                "OFF_DUTY": "Дома",
-                "ARRIVED": "На месте"
-            }
+            avg_rating = driver.avg_rating or 0
+            total_earnings = driver.total_earnings
             
-            driver_text = f"👨‍✈️ <b>{driver['first_name']}</b>\n"
-            driver_text += f"🚗 <b>Номер авто:</b> {driver['car_number']}\n"
-            driver_text += f"📊 <b>Статус:</b> {status_map.get(driver['status'], driver['status'])}\n"
+            driver_text = f"👨‍✈️ <b>{driver.first_name}</b>\n"
+            driver_text += f"🚗 <b>Номер авто:</b> {driver.car_number}\n"
+            driver_text += f"📊 <b>Статус:</b> {templates.driver_status_text(driver.status)}\n"
             driver_text += f"⭐ <b>Рейтинг:</b> {avg_rating:.1f}/5.0\n"
             driver_text += f"💰 <b>Общий заработок:</b> {total_earnings} руб.\n"
             
@@ -2777,8 +3154,6 @@ def list_registered_drivers(message):
             "Нет водителей для отображения.",
             reply_markup=get_admin_keyboard()
         )
-    
-    conn.close()
 
 # Обработчик команды /profile
 @bot.message_handler(commands=['profile'])
@@ -2875,13 +3250,6 @@ def driver_command(message):
         reply_markup=get_driver_keyboard()
     )
 
-def get_driver_keyboard():
-    markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(telebot.types.KeyboardButton("🚗 Изменить статус"))
-    markup.add(telebot.types.KeyboardButton("📋 Мои заказы"), telebot.types.KeyboardButton("💰 Мой заработок"))
-    markup.add(telebot.types.KeyboardButton("🔙 Главное меню"))
-    return markup
-
 # Обработчик изменения статуса водителя
 @bot.message_handler(func=lambda message: message.text == "🚗 Изменить статус")
 def change_driver_status(message):
@@ -2899,12 +3267,7 @@ def change_driver_status(message):
         return
     
     # Показываем текущий статус и предлагаем изменить
-    status_map = {
-        "ON_DUTY": "На линии",
-        "ON_ORDER": "На заказе", 
-        "OFF_DUTY": "Дома"
-    }
-    current_status = status_map.get(driver['status'], driver['status'])
+    current_status = templates.driver_status_text(driver['status'])
     
     markup = telebot.types.InlineKeyboardMarkup()
     markup.add(telebot.types.InlineKeyboardButton("🟢 На линии", callback_data="status:ON_DUTY"))
@@ -2945,12 +3308,7 @@ def process_status_change(call):
     conn.close()
     
     # Уведомляем водителя
-    status_map = {
-        "ON_DUTY": "На линии",
-        "ON_ORDER": "На заказе",
-        "OFF_DUTY": "Дома"
-    }
-    new_status_text = status_map.get(status, status)
+    new_status_text = templates.driver_status_text(status)
     
     bot.edit_message_text(
         chat_id=call.message.chat.id,
@@ -2961,15 +3319,19 @@ def process_status_change(call):
     )
     
     # Уведомляем админа
-    old_status_text = status_map.get(old_status, old_status)
+    old_status_text = templates.driver_status_text(old_status)
     admin_text = f"🔄 <b>Изменение статуса водителя</b>\n\n"
     admin_text += f"👤 <b>Водитель:</b> {driver['first_name']}\n"
     admin_text += f"🚗 <b>Госномер:</b> {driver['car_number']}\n"
     admin_text += f"📊 <b>Статус:</b> {old_status_text} ➡️ {new_status_text}"
     
+    # Повторные переключения одного водителя склеиваются в сводке
     send_to_admins(
         admin_text,
-        parse_mode="HTML"
+        parse_mode="HTML",
+        category='driver_status',
+        key=driver['id'],
+        digest_text=f"{html.escape(driver['first_name'])} ({html.escape(driver['car_number'])}): {new_status_text}"
     )
 
 # Обработчик "Мои заказы" для водителей
@@ -3022,41 +3384,10 @@ def driver_orders(message):
         bot.send_message(message.chat.id, header_text, parse_mode="HTML")
     
     # Отправляем информацию о каждом заказе
-    for order in orders:
-        # Получаем номер заказа для клиента
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE client_id = ? AND id <= ?', (order['client_id'], order['id']))
-        client_order_number = cursor.fetchone()[0]
-        
-        order_text = f"🚕 <b>Заказ #{client_order_number}</b> (ID: {order['id']})\n\n"
-        order_text += f"📍 <b>Откуда:</b> {order['from_address']}\n"
-        order_text += f"🏁 <b>Куда:</b> {order['to_address']}\n"
-        
-        if order['comment']:
-            order_text += f"💬 <b>Комментарий:</b> {order['comment']}\n"
-        
-        if order['price']:
-            order_text += f"💰 <b>Цена:</b> {order['price']} руб.\n"
-        
-        # Добавляем запланированное время для водителя
-        if order['scheduled_at']:
-            try:
-                scheduled_time = datetime.datetime.fromisoformat(order['scheduled_at']).strftime('%d.%m %H:%M')
-                order_text += f"🕐 <b>Время подачи:</b> {scheduled_time}\n"
-            except:
-                pass
-        
-        status_map = {
-            "NEW": "Новый",
-            "PRICE_OFFERED": "Предложена цена",
-            "ACCEPTED": "Принят",
-            "DECLINED": "Отклонен",
-            "IN_PROGRESS": "Выполняется",
-            "COMPLETED": "Завершен",
-            "CANCELLED": "Отменен"
-        }
-        order_text += f"📊 <b>Статус:</b> {status_map.get(order['status'], order['status'])}\n"
-        order_text += f"🕒 <b>Создан:</b> {order['created_at']}\n"
-        
+    client_order_numbers = repository.get_client_order_numbers(conn, [order['id'] for order in orders])
+    order_texts = templates.render_cards(templates.DRIVER_CARD, orders, client_order_numbers)
+    
+    for order, order_text in zip(orders, order_texts):
         # Добавляем кнопку завершения заказа, если он в процессе
         markup = None
         if order['status'] == 'IN_PROGRESS':
@@ -3102,8 +3433,13 @@ def complete_order_callback(call):
         conn.close()
         return
     
-    # Обновляем статус заказа
-    cursor.execute('UPDATE orders SET status = ?, completed_at = ? WHERE id = ?', ('COMPLETED', datetime.datetime.now(datetime.timezone.utc).isoformat(), order_id))
+    # Обновляем статус заказа (повторное завершение ничего не меняет)
+    cursor.execute('UPDATE orders SET status = ?, completed_at = ? WHERE id = ? AND status != ?', ('COMPLETED', datetime.datetime.now(datetime.timezone.utc).isoformat(), order_id, 'COMPLETED'))
+    if cursor.rowcount == 0:
+        bot.answer_callback_query(call.id, "Заказ уже завершен")
+        conn.close()
+        return
+    events.log_order_event(cursor, order_id, events.EVENT_COMPLETED, order['status'], 'COMPLETED', user_id, price=order['price'], driver_id=driver['id'])
     
     # Проверяем, есть ли у водителя другие активные заказы
     cursor.execute('SELECT COUNT(*) FROM orders WHERE driver_id = ? AND status IN ("IN_PROGRESS", "ACCEPTED", "ARRIVED") AND id != ?', (driver['id'], order_id))
@@ -3114,9 +3450,12 @@ def complete_order_callback(call):
         cursor.execute('UPDATE drivers SET status = ? WHERE id = ?', ('ON_DUTY', driver['id']))
     
     # Добавляем запись о заработке
-    cursor.execute('INSERT INTO earnings (driver_id, order_id, amount) VALUES (?, ?, ?)', (driver['id'], order_id, order['price']))
+    cursor.execute('INSERT OR IGNORE INTO earnings (driver_id, order_id, amount) VALUES (?, ?, ?)', (driver['id'], order_id, order['price']))
     
     conn.commit()
+    statistics.cache.invalidate()
+    # Если водитель не отметил прибытие - прекращаем обновлять время подачи
+    eta.stop(order_id)
     
     # Получаем клиента
     cursor.execute('SELECT user_id FROM users WHERE id = ?', (order['client_id'],))
@@ -3158,9 +3497,7 @@ def complete_order_callback(call):
         client_text += f"Спасибо за использование нашего сервиса!\n\n"
         client_text += "Пожалуйста, оцените поездку:"
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        for i in range(1, 6):
-            markup.add(telebot.types.InlineKeyboardButton(f"⭐ {i}", callback_data=f"rate:{order_id}:{i}"))
+        markup = get_rating_keyboard(order_id)
         
         bot.send_message(
             client_user_id,
@@ -3172,7 +3509,8 @@ def complete_order_callback(call):
     # Уведомляем админа
     send_to_admins(
         f"✅ Заказ #{client_order_number} (ID: {order_id}) завершен водителем {driver['first_name']} ({driver['car_number']}).\n"
-        f"Сумма: {order['price']} руб."
+        f"Сумма: {order['price']} руб.",
+        category='order_completed'
     )
 
 # Обработчик "Мой заработок" для водителей
@@ -3191,26 +3529,13 @@ def driver_earnings(message):
         )
         return
     
-    # Получаем заработок водителя
+    # Получаем заработок водителя (сутки и месяц - по местному времени)
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Общий заработок
-    cursor.execute('SELECT SUM(amount) FROM earnings WHERE driver_id = ?', (driver['id'],))
-    total_earnings = cursor.fetchone()[0] or 0
-    
-    # Заработок за текущий месяц
-    now = datetime.datetime.now(datetime.timezone.utc)
-    start_of_month = datetime.datetime(now.year, now.month, 1, tzinfo=datetime.timezone.utc).isoformat()
-    cursor.execute('SELECT SUM(amount) FROM earnings WHERE driver_id = ? AND date >= ?', (driver['id'], start_of_month))
-    monthly_earnings = cursor.fetchone()[0] or 0
-    
-    # Заработок за сегодня
-    start_of_day = datetime.datetime.combine(now.date(), datetime.time.min, tzinfo=datetime.timezone.utc).isoformat()
-    cursor.execute('SELECT SUM(amount) FROM earnings WHERE driver_id = ? AND date >= ?', (driver['id'], start_of_day))
-    daily_earnings = cursor.fetchone()[0] or 0
-    
+    earnings = repository.get_driver_earnings(conn, driver['id'])
     conn.close()
+    total_earnings = earnings['total']
+    monthly_earnings = earnings['month']
+    daily_earnings = earnings['day']
     
     # Формируем сообщение
     earnings_text = f"💰 <b>Ваш заработок</b>\n\n"
@@ -3225,54 +3550,12 @@ def driver_earnings(message):
         reply_markup=get_driver_keyboard()
     )
 
-# Запуск бота
+# Замер времени всех зарегистрированных обработчиков
+metrics.instrument_bot(bot)
+# Отсев повторных апдейтов и двойных нажатий
+install_dedupe(bot)
+
+# Запуск бота (общий запускатель в main.py)
 if __name__ == "__main__":
-    logger.info("Запуск бота Такси Светлогорск39")
-    
-    # Инициализация базы данных
-    init_db()
-    
-    # Установка команд бота
-    bot.set_my_commands([
-        telebot.types.BotCommand("/start", "Начать работу с ботом"),
-        telebot.types.BotCommand("/help", "Показать справку"),
-        telebot.types.BotCommand("/order", "Заказать такси"),
-        telebot.types.BotCommand("/profile", "Ваш профиль"),
-        telebot.types.BotCommand("/driver", "Меню водителя"),
-        telebot.types.BotCommand("/admin", "Админ-панель (только для администраторов)")
-    ])
-    
-    # Получение информации о боте
-    bot_info = bot.get_me()
-    logger.info(f"Бот запущен: @{bot_info.username} ({bot_info.first_name})")
-    
-    # Запуск бота
-    try:
-        logger.info("Бот начал прослушивание сообщений")
-        
-        # Бесконечный цикл с обработкой ошибок
-        backoff = 5
-        while True:
-            try:
-                bot.polling(none_stop=True, interval=1, timeout=30, long_polling_timeout=30)
-                backoff = 5  # сброс после успешного цикла
-            except Exception as e:
-                msg = str(e)
-                if 'Conflict: terminated by other getUpdates request' in msg or '409' in msg:
-                    logger.error("Конфликт 409: уже запущен другой экземпляр бота. Останавливаю текущий.")
-                    break
-                logger.error(f"Ошибка при polling: {e}")
-                logger.info(f"Перезапуск polling через {backoff} секунд...")
-                import time
-                time.sleep(backoff)
-                backoff = min(backoff * 2, 60)
-                continue
-                
-    except KeyboardInterrupt:
-        logger.info("Бот остановлен пользователем")
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
-        import traceback
-        logger.error(f"Трассировка: {traceback.format_exc()}")
-    finally:
-        logger.info("Бот завершил работу")
+    import main
+    main.launch(bot=bot)
@@ -0,0 +1,19 @@
+"""
+Общие фикстуры тестов.
+"""
+import os
+import sys
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from loadtest import UpdateFactory
+
+
+@pytest.fixture(scope='session')
+def updates():
+    """Один на все тесты: taxi_bot отбрасывает повторные update_id как дубли"""
+    return UpdateFactory()
@@ -0,0 +1,65 @@
+"""
+Индекс подсказок адресов (app/utils/addresses.py).
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils.addresses import AddressIndex
+
+
+def open_db(path):
+    conn = repository.connect(str(path))
+    repository.ensure_schema(conn)
+    conn.executemany(
+        "INSERT INTO orders (client_id, from_address, to_address, status) VALUES (1, ?, ?, 'COMPLETED')",
+        [
+            ('Светлогорск, ул. Морская, 5', 'Аэропорт Храброво'),
+            ('Светлогорск, ул. Морская, 5', 'г.Калининград, ул. Ленина, 1'),
+            ('Светлогорск, ул. Ленина, 12', 'г.Зеленоградск'),
+        ],
+    )
+    conn.commit()
+    return conn
+
+
+def test_load_matches_incremental_add(tmp_path):
+    conn = open_db(tmp_path / 'taxi.db')
+    index = AddressIndex()
+    index.load(conn)
+    conn.close()
+
+    assert index._entries == sorted(index._entries)
+    assert index.complete('морск')[0] == 'Светлогорск, ул. Морская, 5'
+    assert 'г.Калининград, ул. Ленина, 1' in index.complete('ленина')
+
+    index.add('Светлогорск, ул. Ленина, 12', 'Светлогорск, ул. Ленина, 12')
+    assert index._entries == sorted(index._entries)
+    assert index.complete('ленина')[0] == 'Светлогорск, ул. Ленина, 12'
+
+
+def test_not_loaded_index_is_empty():
+    index = AddressIndex()
+    index.add('Светлогорск, ул. Морская, 5')
+    assert index.complete('морск') == []
+
+
+def test_refresh_adds_only_new_orders(tmp_path):
+    conn = open_db(tmp_path / 'taxi.db')
+    index = AddressIndex()
+    index.load(conn)
+    conn.execute(
+        "INSERT INTO orders (client_id, from_address, to_address, status) "
+        "VALUES (1, 'Светлогорск, ул. Ленина, 12', 'Светлогорск, ул. Ленина, 12', 'NEW')"
+    )
+    conn.commit()
+
+    assert index.refresh(conn) == 1
+    assert index.refresh(conn) == 0
+    conn.close()
+    assert index.complete('ленина')[0] == 'Светлогорск, ул. Ленина, 12'
+    assert index._addresses['светлогорск ленина 12'][1] == 3
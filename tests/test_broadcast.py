@@ -0,0 +1,51 @@
+"""
+Склейка уведомлений одного получателя (app/utils/broadcast.py).
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from telebot import types
+
+from app.utils.broadcast import Notification, dedupe_notifications
+
+
+def keyboard(*buttons):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(*buttons)
+    return markup
+
+
+def test_repeated_text_is_sent_once():
+    merged = dedupe_notifications([Notification(1, 'Заказ отменен'), Notification(1, 'Заказ отменен')])
+    assert [item.text for item in merged] == ['Заказ отменен']
+
+
+def test_contained_text_is_not_dropped():
+    merged = dedupe_notifications([Notification(1, 'Заказ #12 отменен'), Notification(1, 'Заказ #1')])
+    assert [item.text for item in merged] == ['Заказ #12 отменен\n\nЗаказ #1']
+
+
+def test_different_keyboards_are_not_merged():
+    client = {'parse_mode': 'HTML', 'reply_markup': keyboard('🚕 Заказать такси')}
+    driver = {'parse_mode': 'HTML', 'reply_markup': keyboard('🚗 Изменить статус')}
+    merged = dedupe_notifications([
+        Notification(1, 'Клиенту', client),
+        Notification(1, 'Водителю', driver),
+        Notification(1, 'Еще клиенту', {'parse_mode': 'HTML', 'reply_markup': keyboard('🚕 Заказать такси')}),
+    ])
+    assert [(item.text, item.kwargs['reply_markup']) for item in merged] == [
+        ('Клиенту\n\nЕще клиенту', client['reply_markup']),
+        ('Водителю', driver['reply_markup']),
+    ]
+
+
+def test_merged_text_respects_limit():
+    items = [Notification(1, str(i) * 30) for i in range(10)]
+    merged = dedupe_notifications(items, limit=100)
+    assert all(len(item.text) <= 100 for item in merged)
+    assert len(merged) == 4
+    assert '\n\n'.join(item.text for item in merged) == '\n\n'.join(item.text for item in items)
@@ -0,0 +1,114 @@
+"""
+Распознавание города назначения, набранного текстом.
+
+Улицы Светлогорска похожи на названия городов области ("ул. Балтийская" и
+г.Балтийск), поэтому они не сопоставляются нечетко, а любое неточное
+совпадение бот переспрашивает у клиента.
+"""
+import os
+import sys
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.utils.addresses import destinations
+from loadtest import FakeTelegramAPI
+
+CLIENT = 1001
+
+
+@pytest.mark.parametrize('text', [
+    'ул. Балтийская',
+    'ул. Пионерская',
+    'ул. Морская',
+    'Балтийская',
+    'балт',
+    'пионерская',
+])
+def test_city_streets_are_not_destinations(text):
+    assert destinations.exact(text) is None
+    assert destinations.match(text) is None
+
+
+@pytest.mark.parametrize('text, name', [
+    ('г.Калининград', 'г.Калининград'),
+    ('калининград', 'г.Калининград'),
+    ('храброво', 'Аэропорт Храброво'),
+    ('Пионерский', 'г.Пионерский'),
+    ('пос. Морское', 'пос. Морское'),
+])
+def test_exact_names(text, name):
+    assert destinations.exact(text) == name
+    assert destinations.match(text) == name
+
+
+@pytest.mark.parametrize('text, name', [
+    ('калиниград', 'г.Калининград'),
+    ('зеленоградкс', 'г.Зеленоградск'),
+    ('куршкая коса', 'Куршская коса'),
+])
+def test_typos_are_only_guesses(text, name):
+    assert destinations.exact(text) is None
+    assert destinations.match(text) == name
+
+
+@pytest.mark.parametrize('text', ['балтиск', 'хроброво', 'москва'])
+def test_single_word_threshold(text):
+    assert destinations.match(text) is None
+
+
+@pytest.fixture
+def taxi(tmp_path, monkeypatch, updates):
+    # taxi_bot открывает taxi.db в рабочем каталоге
+    monkeypatch.chdir(tmp_path)
+    api = FakeTelegramAPI().install()
+    import taxi_bot
+    taxi_bot.bot.threaded = False
+    taxi_bot.init_db()
+    taxi_bot.user_order_data.pop(CLIENT, None)
+    yield taxi_bot, api, updates
+    taxi_bot.bot.clear_step_handler_by_chat_id(CLIENT)
+    taxi_bot.user_order_data.pop(CLIENT, None)
+
+
+def enter_destination(taxi, *texts):
+    """Отправляет ответы клиента на шаге выбора точки Б, возвращает последний ответ бота"""
+    taxi_bot, api, updates = taxi
+    taxi_bot.user_order_data[CLIENT] = {'from_address': 'Светлогорск, ул. Ленина, 1'}
+    taxi_bot.bot.register_next_step_handler_by_chat_id(CLIENT, taxi_bot.process_to_address)
+    for text in texts:
+        taxi_bot.bot.process_new_updates([updates.message(CLIENT, text)])
+    return api.inbox[CLIENT][-1].text
+
+
+def test_street_with_house_is_not_taken_for_a_city(taxi):
+    taxi_bot, api, _ = taxi
+    reply = enter_destination(taxi, 'ул. Балтийская, 5')
+    assert 'выберите город назначения' in reply
+    assert 'to_address' not in taxi_bot.user_order_data[CLIENT]
+
+
+def test_typo_is_confirmed_before_use(taxi):
+    taxi_bot, api, _ = taxi
+    reply = enter_destination(taxi, 'калиниград, ул. Ленина 1')
+    assert reply == 'Вы имели в виду «г.Калининград»?'
+    assert 'to_address' not in taxi_bot.user_order_data[CLIENT]
+
+    enter_destination(taxi, 'калиниград, ул. Ленина 1', '✅ Да')
+    assert taxi_bot.user_order_data[CLIENT]['to_address'] == 'г.Калининград, ул. Ленина 1'
+
+
+def test_rejected_guess_asks_again(taxi):
+    taxi_bot, api, _ = taxi
+    reply = enter_destination(taxi, 'калиниград, ул. Ленина 1', '❌ Нет')
+    assert 'введите адрес еще раз' in reply
+    assert 'to_address' not in taxi_bot.user_order_data[CLIENT]
+
+
+def test_exact_city_needs_no_confirmation(taxi):
+    taxi_bot, api, _ = taxi
+    enter_destination(taxi, 'Калининград, ул. Ленина 1')
+    assert taxi_bot.user_order_data[CLIENT]['to_address'] == 'г.Калининград, ул. Ленина 1'
@@ -0,0 +1,68 @@
+"""
+Слежение за временем подачи (app/utils/eta.py): просроченные слежения
+снимаются потоком записи LocationTracker.
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils.eta import EtaNotifier
+from app.utils.geo import LocationTracker
+
+PICKUP = (54.94, 20.15)
+
+
+class FakeBot:
+    """Запоминает отправленные сообщения"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent))
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def make_notifier(tmp_path, **kwargs):
+    path = str(tmp_path / 'taxi.db')
+    conn = repository.connect(path)
+    repository.ensure_schema(conn)
+    conn.close()
+    connect = lambda: repository.connect(path)
+    tracker = LocationTracker(connect=connect)
+    return EtaNotifier(FakeBot(), tracker, connect=connect, **kwargs), tracker
+
+
+def test_tracker_sweep_stops_expired_watches(tmp_path):
+    eta, tracker = make_notifier(tmp_path, watch_seconds=60)
+    try:
+        eta.start(1, 1001, 7, 'Заказ 1\n', pickup=PICKUP)
+        eta.start(2, 1002, 8, 'Заказ 2\n', pickup=PICKUP)
+        eta._watches[1].started -= 120
+
+        tracker.sweep()
+
+        assert set(eta._watches) == {2}
+        assert set(eta._by_driver) == {8}
+    finally:
+        tracker.stop()
+
+
+def test_stop_all_only_given_orders(tmp_path):
+    eta, tracker = make_notifier(tmp_path)
+    try:
+        eta.start(1, 1001, 7, 'Заказ 1\n', pickup=PICKUP)
+        eta.start(2, 1002, 8, 'Заказ 2\n', pickup=PICKUP)
+
+        assert eta.stop_all([1, 3]) == 1
+        assert set(eta._watches) == {2}
+    finally:
+        tracker.stop()
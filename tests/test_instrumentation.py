@@ -0,0 +1,36 @@
+"""
+Учет запросов (app/database/instrumentation.py).
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import instrumentation
+from app.database.instrumentation import normalize_sql, query_summary, record_query, reset_query_stats
+
+
+def test_in_lists_share_one_key():
+    keys = {
+        normalize_sql('SELECT * FROM orders WHERE id IN (' + ', '.join('?' * n) + ')')
+        for n in range(1, 50)
+    }
+    assert keys == {'SELECT * FROM orders WHERE id IN (?, ...)'}
+
+
+def test_multi_row_values_share_one_key():
+    assert normalize_sql('INSERT INTO t (a, b) VALUES (?, ?), (?, ?)') == \
+        normalize_sql('INSERT INTO t (a, b)\n VALUES (?, ?), (?, ?), (?, ?)')
+
+
+def test_number_of_keys_is_capped(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'MAX_QUERY_KEYS', 3)
+    reset_query_stats()
+    for i in range(10):
+        record_query(f'SELECT {i}', 0.001)
+    summary = {row['sql']: row['count'] for row in query_summary(limit=100)}
+    reset_query_stats()
+    assert len(summary) == 4
+    assert summary[instrumentation.OTHER_QUERIES] == 7
@@ -0,0 +1,90 @@
+"""
+Кэш Telegram ID -> водитель в LocationTracker (app/utils/geo.py).
+"""
+import os
+import time
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils.geo import LocationTracker
+
+CLIENT = 1001
+DRIVER = 2001
+
+
+class CountingConnect:
+    """Открывает соединения с базой и считает их"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return repository.connect(self.path)
+
+
+def make_tracker(tmp_path, **kwargs):
+    conn = repository.connect(str(tmp_path / 'taxi.db'))
+    repository.ensure_schema(conn)
+    conn.execute(
+        "INSERT INTO drivers (id, user_id, first_name, license_number, car_registration, car_number, is_approved) "
+        "VALUES (1, ?, 'Иван', '-', '-', '-', 0)",
+        (DRIVER,)
+    )
+    conn.commit()
+    conn.close()
+    connect = CountingConnect(tmp_path / 'taxi.db')
+    return LocationTracker(connect=connect, **kwargs), connect
+
+
+def test_client_lookup_is_cached(tmp_path):
+    tracker, connect = make_tracker(tmp_path)
+
+    assert tracker.driver_id_for(CLIENT) is None
+    assert tracker.driver_id_for(CLIENT) is None
+    assert connect.calls == 1
+
+
+def test_miss_expires(tmp_path):
+    tracker, connect = make_tracker(tmp_path, not_driver_seconds=0)
+
+    assert tracker.driver_id_for(CLIENT) is None
+    assert tracker.sweep() == 1
+    assert tracker.driver_id_for(CLIENT) is None
+    assert connect.calls == 2
+
+
+def test_approval_clears_miss(tmp_path):
+    tracker, connect = make_tracker(tmp_path)
+    assert tracker.driver_id_for(DRIVER) is None
+
+    conn = connect()
+    conn.execute('UPDATE drivers SET is_approved = 1 WHERE user_id = ?', (DRIVER,))
+    conn.commit()
+    conn.close()
+    assert tracker.driver_id_for(DRIVER) is None
+
+    tracker.forget_user(DRIVER)
+    assert tracker.driver_id_for(DRIVER) == 1
+
+
+def test_refresh_loads_points_of_previous_leader(tmp_path):
+    tracker, connect = make_tracker(tmp_path)
+    conn = connect()
+    conn.execute('INSERT INTO driver_locations (driver_id, lat, lon, updated_ts) VALUES (1, 54.94, 20.15, ?)',
+                 (time.time(),))
+    conn.commit()
+    assert tracker.load(conn) == 1
+
+    # Прежний ведущий записал новую точку после прогрева резерва
+    conn.execute('UPDATE driver_locations SET lat = 54.95, updated_ts = ? WHERE driver_id = 1', (time.time() + 1,))
+    conn.commit()
+    assert tracker.refresh(conn) == 1
+    assert tracker.refresh(conn) == 0
+    conn.close()
+    assert tracker.get(1).lat == 54.95
@@ -0,0 +1,90 @@
+"""
+Уведомления администраторов (app/utils/notifications.py): склейка
+событий сводки, разбиение сводки по сообщениям и политики категорий.
+"""
+import os
+import sys
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils import notifications
+from app.utils.broadcast import BroadcastResult
+from app.utils.notifications import DIGEST, IMMEDIATE, MESSAGE_LIMIT, OFF, NotificationRouter, PendingEvent
+
+ADMIN = 916948327
+
+
+class FakeBroadcaster:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, items):
+        self.sent.extend(items)
+        return BroadcastResult(total=len(items), sent=len(items))
+
+
+@pytest.fixture
+def router(tmp_path):
+    path = str(tmp_path / 'taxi.db')
+    conn = repository.connect(path)
+    repository.ensure_schema(conn)
+    conn.close()
+    router = NotificationRouter(None, FakeBroadcaster(), lambda: [ADMIN], connect=lambda: repository.connect(path),
+                                interval=3600)
+    yield router
+    router.stop()
+
+
+def test_events_with_same_key_are_merged(router):
+    router._enqueue(ADMIN, 'driver_status', 7, 'Иван: на линии', 100)
+    router._enqueue(ADMIN, 'driver_status', 8, 'Петр: на линии', 110)
+    router._enqueue(ADMIN, 'driver_status', 7, 'Иван: перерыв', 120)
+    router._enqueue(ADMIN, 'order_completed', None, 'Заказ 1', 130)
+    router._enqueue(ADMIN, 'order_completed', None, 'Заказ 1', 140)
+
+    events = list(router._pending[ADMIN].values())
+    assert [(event.text, event.count, event.first_ts) for event in events] == [
+        ('Петр: на линии', 1, 110),
+        ('Иван: перерыв', 2, 100),
+        ('Заказ 1', 1, 130),
+        ('Заказ 1', 1, 140),
+    ]
+    assert router.pending_count(ADMIN) == 4
+
+
+def test_digest_is_split_by_message_limit(router):
+    events = [PendingEvent('driver_status', f"Водитель {i}: " + 'x' * 90, 0) for i in range(100)]
+    events.append(PendingEvent('order_completed', 'Заказ 1', 0, count=3))
+
+    messages = router.digest_messages(events, now=600)
+
+    assert len(messages) > 1
+    assert all(len(message) <= MESSAGE_LIMIT for message in messages)
+    assert messages[0].startswith("🔔 <b>Сводка за 10 мин</b>")
+    text = ''.join(messages)
+    assert all(f"Водитель {i}:" in text for i in range(100))
+    assert "• Заказ 1 (×3)" in text
+
+
+def test_flush_sends_one_digest_per_admin(router):
+    router._enqueue(ADMIN, 'driver_status', 7, 'Иван: на линии', 100)
+    assert router.flush() == 1
+    assert router.pending_count() == 0
+    assert router.broadcaster.sent[0].chat_id == ADMIN
+
+
+@pytest.mark.parametrize('category', notifications.ACTION_CATEGORIES)
+def test_action_categories_are_not_digested(router, category):
+    with pytest.raises(ValueError):
+        router.set_policy(ADMIN, category, DIGEST)
+    router.set_policy(ADMIN, category, OFF)
+    assert router.policy(ADMIN, category) == OFF
+
+    # Сводка, сохраненная до ограничения, работает как отправка сразу
+    router._load_settings()[ADMIN, category] = DIGEST
+    assert router.policy(ADMIN, category) == IMMEDIATE
@@ -0,0 +1,113 @@
+"""
+Ответы клиента и администратора на цену: принятый или назначенный заказ
+не откатывается в DECLINED поздним нажатием кнопки.
+"""
+import itertools
+import os
+import sys
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import ADMIN_ID
+from loadtest import FakeTelegramAPI
+
+CLIENT = 1001
+ORDER_ID = 1
+# Каждое нажатие - под новым сообщением, иначе его отсеет окно двойных нажатий
+message_ids = itertools.count(700_000)
+
+
+class AnswerRecorder(FakeTelegramAPI):
+    """FakeTelegramAPI, запоминающий тексты answerCallbackQuery"""
+
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        if url.endswith('/answerCallbackQuery'):
+            self.answers.append((params or {}).get('text'))
+        return super().__call__(method, url, params, files, **kwargs)
+
+
+@pytest.fixture
+def taxi(tmp_path, monkeypatch, updates):
+    # taxi_bot открывает taxi.db в рабочем каталоге
+    monkeypatch.chdir(tmp_path)
+    api = AnswerRecorder().install()
+    import taxi_bot
+    taxi_bot.bot.threaded = False
+    taxi_bot.init_db()
+    conn = taxi_bot.get_db_connection()
+    conn.execute("INSERT INTO users (id, user_id, first_name) VALUES (1, ?, 'Клиент')", (CLIENT,))
+    conn.commit()
+    conn.close()
+    yield taxi_bot, api, updates
+
+
+def set_order(taxi_bot, status):
+    conn = taxi_bot.get_db_connection()
+    conn.execute('DELETE FROM orders')
+    conn.execute(
+        "INSERT INTO orders (id, client_id, from_address, to_address, price, counter_offer, status) "
+        "VALUES (?, 1, 'Светлогорск, ул. Ленина, 1', 'г.Калининград', 500, 450, ?)",
+        (ORDER_ID, status)
+    )
+    conn.commit()
+    conn.close()
+
+
+def order_status(taxi_bot):
+    conn = taxi_bot.get_db_connection()
+    status = conn.execute('SELECT status FROM orders WHERE id = ?', (ORDER_ID,)).fetchone()[0]
+    conn.close()
+    return status
+
+
+def press(taxi, user_id, data):
+    taxi_bot, api, updates = taxi
+    taxi_bot.bot.process_new_updates([updates.callback(user_id, next(message_ids), data)])
+
+
+@pytest.mark.parametrize('user_id, data', [
+    (CLIENT, f"decline_price:{ORDER_ID}"),
+    (ADMIN_ID, f"decline_counter_offer:{ORDER_ID}"),
+])
+@pytest.mark.parametrize('status', ['ACCEPTED', 'IN_PROGRESS'])
+def test_late_decline_keeps_order(taxi, user_id, data, status):
+    taxi_bot, api, _ = taxi
+    set_order(taxi_bot, status)
+
+    press(taxi, user_id, data)
+
+    assert order_status(taxi_bot) == status
+    assert api.answers[-1] == "Цена по этому заказу уже принята"
+
+
+def test_decline_offered_price(taxi):
+    taxi_bot, api, _ = taxi
+    set_order(taxi_bot, 'PRICE_OFFERED')
+
+    press(taxi, CLIENT, f"decline_price:{ORDER_ID}")
+
+    assert order_status(taxi_bot) == 'DECLINED'
+
+
+@pytest.mark.parametrize('status, answer', [
+    ('ACCEPTED', "Цена по этому заказу уже принята"),
+    ('COMPLETED', "Цена по этому заказу уже принята"),
+    ('DECLINED', "Заказ больше не доступен"),
+    ('CANCELLED', "Заказ больше не доступен"),
+])
+def test_accept_answer_depends_on_status(taxi, status, answer):
+    taxi_bot, api, _ = taxi
+    set_order(taxi_bot, status)
+
+    press(taxi, CLIENT, f"accept_price:{ORDER_ID}")
+
+    assert order_status(taxi_bot) == status
+    assert api.answers[-1] == answer
@@ -0,0 +1,50 @@
+"""
+Разбор цен пачкой (taxi_bot.parse_price_batch).
+"""
+import os
+import sys
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from taxi_bot import parse_price_batch
+
+
+@pytest.mark.parametrize('text', [
+    '12:800 15:1200',
+    '12:800, 15:1200',
+    '12:800;15:1200',
+    '12 : 800\n15=1200',
+    '  12=800 ,  15 = 1200  ',
+])
+def test_separators(text):
+    assert parse_price_batch(text) == ({12: 800.0, 15: 1200.0}, [])
+
+
+def test_decimal_price():
+    assert parse_price_batch('7:450.5') == ({7: 450.5}, [])
+
+
+@pytest.mark.parametrize('text, errors', [
+    ('12:0', ['12:0']),
+    ('12:-5', ['12:-5']),
+    ('12:abc', ['12:abc']),
+    ('800', ['800']),
+    ('12:800,5', ['5']),
+])
+def test_invalid_tokens(text, errors):
+    assert parse_price_batch(text)[1] == errors
+
+
+def test_duplicate_id_is_an_error():
+    prices, errors = parse_price_batch('12:800 15:1000 12:900')
+    assert prices == {12: 800.0, 15: 1000.0}
+    assert errors == ['12:900 (ID 12 указан дважды)']
+
+
+def test_empty_text():
+    assert parse_price_batch('') == ({}, [])
+    assert parse_price_batch(None) == ({}, [])
@@ -0,0 +1,262 @@
+"""
+Бюджеты SQL-запросов обработчиков app/handlers.
+
+Каждый обработчик прогоняется через bot.process_new_updates на заполненной
+базе во временном каталоге; Bot API подменен FakeTelegramAPI из loadtest.py.
+Подготовительные апдейты (открыть диалог, ввести предыдущие шаги) не
+считаются, последний апдейт сценария выполняется внутри строгого
+query_budget - так ловятся N+1 и лишние перечитывания.
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from telebot import types
+
+from app.database import repository
+from app.database.instrumentation import instrument_engine, query_budget
+from app.database.models import Session, engine
+from app.handlers.driver_handlers import driver_registration_data
+from app.handlers.order_handlers import user_order_data
+from app.utils import addresses, statistics
+from config import ADMIN_ID
+from loadtest import FakeTelegramAPI, UpdateFactory
+
+CLIENT = 1001
+DRIVER = 2001
+PENDING_DRIVER = 2002
+NEWCOMER = 3001
+
+# Заказы заполненной базы: id -> (статус, водитель, цена)
+ORDERS = {
+    1: ('NEW', None, None),
+    2: ('PRICE_OFFERED', None, 500),
+    3: ('ACCEPTED', None, 400),
+    4: ('IN_PROGRESS', 1, 300),
+    5: ('COMPLETED', 1, 200),
+}
+
+
+def seed(conn):
+    now = datetime.datetime.utcnow().isoformat(' ')
+    conn.executemany(
+        'INSERT INTO users (id, user_id, first_name, registration_date) VALUES (?, ?, ?, ?)',
+        [(1, CLIENT, 'Клиент', now), (2, ADMIN_ID, 'Админ', now), (3, DRIVER, 'Водитель', now)],
+    )
+    conn.executemany(
+        '''INSERT INTO drivers (id, user_id, first_name, license_number, car_registration,
+                                car_number, car_photos, status, is_approved, registration_date)
+           VALUES (?, ?, ?, '77 00 000000', 'ПТС', ?, '[]', ?, ?, ?)''',
+        [
+            (1, DRIVER, 'Иван', 'А001АА39', 'ON_DUTY', 1, now),
+            (2, PENDING_DRIVER, 'Петр', 'В002ВВ39', 'OFF_DUTY', 0, now),
+        ],
+    )
+    for order_id, (status, driver_id, price) in ORDERS.items():
+        conn.execute(
+            '''INSERT INTO orders (id, client_id, driver_id, from_address, to_address,
+                                   price, status, created_at, completed_at)
+               VALUES (?, 1, ?, 'ул. Ленина, 1', 'Аэропорт Храброво', ?, ?, ?, ?)''',
+            (order_id, driver_id, price, status, now, now if status == 'COMPLETED' else None),
+        )
+    conn.execute('INSERT INTO earnings (driver_id, order_id, amount, date) VALUES (1, 5, 200, ?)', (now,))
+    conn.commit()
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    # repository открывает относительный taxi.db, а движок SQLAlchemy
+    # запомнил абсолютный путь при импорте - сессии привязываются к своему
+    monkeypatch.chdir(tmp_path)
+    test_engine = instrument_engine(create_engine(f"sqlite:///{tmp_path / 'taxi.db'}"))
+    Session.remove()
+    Session.configure(bind=test_engine)
+    conn = repository.connect()
+    repository.ensure_schema(conn)
+    seed(conn)
+    # Как main.launch: индекс подсказок загружается при запуске
+    addresses.index.load(conn)
+    conn.close()
+    statistics.cache.invalidate()
+    user_order_data.clear()
+    driver_registration_data.clear()
+
+    import main
+    bot = main.build_app_bot()
+    bot.threaded = False
+    api = FakeTelegramAPI().install()
+    yield Runner(bot, api)
+
+    Session.remove()
+    Session.configure(bind=engine)
+    test_engine.dispose()
+
+
+class Runner:
+    """Отправляет апдейты боту от имени пользователей"""
+
+    def __init__(self, bot, api):
+        self.bot = bot
+        self.api = api
+        self.updates = UpdateFactory()
+        self._message_ids = iter(range(500_000, 600_000))
+
+    def _message_update(self, user_id, **fields):
+        update = self.updates.message(user_id, '')
+        raw = {
+            'message_id': next(self._message_ids),
+            'date': update.message.date,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"U{user_id}"},
+        }
+        raw.update(fields)
+        return types.Update.de_json({'update_id': update.update_id, 'message': raw})
+
+    def build(self, step):
+        kind, user_id, *args = step
+        if kind == 'msg':
+            return self.updates.message(user_id, args[0])
+        if kind == 'cb':
+            return self.updates.callback(user_id, next(self._message_ids), args[0])
+        if kind == 'photo':
+            photo = {'file_id': f"photo{user_id}", 'file_unique_id': 'u', 'width': 1, 'height': 1}
+            return self._message_update(user_id, photo=[photo])
+        if kind == 'contact':
+            contact = {'phone_number': '+79000000000', 'first_name': 'Клиент', 'user_id': user_id}
+            return self._message_update(user_id, contact=contact)
+        if kind == 'inline':
+            update = self.updates.message(user_id, '')
+            return types.Update.de_json({
+                'update_id': update.update_id,
+                'inline_query': {
+                    'id': str(update.update_id),
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f"U{user_id}"},
+                    'query': args[0],
+                    'offset': '',
+                },
+            })
+        raise ValueError(kind)
+
+    def send(self, step):
+        self.bot.process_new_updates([self.build(step)])
+
+
+def registration(user_id):
+    return [
+        ('cb', user_id, 'start_driver_reg'),
+        ('msg', user_id, 'Сергей'),
+        ('msg', user_id, '39 00 123456'),
+        ('msg', user_id, '39 АА 123456'),
+        ('msg', user_id, 'Е003ЕЕ39'),
+        ('photo', user_id),
+        ('photo', user_id),
+        ('photo', user_id),
+    ]
+
+
+def new_order(*steps):
+    return [
+        ('msg', CLIENT, '/order'),
+        ('msg', CLIENT, 'Светлогорск, ул. Ленина, 5'),
+        *steps,
+    ]
+
+
+# (обработчик, бюджет, подготовка, измеряемый апдейт)
+SCENARIOS = [
+    ('start', 2, [], ('msg', NEWCOMER, '/start')),
+    ('contact_us', 0, [], ('msg', CLIENT, '📞 Связаться с нами')),
+    ('back_to_main_menu', 0, [], ('msg', CLIENT, '🔙 Главное меню')),
+    ('help', 0, [], ('msg', CLIENT, '/help')),
+    ('profile', 2, [], ('msg', CLIENT, '/profile')),
+    ('contact', 2, [], ('contact', CLIENT)),
+
+    ('admin', 0, [], ('msg', ADMIN_ID, '/admin')),
+    ('active_orders', 1, [], ('msg', ADMIN_ID, '📊 Активные заказы')),
+    ('set_price', 0, [], ('cb', ADMIN_ID, 'set_price:1')),
+    ('price_input', 3, [('cb', ADMIN_ID, 'set_price:1')], ('msg', ADMIN_ID, '500')),
+    ('assign_driver', 1, [], ('cb', ADMIN_ID, 'assign_driver:3')),
+    ('select_driver', 5, [], ('cb', ADMIN_ID, 'select_driver:3:1')),
+    ('manage_drivers', 1, [], ('msg', ADMIN_ID, '👨‍✈️ Управление водителями')),
+    ('approve_driver', 2, [], ('cb', ADMIN_ID, 'approve_driver:2')),
+    ('reject_driver', 5, [], ('cb', ADMIN_ID, 'reject_driver:2')),
+    ('order_history', 1, [], ('msg', ADMIN_ID, '📋 История заказов')),
+    ('statistics', 5, [], ('msg', ADMIN_ID, '📈 Статистика')),
+    ('complete_order', 5, [], ('cb', DRIVER, 'complete_order:4')),
+
+    ('driver', 1, [], ('msg', DRIVER, '/driver')),
+    ('driver_unregistered', 1, [], ('msg', NEWCOMER, '/driver')),
+    ('start_driver_reg', 0, [], ('cb', NEWCOMER, 'start_driver_reg')),
+    ('cancel_driver_reg', 0, [], ('cb', NEWCOMER, 'cancel_driver_reg')),
+    ('driver_name', 0, registration(NEWCOMER)[:1], ('msg', NEWCOMER, 'Сергей')),
+    ('driver_photos', 1, registration(NEWCOMER), ('photo', NEWCOMER)),
+    ('change_driver_status', 1, [], ('msg', DRIVER, '🚗 Изменить статус')),
+    ('status_change', 2, [], ('cb', DRIVER, 'status:BUSY')),
+    ('driver_orders', 2, [], ('msg', DRIVER, '📋 Мои заказы')),
+    ('driver_earnings', 2, [], ('msg', DRIVER, '💰 Мой заработок')),
+
+    ('order', 2, [], ('msg', CLIENT, '/order')),
+    ('from_address', 0, new_order()[:1], ('msg', CLIENT, 'Светлогорск, ул. Ленина, 5')),
+    ('to_address', 0, new_order(), ('msg', CLIENT, 'Аэропорт Храброво')),
+    ('custom_to_address', 0, new_order(('msg', CLIENT, '✏️ Ввести другой адрес')), ('msg', CLIENT, 'ул. Мира, 3')),
+    ('comment', 0, new_order(('msg', CLIENT, 'Аэропорт Храброво')), ('msg', CLIENT, '-')),
+    ('inline_query', 0, [], ('inline', CLIENT, 'Лен')),
+    ('confirm_order', 3, new_order(('msg', CLIENT, 'Аэропорт Храброво'), ('msg', CLIENT, '-')),
+     ('cb', CLIENT, 'confirm_order')),
+    ('cancel_order', 0, new_order(('msg', CLIENT, 'Аэропорт Храброво'), ('msg', CLIENT, '-')),
+     ('cb', CLIENT, 'cancel_order')),
+    ('my_orders', 3, [], ('msg', CLIENT, '📝 Мои заказы')),
+    ('rating', 5, [], ('cb', CLIENT, 'rate:5:5')),
+    ('review_comment', 2, [('cb', CLIENT, 'rate:5:5')], ('msg', CLIENT, 'Спасибо')),
+    ('accept_price', 3, [], ('cb', CLIENT, 'accept_price:2')),
+    ('decline_price', 3, [], ('cb', CLIENT, 'decline_price:2')),
+    ('counter_offer', 0, [], ('cb', CLIENT, 'counter_offer:2')),
+    ('counter_offer_input', 2, [('cb', CLIENT, 'counter_offer:2')], ('msg', CLIENT, '450')),
+]
+
+
+@pytest.mark.parametrize(
+    'name, budget, setup, step', SCENARIOS, ids=[scenario[0] for scenario in SCENARIOS],
+)
+def test_handler_query_budget(env, name, budget, setup, step):
+    for prepared in setup:
+        env.send(prepared)
+
+    calls_before = sum(env.api.calls.values())
+    with query_budget(budget, label=name, strict=True) as queries:
+        env.send(step)
+
+    # Обработчик действительно отработал и ответил пользователю
+    assert sum(env.api.calls.values()) > calls_before
+    assert len(queries) <= budget
+
+
+# Переходы заказа, которые пишут журнал order_events: обработчик -> событие
+ORDER_EVENTS = {
+    'price_input': 'PRICE_OFFERED',
+    'select_driver': 'ASSIGNED',
+    'complete_order': 'COMPLETED',
+    'confirm_order': 'CREATED',
+    'rating': 'RATED',
+    'accept_price': 'ACCEPTED',
+    'decline_price': 'DECLINED',
+}
+
+
+@pytest.mark.parametrize('name, event_type', ORDER_EVENTS.items())
+def test_transition_logs_order_event(env, name, event_type):
+    _, _, setup, step = next(scenario for scenario in SCENARIOS if scenario[0] == name)
+    for prepared in [*setup, step]:
+        env.send(prepared)
+
+    conn = repository.connect()
+    rows = conn.execute('SELECT event_type, actor_id FROM order_events').fetchall()
+    conn.close()
+    assert [tuple(row) for row in rows] == [(event_type, step[1])]
@@ -0,0 +1,40 @@
+"""
+Этапы запуска (main.py): команды и имя бота кэшируются в bot_meta.
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import main
+from app.database import repository
+
+
+class FakeBot:
+    def __init__(self, token):
+        self.token = token
+        self.commands_set = 0
+
+    def set_my_commands(self, commands):
+        self.commands_set += 1
+
+
+def open_db(tmp_path):
+    conn = repository.connect(str(tmp_path / 'taxi.db'))
+    repository.ensure_schema(conn)
+    return conn
+
+
+def test_commands_synced_once_per_bot(tmp_path):
+    conn = open_db(tmp_path)
+    first = FakeBot('111:aaa')
+    second = FakeBot('222:bbb')
+
+    assert main.sync_commands(first, conn)
+    assert not main.sync_commands(first, conn)
+    # Новый токен на той же базе
+    assert main.sync_commands(second, conn)
+    assert (first.commands_set, second.commands_set) == (1, 1)
+    conn.close()
@@ -0,0 +1,51 @@
+"""
+Кэш статистики (app/utils/statistics.py): запись во время пересчета не
+оставляет в кэше снимок, снятый до нее.
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils.statistics import StatisticsCache
+
+
+def make_cache(tmp_path):
+    path = str(tmp_path / 'taxi.db')
+    conn = repository.connect(path)
+    repository.ensure_schema(conn)
+    conn.close()
+    calls = []
+
+    def connect():
+        calls.append(path)
+        return repository.connect(path)
+
+    return StatisticsCache(ttl=60, connect=connect), calls
+
+
+def test_snapshot_is_cached(tmp_path):
+    cache, calls = make_cache(tmp_path)
+    assert cache.get() is cache.get()
+    assert len(calls) == 1
+
+
+def test_invalidate_during_recompute(tmp_path):
+    cache, calls = make_cache(tmp_path)
+    connect = cache._connect
+
+    def connect_and_write():
+        # Запись другого потока между началом пересчета и сохранением снимка
+        cache.invalidate()
+        return connect()
+
+    cache._connect = connect_and_write
+    cache.get()
+    cache._connect = connect
+    cache.get()
+    assert len(calls) == 2
+    cache.get()
+    assert len(calls) == 2
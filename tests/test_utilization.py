@@ -0,0 +1,73 @@
+"""
+Перенос интервалов driver_shifts в суточные итоги (app/utils/utilization.py).
+"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.database import repository
+from app.utils import utilization
+
+# 2026-01-15 12:00 по Калининграду: интервалы не пересекают полночь
+NOON = 1768471200
+
+
+class RaceConnection:
+    """Соединение, которое сразу после выборки интервалов запускает roll_up в другом соединении"""
+
+    def __init__(self, conn, other):
+        self._conn = conn
+        self._other = other
+
+    def execute(self, sql, parameters=()):
+        cursor = self._conn.execute(sql, parameters)
+        if sql.startswith('SELECT') and self._other is not None:
+            rows = cursor.fetchall()
+            other, self._other = self._other, None
+            utilization.roll_up(other)
+            return FetchedRows(rows)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class FetchedRows(list):
+    """Строки, уже выбранные из курсора"""
+
+    def fetchall(self):
+        return list(self)
+
+
+def open_db(path):
+    conn = repository.connect(str(path))
+    repository.ensure_schema(conn)
+    conn.execute(
+        "INSERT INTO drivers (id, user_id, first_name, license_number, car_registration, car_number) "
+        "VALUES (1, 2001, 'Иван', '-', '-', '-')"
+    )
+    conn.execute('DELETE FROM driver_shifts')
+    conn.executemany(
+        'INSERT INTO driver_shifts (driver_id, status, started_ts, ended_ts, rolled_up) VALUES (1, ?, ?, ?, 0)',
+        [('ON_DUTY', NOON, NOON + 600), ('ON_ORDER', NOON + 600, NOON + 1800)],
+    )
+    conn.commit()
+    return conn
+
+
+def test_roll_up_counts_each_interval_once(tmp_path):
+    conn = open_db(tmp_path / 'taxi.db')
+    other = repository.connect(str(tmp_path / 'taxi.db'))
+
+    processed = utilization.roll_up(RaceConnection(conn, other))
+
+    assert processed == 0
+    totals = conn.execute('SELECT idle_seconds, busy_seconds FROM driver_shift_daily').fetchall()
+    assert [tuple(row) for row in totals] == [(600, 1200)]
+    assert conn.execute('SELECT COUNT(*) FROM driver_shifts WHERE rolled_up = 0').fetchone()[0] == 0
+    assert utilization.roll_up(conn) == 0
+    other.close()
+    conn.close()